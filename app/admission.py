@@ -0,0 +1,227 @@
+import os
+import math
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional
+
+from app.backend import WORKERS
+from app.batching import BATCH_MAX_SIZE
+from app.metrics import Counter, Gauge, register
+from app.scheduler import current_lane
+
+# 推論與渲染專用的執行緒池，並限制排隊中的請求數；滿載時立即拒絕，而不是讓請求一路排隊到逾時。
+# 使用模型 worker 行程時，預設讓每個 worker 都有一個請求在推論、一個在前處理。
+# 名額與執行緒池依優先權 lane 各自獨立，批次工作佔滿時不會擋住互動請求
+INFER_CONCURRENCY = int(os.getenv("OCR_INFER_CONCURRENCY", str(max(4, BATCH_MAX_SIZE, 2 * WORKERS))))
+INFER_MAX_QUEUE = int(os.getenv("OCR_INFER_MAX_QUEUE", "64"))
+# Retry-After 的上下限（秒）
+RETRY_AFTER_MIN = 1
+RETRY_AFTER_MAX = 60
+
+_DONE = object()
+
+
+class Overloaded(Exception):
+    """
+    執行中與排隊中的請求已達上限；retry_after 為建議的重試秒數
+    """
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """
+    已獲准進入的請求；release() 之前都佔用一個名額（可重複呼叫）
+    """
+
+    def __init__(self, controller: "AdmissionController", lane: str):
+        self._controller = controller
+        self.lane = lane
+        self._started = time.monotonic()
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._controller._release(self.lane, time.monotonic() - self._started)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class AdmissionController:
+    """
+    以名額控制每個 lane 同時進入的請求數（concurrency 個執行中 + max_queue 個排隊中），
+    請求內的阻塞工作透過 call() 交給該 lane 的專用執行緒池，不佔用事件迴圈
+    """
+
+    def __init__(self, concurrency: int, max_queue: int):
+        self.concurrency = max(1, concurrency)
+        self.max_queue = max(0, max_queue)
+        self._executors: Dict[str, ThreadPoolExecutor] = {}
+        self._lock = threading.Lock()
+        self._admitted: Dict[str, int] = {}
+        # 每個請求佔用名額時間的指數移動平均，用來估算 Retry-After
+        self._avg_seconds = 1.0
+        self.counters = {"admitted": 0, "rejected": 0}
+
+    @property
+    def capacity(self) -> int:
+        return self.concurrency + self.max_queue
+
+    def admit(self) -> Ticket:
+        lane = current_lane()[0]
+        with self._lock:
+            admitted = self._admitted.get(lane, 0)
+            if admitted >= self.capacity:
+                self.counters["rejected"] += 1
+                REJECTED.inc()
+                raise Overloaded(
+                    f"服務忙碌中：{self.concurrency} 個請求處理中、{self.max_queue} 個排隊中",
+                    self._retry_after_locked(admitted),
+                )
+            self._admitted[lane] = admitted + 1
+            self.counters["admitted"] += 1
+        return Ticket(self, lane)
+
+    def _release(self, lane: str, seconds: float):
+        with self._lock:
+            self._admitted[lane] -= 1
+            self._avg_seconds = 0.8 * self._avg_seconds + 0.2 * seconds
+
+    def _executor(self, lane: str) -> ThreadPoolExecutor:
+        executor = self._executors.get(lane)
+        if executor is None:
+            with self._lock:
+                executor = self._executors.get(lane)
+                if executor is None:
+                    executor = self._executors[lane] = ThreadPoolExecutor(
+                        max_workers=self.concurrency, thread_name_prefix=f"ocr-infer-{lane}"
+                    )
+        return executor
+
+    def _retry_after_locked(self, admitted: int) -> int:
+        # 排在前面的請求數 / 並行數 × 平均處理時間
+        waves = (admitted - self.concurrency + 1) / self.concurrency
+        seconds = math.ceil(max(waves, 1) * self._avg_seconds)
+        return min(RETRY_AFTER_MAX, max(RETRY_AFTER_MIN, seconds))
+
+    async def call(self, fn: Callable, *args, **kwargs):
+        """
+        在目前 lane 的專用執行緒池中執行阻塞函式（呼叫者需已持有名額）；沿用呼叫端的 contextvars（請求耗時明細）
+        """
+        context = contextvars.copy_context()
+        return await asyncio.wrap_future(
+            self._executor(current_lane()[0]).submit(context.run, functools.partial(fn, *args, **kwargs))
+        )
+
+    def fan_out_limit(self) -> asyncio.Semaphore:
+        """
+        一個請求內多項工作（批次圖片、多個 URL）同時送進執行緒池的上限，與單一 lane 的並行數相同；
+        整個請求只佔一個名額，超出的項目在事件迴圈中等待，不會在執行緒池佇列中堆積到其他請求前面
+        """
+        return asyncio.Semaphore(self.concurrency)
+
+    async def map(self, fn: Callable, arg_tuples: Iterable[tuple]) -> List:
+        """
+        對每組參數在目前 lane 的專用執行緒池中執行 fn（呼叫者需已持有名額），依輸入順序回傳結果；
+        同時執行的項目數受 fan_out_limit() 限制
+        """
+        limit = self.fan_out_limit()
+
+        async def one(args: tuple):
+            async with limit:
+                return await self.call(fn, *args)
+
+        return await asyncio.gather(*(one(args) for args in arg_tuples))
+
+    async def run(self, fn: Callable, *args, **kwargs):
+        """
+        取得名額後在專用執行緒池中執行；滿載時拋出 Overloaded
+        """
+        with self.admit():
+            return await self.call(fn, *args, **kwargs)
+
+    async def iterate(self, ticket: Ticket, iterator: Iterator) -> AsyncIterator:
+        """
+        在專用執行緒池中逐項推進同步產生器（例如逐頁 OCR），結束或客戶端中斷時關閉產生器並釋放名額
+        """
+        executor = self._executor(ticket.lane)
+        pending = None
+        try:
+            while True:
+                pending = executor.submit(contextvars.copy_context().run, next, iterator, _DONE)
+                item = await asyncio.wrap_future(pending)
+                if item is _DONE:
+                    break
+                yield item
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                if pending is not None and not pending.done():
+                    # 仍在工作執行緒中執行，等這一項完成後再關閉
+                    pending.add_done_callback(lambda _: close())
+                else:
+                    close()
+            ticket.release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            admitted = dict(self._admitted)
+            avg = self._avg_seconds
+            counters = dict(self.counters)
+        lanes = {
+            lane: {"in_flight": min(n, self.concurrency), "queued": max(0, n - self.concurrency)}
+            for lane, n in admitted.items()
+        }
+        return {
+            **counters,
+            "concurrency": self.concurrency,
+            "max_queue": self.max_queue,
+            "in_flight": sum(lane["in_flight"] for lane in lanes.values()),
+            "queued": sum(lane["queued"] for lane in lanes.values()),
+            "avg_seconds": round(avg, 3),
+            "lanes": lanes,
+        }
+
+
+REJECTED = register(Counter(
+    "ocr_admission_rejected_total",
+    "Requests rejected with 503 because the inference queue was full",
+))
+
+
+def _collect_depth() -> dict:
+    if _controller is None:
+        return {}
+    stats = _controller.stats()
+    return {("in_flight",): stats["in_flight"], ("queued",): stats["queued"]}
+
+
+register(Gauge(
+    "ocr_admission_requests",
+    "Admitted requests being processed or waiting for an inference worker",
+    _collect_depth,
+    ("state",),
+))
+
+_controller: Optional[AdmissionController] = None
+_controller_lock = threading.Lock()
+
+
+def get_admission() -> AdmissionController:
+    global _controller
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                _controller = AdmissionController(INFER_CONCURRENCY, INFER_MAX_QUEUE)
+    return _controller
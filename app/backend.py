@@ -0,0 +1,696 @@
+import os
+import sys
+import math
+import hashlib
+import contextlib
+import functools
+import tempfile
+import threading
+import time
+import logging
+from typing import Generator, List, Optional, Union
+
+from PIL import Image
+from dotenv import load_dotenv
+
+from app.metrics import stage
+from app.resolution import DEFAULT_MODE, MODES, ResolutionMode
+
+# 初始化
+load_dotenv()
+
+MODEL_ID = os.getenv("DEEPSEEK_OCR_MODEL", "deepseek-ai/DeepSeek-OCR")
+
+# 推論後端：deepseek（預設，真實模型）或 fake（CPU 上的確定性替身，用於壓測與開發）
+BACKEND_NAME = os.getenv("OCR_BACKEND", "deepseek").strip().lower()
+
+# 大於 0 時改為啟動這麼多個模型 worker 行程（每張 GPU 或每段 CPU 一個），API 行程不載入權重
+WORKERS = int(os.getenv("OCR_WORKERS", "0"))
+
+# 記憶體中的圖片需要交給只接受路徑的 model.infer 時，暫存到這個目錄（優先使用 tmpfs）
+SPOOL_DIR = os.getenv("OCR_SPOOL_DIR") or ("/dev/shm" if os.path.isdir("/dev/shm") else None)
+
+# 圖片輸入：檔案路徑或記憶體中的 PIL 圖片
+ImageInput = Union[str, Image.Image]
+
+# 沒有 GPU 時的推論精度：int8（語言模型的 Linear 層動態量化）、bf16、fp32，
+# auto 在 CPU 支援 bf16 指令（AVX512-BF16／AMX）時用 bf16，否則用 int8
+CPU_PRECISION = os.getenv("OCR_CPU_PRECISION", "auto").strip().lower()
+CPU_PRECISIONS = ("auto", "int8", "bf16", "fp32")
+# torch 的 intra-op／inter-op 執行緒數（0 代表沿用 torch 預設）
+CPU_THREADS = int(os.getenv("OCR_CPU_THREADS", "0"))
+CPU_INTEROP_THREADS = int(os.getenv("OCR_CPU_INTEROP_THREADS", "0"))
+
+# 載入模型後先以合成圖片推論一次，讓第一個請求不必負擔初始化與記憶體配置的成本
+WARMUP = os.getenv("OCR_WARMUP", "1") == "1"
+
+# 動態量化時保留原精度的視覺編碼器模組（名稱包含這些字串）
+_VISION_MODULES = ("sam_model", "vision_model", "projector")
+
+# 批次 generate 依 remote code（modeling_deepseekocr）的前處理組出輸入：<image> 佔位 token 的 id、
+# 每個視覺 patch 的像素數與視覺 token 的下採樣倍率，以及需要沿用的前處理函式
+_IMAGE_TOKEN_ID = 128815
+_PATCH_SIZE = 16
+_DOWNSAMPLE_RATIO = 4
+_REMOTE_HELPERS = ("BasicImageTransform", "dynamic_preprocess", "format_messages", "text_encode")
+
+# 呼叫端未指定解析度模式時，後端使用 gundam（原本固定的 base_size=1024, image_size=640, crop_mode=True）
+BACKEND_DEFAULT_MODE = MODES["gundam"]
+# 呼叫端未指定 prompt 時使用
+DEFAULT_PROMPT = "<image>\nFree OCR."
+
+logger = logging.getLogger(__name__)
+
+
+class OCRBackend:
+    """
+    推論後端介面
+
+    `_process_ocr` 只透過這個介面呼叫模型，子類別負責載入與推論。
+    """
+
+    name = "base"
+    # infer_batch 是否以一次補齊長度的 generate 處理整批；False 時整批仍逐張推論，
+    # 微批次只會增加等待時間，沒有吞吐量效益
+    batched_generate = False
+
+    def __init__(self):
+        self._load_lock = threading.Lock()
+        self._loaded = False
+        self.load_error: Optional[str] = None
+        self.load_seconds: Optional[float] = None
+        self.warmup_seconds: Optional[float] = None
+        # 模型權重的推論精度（fp32／bf16／int8）；沒有權重的後端為 None
+        self.precision: Optional[str] = None
+
+    @property
+    def ready(self) -> bool:
+        return self._loaded
+
+    @property
+    def device(self) -> str:
+        return "cpu"
+
+    def load(self) -> "OCRBackend":
+        """
+        載入模型（可重複呼叫，只會真正載入一次）
+        """
+        if self._loaded:
+            return self
+        with self._load_lock:
+            if self._loaded:
+                return self
+            t0 = time.time()
+            try:
+                self._load()
+            except Exception as e:
+                self.load_error = str(e)
+                raise
+            self.load_seconds = round(time.time() - t0, 3)
+            if WARMUP:
+                t1 = time.time()
+                try:
+                    self._warmup()
+                    self.warmup_seconds = round(time.time() - t1, 3)
+                except Exception as e:
+                    logger.warning("模型暖機失敗（不影響服務）: %s", e)
+            self.load_error = None
+            self._loaded = True
+        return self
+
+    def _load(self):
+        raise NotImplementedError
+
+    def _warmup(self):
+        """
+        載入後、開始接受請求前執行一次推論（在 _load_lock 內呼叫，不可再呼叫 load）
+        """
+
+    def load_tokenizer(self):
+        """
+        只載入 count_tokens 需要的 tokenizer（模型在其他行程時使用）
+        """
+
+    def close(self):
+        """
+        釋放後端持有的行程或裝置資源（服務關閉時呼叫）
+        """
+
+    def stats(self) -> Optional[dict]:
+        return None
+
+    def infer(self, image: ImageInput, prompt: str, mode: Optional[ResolutionMode] = None) -> str:
+        """
+        對單張圖片（路徑或 PIL 圖片）以指定解析度模式執行推論，回傳模型解碼後的原始文字
+        """
+        raise NotImplementedError
+
+    def infer_stream(
+        self, image: ImageInput, prompt: str, mode: Optional[ResolutionMode] = None
+    ) -> Generator[str, None, str]:
+        """
+        逐段 yield 模型生成中的文字，產生器的回傳值為與 infer 相同的完整原始文字
+
+        預設整段只 yield 一次，可逐 token 解碼的後端覆寫此方法。
+        """
+        text = self.infer(image, prompt, mode)
+        yield text
+        return text
+
+    def infer_batch(
+        self,
+        images: List[ImageInput],
+        prompts: List[str],
+        modes: Optional[List[Optional[ResolutionMode]]] = None
+    ) -> List[Union[str, Exception]]:
+        """
+        對一批圖片執行推論，依序回傳文字；單張失敗時該位置放入例外而不影響其他圖片
+
+        預設逐張呼叫 infer，支援批次 generate 的後端可覆寫此方法。
+        """
+        modes = modes or [None] * len(images)
+        results = []
+        for image, prompt, mode in zip(images, prompts, modes):
+            try:
+                results.append(self.infer(image, prompt, mode))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def count_tokens(self, text: str) -> int:
+        """
+        模型輸出的 token 數（用於指標）；預設以空白分詞估算
+        """
+        return len(text.split())
+
+    def infer_params(self, mode: Optional[ResolutionMode] = None) -> dict:
+        """
+        影響輸出結果的模型與推論參數（用於結果快取鍵）
+        """
+        mode = mode or BACKEND_DEFAULT_MODE
+        return {
+            "backend": self.name,
+            "model_id": MODEL_ID,
+            "base_size": mode.base_size,
+            "image_size": mode.image_size,
+            "crop_mode": mode.crop_mode,
+        }
+
+    def meta(self) -> dict:
+        return {
+            "device": self.device,
+            "model_id": MODEL_ID,
+            "torch": None,
+            "backend": self.name,
+            "precision": self.precision,
+        }
+
+
+class DeepSeekBackend(OCRBackend):
+    """
+    DeepSeek-OCR 模型（第一次使用時才載入 tokenizer 與權重）
+    """
+
+    name = "deepseek"
+    # 同一解析度模式的圖片以左側補齊的單次 generate 處理；remote code 缺少前處理函式時於載入後改為 False
+    batched_generate = True
+
+    def __init__(self):
+        super().__init__()
+        self.model = None
+        self.tokenizer = None
+        # remote code 的模組（提供批次前處理函式）
+        self._remote = None
+        self._device = None
+        self.cpu_threads = CPU_THREADS
+        self.cpu_interop_threads = CPU_INTEROP_THREADS
+        # 單一模型實例，同一時間只允許一個推論
+        self._infer_lock = threading.Lock()
+
+    @property
+    def device(self) -> str:
+        if self._device is None:
+            import torch
+            self._device = "cuda" if torch.cuda.is_available() else "cpu"
+        return self._device
+
+    def load_tokenizer(self):
+        if self.tokenizer is None:
+            from transformers import AutoTokenizer
+            self.tokenizer = AutoTokenizer.from_pretrained(MODEL_ID, trust_remote_code=True)
+
+    def _load(self):
+        import torch
+        from transformers import AutoModel
+
+        # 載入 tokenizer
+        self.load_tokenizer()
+
+        # 載入模型
+        if self.device == "cuda":
+            try:
+                model = AutoModel.from_pretrained(
+                    MODEL_ID,
+                    trust_remote_code=True,
+                    torch_dtype=torch.bfloat16,
+                    device_map="auto",
+                    attn_implementation="flash_attention_2"
+                )
+            except Exception as e:
+                logger.warning("Flash attention failed: %s, falling back to eager...", e)
+                model = AutoModel.from_pretrained(
+                    MODEL_ID,
+                    trust_remote_code=True,
+                    torch_dtype=torch.bfloat16,
+                    device_map="auto",
+                    attn_implementation="eager"
+                )
+            self.precision = "bf16"
+        else:
+            model = self._load_cpu()
+
+        self.model = model.eval()
+        remote = sys.modules.get(type(model).__module__)
+        if remote is not None and all(hasattr(remote, helper) for helper in _REMOTE_HELPERS):
+            self._remote = remote
+        else:
+            self.batched_generate = False
+            logger.warning("%s 的 remote code 缺少批次前處理函式，infer_batch 改為逐張推論", MODEL_ID)
+
+    def _load_cpu(self):
+        import torch
+        from transformers import AutoModel
+
+        self._configure_cpu_threads()
+        precision = cpu_precision()
+        model = AutoModel.from_pretrained(
+            MODEL_ID,
+            trust_remote_code=True,
+            torch_dtype=torch.bfloat16 if precision == "bf16" else torch.float32,
+            device_map="cpu",
+            # 逐層載入權重，避免載入期間同時持有兩份模型
+            low_cpu_mem_usage=True
+        )
+        if precision == "int8":
+            # 只量化語言模型（含 MoE 專家與 lm_head）的 Linear 層；視覺編碼器的計算量小且對精度較敏感
+            targets = {
+                name for name, module in model.named_modules()
+                if isinstance(module, torch.nn.Linear) and not any(v in name for v in _VISION_MODULES)
+            }
+            model = torch.ao.quantization.quantize_dynamic(model, targets, dtype=torch.qint8, inplace=True)
+            logger.info("已將 %d 個 Linear 層動態量化為 int8", len(targets))
+        self.precision = precision
+        return model
+
+    def _configure_cpu_threads(self):
+        import torch
+
+        if self.cpu_threads > 0:
+            torch.set_num_threads(self.cpu_threads)
+        if self.cpu_interop_threads > 0:
+            try:
+                torch.set_num_interop_threads(self.cpu_interop_threads)
+            except RuntimeError as e:
+                # inter-op 執行緒池只能在第一次平行運算之前設定
+                logger.warning("無法設定 inter-op 執行緒數: %s", e)
+
+    def _warmup(self):
+        mode = MODES.get(DEFAULT_MODE, BACKEND_DEFAULT_MODE)
+        image = Image.new("RGB", (mode.base_size, mode.base_size), "white")
+        with self._infer_lock:
+            self._infer_locked(image, DEFAULT_PROMPT, mode)
+
+    def infer(self, image: ImageInput, prompt: str, mode: Optional[ResolutionMode] = None) -> str:
+        self.load()
+        with self._infer_lock:
+            return self._infer_locked(image, prompt, mode or BACKEND_DEFAULT_MODE)
+
+    def infer_batch(
+        self,
+        images: List[ImageInput],
+        prompts: List[str],
+        modes: Optional[List[Optional[ResolutionMode]]] = None
+    ) -> List[Union[str, Exception]]:
+        # 依解析度模式分組，每組前處理後以一次補齊長度的 generate 推論；
+        # 單張前處理失敗只影響該圖片，批次 generate 失敗時該組改為逐張推論
+        self.load()
+        modes = [mode or BACKEND_DEFAULT_MODE for mode in (modes or [None] * len(images))]
+        groups = {}
+        for i, mode in enumerate(modes):
+            groups.setdefault(mode.name, []).append(i)
+
+        results: List[Union[str, Exception, None]] = [None] * len(images)
+        with self._infer_lock:
+            for indices in groups.values():
+                # 不能組批次的圖片（remote code 缺少前處理函式、該組只有一張、prompt 不是剛好一個 <image>）逐張推論
+                serial, prepared = [], []
+                for i in indices:
+                    if self._remote is None or len(indices) == 1 or prompts[i].count("<image>") != 1:
+                        serial.append(i)
+                        continue
+                    try:
+                        with stage("batch_preprocess"):
+                            prepared.append((i, self._prepare(images[i], prompts[i], modes[i])))
+                    except Exception as e:
+                        results[i] = e
+                if len(prepared) > 1:
+                    try:
+                        texts = self._generate_batch([inputs for _, inputs in prepared])
+                    except Exception as e:
+                        logger.warning("批次 generate 失敗（%d 張），改為逐張推論: %s", len(prepared), e)
+                    else:
+                        for (i, _), text in zip(prepared, texts):
+                            results[i] = text
+                        prepared = []
+                serial.extend(i for i, _ in prepared)
+                for i in serial:
+                    try:
+                        results[i] = self._infer_locked(images[i], prompts[i], modes[i])
+                    except Exception as e:
+                        results[i] = e
+        return results
+
+    def _prepare(self, image: ImageInput, prompt: str, mode: ResolutionMode) -> dict:
+        """
+        與 remote code 的 model.infer 相同的單張前處理：token id、標記視覺 token 位置的遮罩、
+        切片與全域視圖張量，以及切片的行列數
+        """
+        import torch
+        from PIL import ImageOps
+
+        remote = self._remote
+        if isinstance(image, str):
+            with Image.open(image) as f:
+                image = ImageOps.exif_transpose(f).convert("RGB")
+        else:
+            image = image.convert("RGB")
+        conversation = [
+            {"role": "<|User|>", "content": prompt, "images": [image]},
+            {"role": "<|Assistant|>", "content": ""},
+        ]
+        text = remote.format_messages(conversations=conversation, sft_format="plain", system_prompt="")
+        parts = text.split("<image>")
+
+        transform = remote.BasicImageTransform(mean=(0.5, 0.5, 0.5), std=(0.5, 0.5, 0.5), normalize=True)
+        fill = tuple(int(x * 255) for x in transform.mean)
+        crops, crop_ratio = [], (1, 1)
+        if mode.crop_mode:
+            if image.width > 640 or image.height > 640:
+                crops, crop_ratio = remote.dynamic_preprocess(image)
+            global_view = ImageOps.pad(image, (mode.base_size, mode.base_size), color=fill)
+            queries = math.ceil((mode.base_size // _PATCH_SIZE) / _DOWNSAMPLE_RATIO)
+        else:
+            if mode.image_size <= 640:
+                image = image.resize((mode.image_size, mode.image_size))
+            global_view = ImageOps.pad(image, (mode.image_size, mode.image_size), color=fill)
+            queries = math.ceil((mode.image_size // _PATCH_SIZE) / _DOWNSAMPLE_RATIO)
+        image_tokens = ([_IMAGE_TOKEN_ID] * queries + [_IMAGE_TOKEN_ID]) * queries + [_IMAGE_TOKEN_ID]
+        width_crops, height_crops = crop_ratio
+        if width_crops > 1 or height_crops > 1:
+            crop_queries = math.ceil((mode.image_size // _PATCH_SIZE) / _DOWNSAMPLE_RATIO)
+            image_tokens += ([_IMAGE_TOKEN_ID] * (crop_queries * width_crops) + [_IMAGE_TOKEN_ID]) * (crop_queries * height_crops)
+        else:
+            crops = []
+
+        head = remote.text_encode(self.tokenizer, parts[0], bos=False, eos=False)
+        tail = remote.text_encode(self.tokenizer, parts[1], bos=False, eos=False)
+        # 開頭的 0 為 bos
+        input_ids = [0] + head + image_tokens + tail
+        seq_mask = [False] * (1 + len(head)) + [True] * len(image_tokens) + [False] * len(tail)
+        dtype = torch.bfloat16 if self.device == "cuda" else self.model.dtype
+        if crops:
+            images_crop = torch.stack([transform(crop).to(dtype) for crop in crops])
+        else:
+            images_crop = torch.zeros((1, 3, mode.base_size, mode.base_size), dtype=dtype)
+        return {
+            "input_ids": input_ids,
+            "seq_mask": seq_mask,
+            "images": (images_crop, torch.stack([transform(global_view).to(dtype)])),
+            "spatial_crop": [width_crops, height_crops],
+        }
+
+    def _generate_batch(self, prepared: List[dict]) -> List[str]:
+        """
+        左側補齊後以一次 generate 推論整批（呼叫端持有 _infer_lock），依序回傳解碼後的文字；
+        生成參數與 remote code 的 model.infer 相同
+        """
+        import torch
+
+        device = next(self.model.parameters()).device
+        eos_id = self.tokenizer.eos_token_id
+        pad_id = self.tokenizer.pad_token_id if self.tokenizer.pad_token_id is not None else eos_id
+        length = max(len(inputs["input_ids"]) for inputs in prepared)
+        input_ids = torch.full((len(prepared), length), pad_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(prepared), length), dtype=torch.long)
+        seq_mask = torch.zeros((len(prepared), length), dtype=torch.bool)
+        for row, inputs in enumerate(prepared):
+            # 左側補齊，每個序列的最後一個 token 對齊，generate 從同一位置開始接續
+            start = length - len(inputs["input_ids"])
+            input_ids[row, start:] = torch.tensor(inputs["input_ids"], dtype=torch.long)
+            attention_mask[row, start:] = 1
+            seq_mask[row, start:] = torch.tensor(inputs["seq_mask"], dtype=torch.bool)
+
+        autocast = torch.autocast("cuda", dtype=torch.bfloat16) if device.type == "cuda" else contextlib.nullcontext()
+        with stage("batch_generate"), autocast, torch.no_grad():
+            output_ids = self.model.generate(
+                input_ids.to(device),
+                attention_mask=attention_mask.to(device),
+                images=[(crop.to(device), ori.to(device)) for crop, ori in (inputs["images"] for inputs in prepared)],
+                images_seq_mask=seq_mask.to(device),
+                images_spatial_crop=torch.tensor([inputs["spatial_crop"] for inputs in prepared], dtype=torch.long),
+                temperature=0.0,
+                eos_token_id=eos_id,
+                pad_token_id=pad_id,
+                max_new_tokens=8192,
+                no_repeat_ngram_size=35,
+                use_cache=True
+            )
+
+        texts = []
+        for generated in output_ids[:, length:].tolist():
+            # 先結束的序列在 eos 之後補上 pad，截到第一個 eos
+            if eos_id in generated:
+                generated = generated[:generated.index(eos_id)]
+            texts.append(self.tokenizer.decode(generated).strip())
+        return texts
+
+    def infer_stream(
+        self, image: ImageInput, prompt: str, mode: Optional[ResolutionMode] = None
+    ) -> Generator[str, None, str]:
+        from transformers import StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
+
+        self.load()
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=False)
+        cancelled = threading.Event()
+
+        class _Cancelled(StoppingCriteria):
+            def __call__(self, input_ids, scores, **kwargs):
+                return cancelled.is_set()
+
+        generate_kwargs = {"streamer": streamer, "stopping_criteria": StoppingCriteriaList([_Cancelled()])}
+        outcome = {}
+
+        def run():
+            try:
+                outcome["text"] = self._infer_locked(image, prompt, mode or BACKEND_DEFAULT_MODE, generate_kwargs)
+            except BaseException as e:
+                outcome["error"] = e
+                # generate 尚未開始或中途失敗時，讓等待中的串流結束
+                streamer.end()
+
+        with self._infer_lock:
+            # generate 在另一個執行緒中執行，這裡逐段取出 streamer 解碼的文字；
+            # 呼叫端中途關閉產生器時停止生成，並等 generate 結束後才釋放模型
+            thread = threading.Thread(target=run, name="ocr-generate", daemon=True)
+            thread.start()
+            try:
+                eos = self.tokenizer.eos_token or ""
+                for delta in streamer:
+                    if eos:
+                        delta = delta.replace(eos, "")
+                    if delta:
+                        yield delta
+            finally:
+                cancelled.set()
+                thread.join()
+        if "error" in outcome:
+            raise outcome["error"]
+        return outcome["text"]
+
+    def _infer_locked(
+        self, image: ImageInput, prompt: str, mode: ResolutionMode, generate_kwargs: Optional[dict] = None
+    ) -> str:
+        if isinstance(image, str):
+            return self._infer_path(os.path.abspath(image), prompt, mode, generate_kwargs)
+
+        # remote code 的 model.infer 只接受檔案路徑：以無壓縮 BMP 暫存到 tmpfs，
+        # 省去 JPEG/PNG 編碼且不經過實體磁碟
+        fd, spool_path = tempfile.mkstemp(prefix="ocr_", suffix=".bmp", dir=SPOOL_DIR)
+        try:
+            with stage("image_encode"), os.fdopen(fd, "wb") as f:
+                image.save(f, format="BMP")
+            return self._infer_path(spool_path, prompt, mode, generate_kwargs)
+        finally:
+            os.remove(spool_path)
+
+    def _infer_path(
+        self, image_path: str, prompt: str, mode: ResolutionMode, generate_kwargs: Optional[dict] = None
+    ) -> str:
+        # eval_mode=True 時 model.infer 直接回傳 generate 解碼後的文字，
+        # 不寫結果檔也不經過標準輸出；output_path 仍必須存在，給每個請求獨立的暫存目錄
+        if generate_kwargs:
+            # remote code 的 infer 在 eval_mode 下不傳 streamer，暫時在實例上包裝 generate 注入額外參數
+            # （呼叫端持有 _infer_lock，同一時間只有一個推論）
+            generate = self.model.generate
+            self.model.generate = functools.partial(generate, **generate_kwargs)
+        try:
+            with tempfile.TemporaryDirectory(prefix="ocr_") as output_path:
+                outputs = self.model.infer(
+                    self.tokenizer,
+                    prompt=prompt,
+                    image_file=image_path,
+                    output_path=output_path,
+                    base_size=mode.base_size,
+                    image_size=mode.image_size,
+                    crop_mode=mode.crop_mode,
+                    save_results=False,
+                    test_compress=False,
+                    eval_mode=True
+                )
+        finally:
+            if generate_kwargs:
+                del self.model.generate
+        if not isinstance(outputs, str):
+            raise Exception(f"模型未回傳文字結果（請確認 {MODEL_ID} 的 remote code 支援 eval_mode）")
+        return outputs
+
+    def count_tokens(self, text: str) -> int:
+        if self.tokenizer is None:
+            return super().count_tokens(text)
+        return len(self.tokenizer.encode(text, add_special_tokens=False))
+
+    def meta(self) -> dict:
+        import torch
+        meta = super().meta()
+        meta["torch"] = torch.__version__
+        if self.device == "cpu":
+            meta["cpu_threads"] = torch.get_num_threads()
+        return meta
+
+
+def cpu_precision() -> str:
+    """
+    解析 OCR_CPU_PRECISION；auto 依 CPU 是否原生支援 bf16 決定
+    """
+    if CPU_PRECISION not in CPU_PRECISIONS:
+        raise ValueError(f"未知的 OCR_CPU_PRECISION: {CPU_PRECISION}（可用: {', '.join(CPU_PRECISIONS)}）")
+    if CPU_PRECISION != "auto":
+        return CPU_PRECISION
+    import torch
+    try:
+        bf16 = torch.backends.mkldnn.is_available() and torch.ops.mkldnn._is_mkldnn_bf16_supported()
+    except (AttributeError, RuntimeError):
+        bf16 = False
+    return "bf16" if bf16 else "int8"
+
+
+class FakeBackend(OCRBackend):
+    """
+    確定性的 CPU 替身：不需要權重，相同圖片與 prompt 永遠回傳相同文字
+
+    可用 OCR_FAKE_LATENCY_MS 模擬推論延遲，方便對整條 HTTP / PDF 流程做壓測。
+    """
+
+    name = "fake"
+
+    def __init__(self):
+        super().__init__()
+        self.latency_ms = float(os.getenv("OCR_FAKE_LATENCY_MS", "0"))
+
+    def _load(self):
+        pass
+
+    def infer(self, image: ImageInput, prompt: str, mode: Optional[ResolutionMode] = None) -> str:
+        self.load()
+        text = _fake_text(image, prompt, mode)
+        if self.latency_ms > 0:
+            time.sleep(self.latency_ms / 1000.0)
+        return text
+
+    def infer_stream(
+        self, image: ImageInput, prompt: str, mode: Optional[ResolutionMode] = None
+    ) -> Generator[str, None, str]:
+        # 逐行送出，模擬延遲平均分攤在每一行之間
+        self.load()
+        text = _fake_text(image, prompt, mode)
+        chunks = text.splitlines(keepends=True)
+        for chunk in chunks:
+            if self.latency_ms > 0:
+                time.sleep(self.latency_ms / 1000.0 / len(chunks))
+            yield chunk
+        return text
+
+
+
+def _fake_text(image: ImageInput, prompt: str, mode: Optional[ResolutionMode] = None) -> str:
+    if isinstance(image, str):
+        with open(image, "rb") as f:
+            data = f.read()
+        with Image.open(image) as img:
+            size = img.size
+    else:
+        data = image.tobytes()
+        size = image.size
+    digest = hashlib.sha256(data).hexdigest()
+    task = prompt.replace("<image>", "").strip() or "Free OCR."
+    return "\n".join([
+        f"[fake-ocr] {size[0]}x{size[1]}",
+        f"sha256: {digest[:16]}",
+        f"task: {task}",
+        f"mode: {(mode or BACKEND_DEFAULT_MODE).name}",
+    ])
+
+
+_BACKENDS = {
+    "deepseek": DeepSeekBackend,
+    "fake": FakeBackend,
+}
+
+_backend: Optional[OCRBackend] = None
+_backend_lock = threading.Lock()
+
+
+def get_backend() -> OCRBackend:
+    """
+    取得目前設定的推論後端（單例，尚未載入模型）
+    """
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if BACKEND_NAME not in _BACKENDS:
+                    raise ValueError(
+                        f"未知的 OCR_BACKEND: {BACKEND_NAME}（可用: {', '.join(_BACKENDS)}）"
+                    )
+                if WORKERS > 0:
+                    from app.workers import WorkerPoolBackend
+                    _backend = WorkerPoolBackend(BACKEND_NAME, WORKERS)
+                else:
+                    _backend = _BACKENDS[BACKEND_NAME]()
+    return _backend
+
+
+def preload_in_background() -> threading.Thread:
+    """
+    於背景執行緒載入模型，讓 API 可以先啟動，再由 /health 回報就緒狀態
+    """
+    def _run():
+        try:
+            get_backend().load()
+            logger.info("模型已載入 (%s)", get_backend().name)
+        except Exception as e:
+            logger.error("模型載入失敗: %s", e)
+
+    thread = threading.Thread(target=_run, name="ocr-model-preload", daemon=True)
+    thread.start()
+    return thread
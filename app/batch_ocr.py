@@ -0,0 +1,113 @@
+import os
+import io
+import time
+import zipfile
+from pathlib import PurePosixPath
+from typing import Callable, Iterable, List, Optional
+
+from app.admission import get_admission
+from app.ocr import decode_base64_image, load_image_bytes, run_ocr_image
+
+# /ocr/batch：一次請求送入多張圖片（多檔上傳、Base64 陣列或 ZIP）
+BATCH_MAX_ITEMS = int(os.getenv("OCR_BATCH_MAX_ITEMS", "1000"))
+BATCH_MAX_ZIP_MB = float(os.getenv("OCR_BATCH_MAX_ZIP_MB", "512"))
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".gif", ".tif", ".tiff", ".webp"}
+
+
+class BatchInputError(ValueError):
+    """
+    批次輸入不合法；status_code 為建議回傳給客戶端的 HTTP 狀態碼
+    """
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class BatchItem:
+    """
+    批次中的一張圖片；load() 在工作執行緒中才取得圖片檔內容，避免一次把所有圖片解開放進記憶體
+    """
+    __slots__ = ("name", "load")
+
+    def __init__(self, name: str, load: Callable[[], bytes]):
+        self.name = name
+        self.load = load
+
+
+def items_from_bytes(files: Iterable[tuple]) -> List[BatchItem]:
+    """
+    由 (檔名, 檔案內容) 建立批次項目
+    """
+    return [BatchItem(name, (lambda data=data: data)) for name, data in files]
+
+
+def items_from_base64(images: Iterable[tuple]) -> List[BatchItem]:
+    """
+    由 (名稱, Base64 字串) 建立批次項目；解碼在工作執行緒中進行，單張失敗只影響該項目
+    """
+    return [BatchItem(name, (lambda data=data: decode_base64_image(data))) for name, data in images]
+
+
+def items_from_zip(data: bytes) -> List[BatchItem]:
+    """
+    列出 ZIP 中的圖片檔（依檔名排序）；解壓縮總大小超過上限時拒絕，避免壓縮炸彈
+    """
+    try:
+        archive = zipfile.ZipFile(io.BytesIO(data))
+    except zipfile.BadZipFile as e:
+        raise BatchInputError(f"無效的 ZIP 檔: {e}")
+
+    infos = []
+    total = 0
+    for info in archive.infolist():
+        path = PurePosixPath(info.filename)
+        if info.is_dir() or path.name.startswith(".") or "__MACOSX" in path.parts:
+            continue
+        if path.suffix.lower() not in IMAGE_EXTENSIONS:
+            continue
+        infos.append(info)
+        total += info.file_size
+
+    if total > BATCH_MAX_ZIP_MB * 1024 * 1024:
+        raise BatchInputError(f"ZIP 解壓縮後超過大小上限 {BATCH_MAX_ZIP_MB:g} MB", status_code=413)
+
+    infos.sort(key=lambda info: info.filename)
+    # ZipFile 讀取成員時會以內部鎖保護共用的檔案物件，可由多個執行緒同時讀取
+    return [BatchItem(info.filename, (lambda info=info: archive.read(info))) for info in infos]
+
+
+def check_batch_size(items: List[BatchItem]):
+    if not items:
+        raise BatchInputError("批次中沒有可處理的圖片")
+    if len(items) > BATCH_MAX_ITEMS:
+        raise BatchInputError(f"一次最多 {BATCH_MAX_ITEMS} 張圖片，收到 {len(items)} 張", status_code=413)
+
+
+def _run_item(index: int, item: BatchItem, prompt: Optional[str], mode=None) -> dict:
+    t0 = time.time()
+    try:
+        image = load_image_bytes(item.load())
+        result = run_ocr_image(image, prompt, mode)
+    except Exception as e:
+        return {"index": index, "name": item.name, "status": "error", "error": str(e)}
+    return {
+        "index": index,
+        "name": item.name,
+        "status": "ok",
+        "full_text": result.text,
+        "lines": result.lines,
+        "cached": result.cached,
+        "mode": result.mode,
+        "elapsed_ms": int((time.time() - t0) * 1000),
+    }
+
+
+async def run_ocr_batch(items: List[BatchItem], prompt: Optional[str] = None, mode=None) -> List[dict]:
+    """
+    在目前 lane 的推論執行緒池中並行解碼與前處理，並同時把圖片送進推論（啟用微批次時會合併成批次、相同圖片由快取合併）；
+    依輸入順序回傳每張圖片的結果或錯誤。呼叫者需已持有名額，同一時間只有 OCR_INFER_CONCURRENCY 張圖片在記憶體中解碼；
+    mode 為 auto 時每張圖片各自挑選解析度模式
+    """
+    return await get_admission().map(_run_item, ((i, item, prompt, mode) for i, item in enumerate(items)))
@@ -0,0 +1,146 @@
+import os
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Optional
+
+from app.backend import ImageInput, OCRBackend, get_backend
+from app.resolution import ResolutionMode
+from app.metrics import Gauge, Histogram, register
+
+# 動態微批次：OCR_BATCH_MAX_SIZE > 1 時啟用
+BATCH_MAX_SIZE = int(os.getenv("OCR_BATCH_MAX_SIZE", "1"))
+BATCH_MAX_WAIT_MS = float(os.getenv("OCR_BATCH_MAX_WAIT_MS", "5"))
+
+logger = logging.getLogger(__name__)
+
+
+class _Pending:
+    __slots__ = ("image", "prompt", "mode", "future")
+
+    def __init__(self, image: ImageInput, prompt: str, mode: Optional[ResolutionMode]):
+        self.image = image
+        self.prompt = prompt
+        self.mode = mode
+        self.future: Future = Future()
+
+
+class MicroBatcher:
+    """
+    收集等待中的圖片（最多 max_batch_size 張或等待 max_wait_ms），
+    交給後端的 infer_batch 一次推論，再把結果分回各個呼叫者
+    """
+
+    def __init__(self, backend: OCRBackend, max_batch_size: int, max_wait_ms: float):
+        self.backend = backend
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._queue: "queue.Queue[_Pending]" = queue.Queue()
+        self.batches = 0
+        self.items = 0
+        self._thread = threading.Thread(target=self._loop, name="ocr-micro-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, image: ImageInput, prompt: str, mode: Optional[ResolutionMode] = None) -> Future:
+        pending = _Pending(image, prompt, mode)
+        self._queue.put(pending)
+        return pending.future
+
+    def infer(self, image: ImageInput, prompt: str, mode: Optional[ResolutionMode] = None) -> str:
+        """
+        阻塞直到該圖片所屬的批次完成
+        """
+        return self.submit(image, prompt, mode).result()
+
+    def _collect(self) -> List[_Pending]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        # 多個模型 worker 行程時不等這一批完成，下一批可以同時送往其他 worker
+        submit_batch = getattr(self.backend, "submit_batch", None)
+        while True:
+            batch = self._collect()
+            self.batches += 1
+            self.items += len(batch)
+            BATCH_SIZE.observe(len(batch))
+            args = ([p.image for p in batch], [p.prompt for p in batch], [p.mode for p in batch])
+
+            if submit_batch is not None:
+                try:
+                    future = submit_batch(*args)
+                except Exception as e:
+                    self._deliver(batch, [e] * len(batch))
+                else:
+                    future.add_done_callback(lambda f, batch=batch: self._deliver(
+                        batch, f.result() if f.exception() is None else [f.exception()] * len(batch)
+                    ))
+                continue
+
+            try:
+                results = self.backend.infer_batch(*args)
+            except Exception as e:
+                results = [e] * len(batch)
+            self._deliver(batch, results)
+
+    @staticmethod
+    def _deliver(batch: List[_Pending], results: list):
+        for pending, result in zip(batch, results):
+            if isinstance(result, Exception):
+                pending.future.set_exception(result)
+            else:
+                pending.future.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "batches": self.batches,
+            "items": self.items,
+            "queued": self._queue.qsize(),
+        }
+
+
+BATCH_SIZE = register(Histogram(
+    "ocr_batch_size",
+    "Images per micro-batch sent to the backend",
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+))
+register(Gauge(
+    "ocr_batch_queue_depth",
+    "Images waiting to be collected into a micro-batch",
+    lambda: {(): _batcher._queue.qsize()} if _batcher else {},
+))
+
+_batcher: Optional[MicroBatcher] = None
+_batcher_lock = threading.Lock()
+
+
+def get_batcher() -> Optional[MicroBatcher]:
+    """
+    取得全域微批次排程器；未啟用（OCR_BATCH_MAX_SIZE <= 1）時回傳 None
+    """
+    global _batcher
+    if BATCH_MAX_SIZE <= 1:
+        return None
+    if _batcher is None:
+        with _batcher_lock:
+            if _batcher is None:
+                backend = get_backend()
+                if not backend.batched_generate:
+                    logger.warning(
+                        "後端 %s 沒有批次 generate，整批仍逐張推論；OCR_BATCH_MAX_SIZE > 1 只會增加等待時間", backend.name
+                    )
+                _batcher = MicroBatcher(backend, BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS)
+    return _batcher
@@ -0,0 +1,298 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Callable, Optional, Tuple
+
+from PIL import Image
+
+from app.backend import BACKEND_DEFAULT_MODE, DEFAULT_PROMPT, get_backend
+from app.resolution import ResolutionMode
+
+# 內容定址的 OCR 結果快取：記憶體 LRU + 選用的磁碟層
+CACHE_MAX_ENTRIES = int(os.getenv("OCR_CACHE_MAX_ENTRIES", "1024"))
+CACHE_TTL_SECONDS = float(os.getenv("OCR_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+CACHE_DIR = os.getenv("OCR_CACHE_DIR")
+CACHE_DISK_MAX_MB = float(os.getenv("OCR_CACHE_DISK_MAX_MB", "512"))
+
+# 每寫入這麼多筆才掃描一次磁碟層大小
+_DISK_PRUNE_EVERY = 64
+# 查詢時最多每隔這麼多秒清除一次過期項目（記憶體層在查詢當下清除，磁碟層在背景執行緒清除）
+_SWEEP_INTERVAL = 60
+
+logger = logging.getLogger(__name__)
+
+
+def cache_key(image: Image.Image, prompt: Optional[str], mode: Optional[ResolutionMode]) -> str:
+    """
+    所有端點共用的快取鍵：圖片像素、prompt（未指定時為預設 prompt）、解析度模式與後端的模型與推論參數
+
+    以解碼（依 EXIF 轉正）後的像素計算：本機路徑由呼叫端先解碼一次，與推論共用同一張圖片，
+    同一張圖片不論經由上傳、Base64、URL 或 PDF 渲染送入都會命中同一筆快取
+    """
+    mode = mode or BACKEND_DEFAULT_MODE
+    params = {"prompt": prompt or DEFAULT_PROMPT, "mode": mode.name, **get_backend().infer_params(mode)}
+    h = hashlib.sha256()
+    h.update(json.dumps(params, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    h.update(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode("ascii"))
+    h.update(image.tobytes())
+    return h.hexdigest()
+
+
+class OCRCache:
+    """
+    兩層快取，並合併相同鍵的進行中推論（同時間的相同請求只跑一次模型）
+    """
+
+    def __init__(
+        self,
+        max_entries: int = CACHE_MAX_ENTRIES,
+        ttl_seconds: float = CACHE_TTL_SECONDS,
+        disk_dir: Optional[str] = CACHE_DIR,
+        disk_max_mb: float = CACHE_DISK_MAX_MB
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl_seconds
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.disk_max_bytes = int(disk_max_mb * 1024 * 1024)
+        self._memory: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._disk_writes = 0
+        self._last_sweep = time.time()
+        self._disk_sweeping = False
+        self.counters = {
+            "hits_memory": 0,
+            "hits_disk": 0,
+            "misses": 0,
+            "coalesced": 0,
+            "evictions": 0,
+        }
+        if self.disk_dir:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+
+    def get_or_compute(self, key: str, compute: Callable[[], str]) -> Tuple[str, bool]:
+        """
+        回傳 (text, cached)；未命中時由第一個呼叫者執行 compute，其他相同鍵的呼叫者等待其結果
+        """
+        self._maybe_sweep()
+        with self._lock:
+            text = self._memory_get(key)
+            if text is not None:
+                self.counters["hits_memory"] += 1
+                return text, True
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[key] = future
+            else:
+                self.counters["coalesced"] += 1
+
+        if not owner:
+            return future.result(), True
+
+        try:
+            text = self._disk_get(key)
+            if text is not None:
+                with self._lock:
+                    self.counters["hits_disk"] += 1
+                    self._memory_put(key, text)
+                future.set_result(text)
+                return text, True
+
+            with self._lock:
+                self.counters["misses"] += 1
+            text = compute()
+            with self._lock:
+                self._memory_put(key, text)
+            self._disk_put(key, text)
+            future.set_result(text)
+            return text, False
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        只查詢兩層快取（不合併進行中的推論）；未命中時由呼叫者自行推論後以 put 寫入，供逐段串流的推論使用
+        """
+        self._maybe_sweep()
+        with self._lock:
+            text = self._memory_get(key)
+            if text is not None:
+                self.counters["hits_memory"] += 1
+                return text
+        text = self._disk_get(key)
+        with self._lock:
+            if text is not None:
+                self.counters["hits_disk"] += 1
+                self._memory_put(key, text)
+            else:
+                self.counters["misses"] += 1
+        return text
+
+    def put(self, key: str, text: str):
+        with self._lock:
+            self._memory_put(key, text)
+        self._disk_put(key, text)
+
+    def _maybe_sweep(self):
+        """
+        查詢時定期清除過期項目，沒有新寫入時過期的結果也不會一直留在記憶體與磁碟上
+        """
+        if not self.ttl:
+            return
+        now = time.time()
+        with self._lock:
+            if now - self._last_sweep < _SWEEP_INTERVAL:
+                return
+            self._last_sweep = now
+            self._memory_expire(now)
+            sweep_disk = self.disk_dir is not None and not self._disk_sweeping
+            self._disk_sweeping = sweep_disk
+        if sweep_disk:
+            threading.Thread(target=self._sweep_disk, name="ocr-cache-sweep", daemon=True).start()
+
+    def _sweep_disk(self):
+        try:
+            self.prune_disk()
+        finally:
+            with self._lock:
+                self._disk_sweeping = False
+
+    # ---- 記憶體層（呼叫者需持有 self._lock）----
+
+    def _memory_expire(self, now: float):
+        expired = [key for key, (stored_at, _) in self._memory.items() if now - stored_at > self.ttl]
+        for key in expired:
+            del self._memory[key]
+        self.counters["evictions"] += len(expired)
+
+    def _memory_get(self, key: str) -> Optional[str]:
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        stored_at, text = entry
+        if self.ttl and time.time() - stored_at > self.ttl:
+            del self._memory[key]
+            return None
+        self._memory.move_to_end(key)
+        return text
+
+    def _memory_put(self, key: str, text: str):
+        if self.max_entries <= 0:
+            return
+        self._memory[key] = (time.time(), text)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    # ---- 磁碟層 ----
+
+    def _disk_path(self, key: str) -> Path:
+        return self.disk_dir / key[:2] / f"{key}.json"
+
+    def _disk_get(self, key: str) -> Optional[str]:
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            if self.ttl and time.time() - path.stat().st_mtime > self.ttl:
+                path.unlink()
+                return None
+            with path.open("r", encoding="utf-8") as f:
+                return json.load(f)["text"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _disk_put(self, key: str, text: str):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        try:
+            path.parent.mkdir(exist_ok=True)
+            tmp = path.with_suffix(".tmp")
+            with tmp.open("w", encoding="utf-8") as f:
+                json.dump({"text": text}, f, ensure_ascii=False)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning("寫入磁碟快取失敗: %s", e)
+            return
+
+        with self._lock:
+            self._disk_writes += 1
+            prune = self._disk_writes % _DISK_PRUNE_EVERY == 0
+        if prune:
+            self.prune_disk()
+
+    def prune_disk(self):
+        """
+        刪除過期檔案，並從最舊的開始刪除直到總大小低於上限
+        """
+        if not self.disk_dir:
+            return
+        now = time.time()
+        entries = []
+        total = 0
+        for path in self.disk_dir.glob("*/*.json"):
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            if self.ttl and now - st.st_mtime > self.ttl:
+                path.unlink(missing_ok=True)
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.disk_max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+            with self._lock:
+                self.counters["evictions"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+            size = len(self._memory)
+            inflight = len(self._inflight)
+        lookups = counters["hits_memory"] + counters["hits_disk"] + counters["coalesced"] + counters["misses"]
+        hits = lookups - counters["misses"]
+        return {
+            **counters,
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+            "memory_entries": size,
+            "inflight": inflight,
+            "disk_enabled": bool(self.disk_dir),
+        }
+
+
+_cache: Optional[OCRCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> Optional[OCRCache]:
+    """
+    取得全域快取；OCR_CACHE_MAX_ENTRIES=0 且未設定 OCR_CACHE_DIR 時停用（回傳 None）
+    """
+    global _cache
+    if CACHE_MAX_ENTRIES <= 0 and not CACHE_DIR:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = OCRCache()
+    return _cache
@@ -0,0 +1,150 @@
+import os
+import json
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+from app.backend import MODEL_ID, get_backend
+from app.metrics import Gauge, register
+
+# /ocr/pdf 的逐頁檢查點：每完成一頁就寫入，以 (文件內容雜湊, 影響結果的參數) 為鍵；
+# 同一份文件以相同參數重送時，已完成的頁面直接取用，只處理尚未完成或先前失敗的頁面。
+# 檢查點保存 OCR 文字，預設關閉；開啟後只存在記憶體中（重啟即消失），設定 OCR_CHECKPOINT_DIR 才寫入磁碟
+CHECKPOINT_ENABLED = os.getenv("OCR_PDF_CHECKPOINT", "0") == "1"
+CHECKPOINT_DIR = os.getenv("OCR_CHECKPOINT_DIR", "").strip()
+CHECKPOINT_TTL_SECONDS = float(os.getenv("OCR_CHECKPOINT_TTL_SECONDS", str(24 * 3600)))
+
+# 最多每隔這麼多秒清除一次過期的檢查點
+_SWEEP_INTERVAL = 60
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pdf_pages (
+    document TEXT NOT NULL,
+    settings TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    record TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (document, settings, page)
+);
+CREATE INDEX IF NOT EXISTS pdf_pages_updated_at ON pdf_pages (updated_at);
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def document_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def settings_key(**settings) -> str:
+    """
+    影響逐頁結果的參數（prompt、解析度模式、渲染與頁面過濾選項，加上模型）的雜湊
+    """
+    backend = get_backend()
+    payload = {"backend": backend.name, "model_id": MODEL_ID, **settings}
+    return hashlib.sha256(
+        json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+class CheckpointStore:
+    """
+    逐頁結果的 SQLite 儲存；最後一次寫入超過 TTL 的頁面會被清除。db_path 為 None 時使用記憶體資料庫
+    """
+
+    def __init__(self, db_path: Optional[Path] = None, ttl_seconds: float = CHECKPOINT_TTL_SECONDS):
+        if db_path is not None:
+            db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl_seconds
+        self._conn = sqlite3.connect(str(db_path) if db_path is not None else ":memory:", check_same_thread=False)
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+        with self._lock, self._conn:
+            self._conn.executescript(_SCHEMA)
+
+    def load(self, document: str, settings: str) -> Dict[int, dict]:
+        self.sweep()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT page, record FROM pdf_pages WHERE document = ? AND settings = ? AND updated_at >= ?",
+                (document, settings, self._cutoff()),
+            ).fetchall()
+        return {page: json.loads(record) for page, record in rows}
+
+    def save(self, document: str, settings: str, record: dict):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pdf_pages (document, settings, page, record, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (document, settings, record["page"], json.dumps(record, ensure_ascii=False), time.time()),
+            )
+
+    def clear(self, document: str, settings: str):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM pdf_pages WHERE document = ? AND settings = ?", (document, settings))
+
+    def _cutoff(self) -> float:
+        return time.time() - self.ttl if self.ttl else 0.0
+
+    def sweep(self, force: bool = False):
+        now = time.time()
+        with self._lock:
+            if not self.ttl or (not force and now - self._last_sweep < _SWEEP_INTERVAL):
+                return
+            self._last_sweep = now
+            with self._conn:
+                deleted = self._conn.execute("DELETE FROM pdf_pages WHERE updated_at < ?", (self._cutoff(),)).rowcount
+        if deleted:
+            logger.debug("已清除 %d 筆過期的頁面檢查點", deleted)
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM pdf_pages").fetchone()[0]
+
+
+class Checkpoint:
+    """
+    一份文件在一組參數下的檢查點
+
+    Example:
+        checkpoint = Checkpoint(document_hash(data), settings_key(prompt=prompt))
+        done = checkpoint.load()
+        checkpoint.save({"page": 3, "text": ...})
+    """
+
+    def __init__(self, document: str, settings: str, store: "CheckpointStore" = None):
+        self.document = document
+        self.settings = settings
+        self.store = store or get_checkpoint_store()
+
+    def load(self) -> Dict[int, dict]:
+        return self.store.load(self.document, self.settings)
+
+    def save(self, record: dict):
+        self.store.save(self.document, self.settings, record)
+
+    def clear(self):
+        self.store.clear(self.document, self.settings)
+
+
+_store: Optional[CheckpointStore] = None
+_store_lock = threading.Lock()
+
+
+def get_checkpoint_store() -> CheckpointStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = CheckpointStore(Path(CHECKPOINT_DIR) / "checkpoints.db" if CHECKPOINT_DIR else None)
+    return _store
+
+
+register(Gauge(
+    "ocr_pdf_checkpoint_pages",
+    "PDF page results held in the checkpoint store",
+    lambda: {(): _store.count()} if _store else {},
+))
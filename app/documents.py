@@ -0,0 +1,285 @@
+import os
+import io
+import re
+import json
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional, Tuple, Union
+
+from PIL import Image
+
+from app.metrics import Counter, Gauge, register, stage
+from app.ocr import PageRangeError, PdfPages, open_pdf, render_pdf_page
+from app.resolution import ResolutionMode
+
+# /pdf/split 上傳的 PDF 暫存在文件庫，頁面在請求時才渲染；
+# 閒置超過 OCR_DOC_TTL_SECONDS 的文件會被清除
+DOCS_DIR = Path(os.getenv("OCR_DOCS_DIR", "./documents"))
+DOC_TTL_SECONDS = float(os.getenv("OCR_DOC_TTL_SECONDS", "3600"))
+# 已渲染頁面圖片（編碼後）的記憶體 LRU 上限
+RENDER_CACHE_MB = float(os.getenv("OCR_RENDER_CACHE_MB", "256"))
+
+RENDER_DEFAULT_DPI = 200
+RENDER_MIN_DPI = 36
+RENDER_MAX_DPI = 600
+
+# format 參數 -> (PIL 格式, Content-Type, 編碼選項)
+IMAGE_FORMATS = {
+    "png": ("PNG", "image/png", {}),
+    "jpeg": ("JPEG", "image/jpeg", {"quality": 90}),
+    "jpg": ("JPEG", "image/jpeg", {"quality": 90}),
+}
+
+# 最多每隔這麼多秒掃描一次過期文件
+_SWEEP_INTERVAL = 60
+_DOC_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+logger = logging.getLogger(__name__)
+
+
+class DocumentError(Exception):
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+RenderKey = Tuple[str, int, int, str, bool]
+
+
+class DocumentStore:
+    """
+    PDF 文件庫：原檔與中繼資料存在磁碟，最後存取時間即檔案的 mtime（重啟後仍可依 TTL 清除）；
+    加密文件的密碼只保存在記憶體
+    """
+
+    def __init__(self, root: Path = DOCS_DIR, ttl_seconds: float = DOC_TTL_SECONDS, cache_mb: float = RENDER_CACHE_MB):
+        self.root = Path(root)
+        self.ttl = ttl_seconds
+        self.cache_max_bytes = int(cache_mb * 1024 * 1024)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._passwords: Dict[str, str] = {}
+        self._cache: "OrderedDict[RenderKey, bytes]" = OrderedDict()
+        self._cache_bytes = 0
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+        self.sweep(force=True)
+
+    # ---- 文件 ----
+
+    def _paths(self, doc_id: str) -> Tuple[Path, Path]:
+        if not _DOC_ID_PATTERN.match(doc_id):
+            raise DocumentError(f"文件不存在或已過期: {doc_id}", status_code=404)
+        return self.root / f"{doc_id}.pdf", self.root / f"{doc_id}.json"
+
+    def add(self, data: bytes, filename: str = None, password: str = None, pages: str = None) -> dict:
+        """
+        儲存 PDF 並回傳文件資訊（不渲染任何頁面）；pages 只用於驗證並回傳所選頁碼
+        """
+        self.sweep()
+        doc_id = uuid.uuid4().hex
+        pdf_path, meta_path = self._paths(doc_id)
+        with stage("upload_spool"):
+            pdf_path.write_bytes(data)
+        try:
+            with PdfPages(str(pdf_path), user_password=password, pages=pages) as pdf_pages:
+                page_count = pdf_pages.page_count
+                selected = list(pdf_pages.page_numbers)
+        except Exception:
+            pdf_path.unlink(missing_ok=True)
+            raise
+
+        meta = {
+            "document_id": doc_id,
+            "filename": filename,
+            "page_count": page_count,
+            "encrypted": bool(password),
+            "created_at": time.time(),
+        }
+        meta_path.write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+        if password:
+            with self._lock:
+                self._passwords[doc_id] = password
+        return {**meta, "pages": selected, "expires_in": self.ttl}
+
+    def info(self, doc_id: str) -> dict:
+        pdf_path, meta_path = self._paths(doc_id)
+        self._touch(doc_id, pdf_path)
+        try:
+            meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            raise DocumentError(f"文件不存在或已過期: {doc_id}", status_code=404)
+        return {**meta, "expires_in": self.ttl}
+
+    def _touch(self, doc_id: str, pdf_path: Path):
+        """
+        確認文件存在且未過期，並更新最後存取時間
+        """
+        self.sweep()
+        try:
+            if self.ttl and time.time() - pdf_path.stat().st_mtime > self.ttl:
+                self.delete(doc_id)
+                raise FileNotFoundError
+            os.utime(pdf_path)
+        except FileNotFoundError:
+            raise DocumentError(f"文件不存在或已過期: {doc_id}", status_code=404)
+
+    def _open(self, doc_id: str) -> Tuple[str, Optional[str]]:
+        pdf_path, meta_path = self._paths(doc_id)
+        self._touch(doc_id, pdf_path)
+        with self._lock:
+            password = self._passwords.get(doc_id)
+        if password is None and meta_path.exists() and json.loads(meta_path.read_text(encoding="utf-8")).get("encrypted"):
+            # 密碼只存在記憶體，服務重啟後加密文件需要重新上傳
+            raise DocumentError(f"加密文件的密碼已失效，請重新上傳: {doc_id}", status_code=409)
+        return str(pdf_path), password
+
+    def delete(self, doc_id: str) -> bool:
+        pdf_path, meta_path = self._paths(doc_id)
+        existed = pdf_path.exists()
+        pdf_path.unlink(missing_ok=True)
+        meta_path.unlink(missing_ok=True)
+        with self._lock:
+            self._passwords.pop(doc_id, None)
+            for key in [k for k in self._cache if k[0] == doc_id]:
+                self._cache_bytes -= len(self._cache.pop(key))
+        return existed
+
+    def sweep(self, force: bool = False):
+        """
+        刪除閒置超過 TTL 的文件（最多每 _SWEEP_INTERVAL 秒掃描一次）
+        """
+        now = time.time()
+        with self._lock:
+            if not force and now - self._last_sweep < _SWEEP_INTERVAL:
+                return
+            self._last_sweep = now
+        if not self.ttl:
+            return
+        for pdf_path in self.root.glob("*.pdf"):
+            try:
+                expired = now - pdf_path.stat().st_mtime > self.ttl
+            except OSError:
+                continue
+            if expired and _DOC_ID_PATTERN.match(pdf_path.stem):
+                self.delete(pdf_path.stem)
+                logger.debug("文件 %s 已過期，已刪除", pdf_path.stem)
+        # 上傳途中失敗留下、沒有對應 PDF 的中繼資料
+        for meta_path in self.root.glob("*.json"):
+            if not meta_path.with_suffix(".pdf").exists():
+                meta_path.unlink(missing_ok=True)
+
+    # ---- 頁面 ----
+
+    def cached_page(self, doc_id: str, page_no: int, dpi: int, fmt: str, grayscale: bool) -> Optional[bytes]:
+        """
+        只查詢渲染快取（不開啟 PDF），命中時也會更新文件的最後存取時間
+        """
+        key = (doc_id, page_no, dpi, fmt, grayscale)
+        with self._lock:
+            data = self._cache.get(key)
+            if data is not None:
+                self._cache.move_to_end(key)
+        if data is None:
+            return None
+        self._touch(doc_id, self._paths(doc_id)[0])
+        RENDER_CACHE.inc(result="hit")
+        return data
+
+    def render_page(self, doc_id: str, page_no: int, dpi: int, fmt: str, grayscale: bool = False) -> bytes:
+        """
+        渲染單頁並編碼成圖片檔內容，結果放入 LRU 快取
+        """
+        data = self.cached_page(doc_id, page_no, dpi, fmt, grayscale)
+        if data is not None:
+            return data
+        RENDER_CACHE.inc(result="miss")
+
+        pil_format, _, options = IMAGE_FORMATS[fmt]
+        pdf_path, password = self._open(doc_id)
+        document = open_pdf(pdf_path, password)
+        try:
+            if not 1 <= page_no <= document.page_count:
+                raise DocumentError(f"頁碼超出文件頁數 ({document.page_count}): {page_no}", status_code=404)
+            with stage("pdf_render"):
+                img = render_pdf_page(document[page_no - 1], dpi, grayscale=grayscale)
+        finally:
+            document.close()
+        with stage("image_encode"):
+            buffer = io.BytesIO()
+            img.save(buffer, format=pil_format, **options)
+        data = buffer.getvalue()
+        self._cache_put((doc_id, page_no, dpi, fmt, grayscale), data)
+        return data
+
+    def page_image(self, doc_id: str, page_no: int, dpi: int, mode: Union[None, str, ResolutionMode] = None) -> Image.Image:
+        """
+        直接渲染成 PIL 圖片交給模型（依解析度模式決定渲染 DPI，不經過編碼）
+        """
+        pdf_path, password = self._open(doc_id)
+        try:
+            with PdfPages(pdf_path, dpi=dpi, user_password=password, pages=str(page_no), mode=mode) as pdf_pages:
+                return next(iter(pdf_pages))[1]
+        except PageRangeError as e:
+            raise DocumentError(str(e), status_code=404)
+
+    def _cache_put(self, key: RenderKey, data: bytes):
+        if len(data) > self.cache_max_bytes:
+            return
+        with self._lock:
+            old = self._cache.pop(key, None)
+            if old is not None:
+                self._cache_bytes -= len(old)
+            self._cache[key] = data
+            self._cache_bytes += len(data)
+            while self._cache_bytes > self.cache_max_bytes:
+                _, evicted = self._cache.popitem(last=False)
+                self._cache_bytes -= len(evicted)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "documents": sum(1 for _ in self.root.glob("*.pdf")),
+                "render_cache_entries": len(self._cache),
+                "render_cache_bytes": self._cache_bytes,
+                "ttl_seconds": self.ttl,
+            }
+
+
+def parse_render_options(dpi: int, fmt: str) -> str:
+    """
+    驗證頁面渲染參數，回傳正規化後的格式名稱
+    """
+    if not RENDER_MIN_DPI <= dpi <= RENDER_MAX_DPI:
+        raise DocumentError(f"dpi 必須介於 {RENDER_MIN_DPI} 到 {RENDER_MAX_DPI}")
+    fmt = (fmt or "png").lower()
+    if fmt not in IMAGE_FORMATS:
+        raise DocumentError(f"不支援的圖片格式: {fmt}（可用: png, jpeg）")
+    return "jpeg" if fmt == "jpg" else fmt
+
+
+RENDER_CACHE = register(Counter(
+    "ocr_render_cache_total",
+    "Page render requests served from the render cache (hit) or rendered (miss)",
+    ("result",),
+))
+register(Gauge(
+    "ocr_render_cache_bytes",
+    "Encoded page images held in the render cache",
+    lambda: {(): _store._cache_bytes} if _store else {},
+))
+
+_store: Optional[DocumentStore] = None
+_store_lock = threading.Lock()
+
+
+def get_document_store() -> DocumentStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = DocumentStore()
+    return _store
@@ -0,0 +1,159 @@
+import os
+import asyncio
+import threading
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from app.metrics import stage
+
+# 共用、具連線池的圖片下載：串流讀入有上限的緩衝區，並限制每個主機的同時連線數
+FETCH_TIMEOUT = float(os.getenv("OCR_FETCH_TIMEOUT", "30"))
+FETCH_MAX_BYTES = int(os.getenv("OCR_FETCH_MAX_BYTES", str(20 * 1024 * 1024)))
+FETCH_MAX_CONNECTIONS = int(os.getenv("OCR_FETCH_MAX_CONNECTIONS", "64"))
+FETCH_PER_HOST = int(os.getenv("OCR_FETCH_PER_HOST", "4"))
+
+# 部分來源以 octet-stream 回傳圖片，交由後續解碼判斷
+_ALLOWED_CONTENT_TYPES = ("image/", "application/octet-stream", "binary/octet-stream")
+
+
+class FetchError(Exception):
+    """
+    下載失敗；status_code 為建議回傳給客戶端的 HTTP 狀態碼
+    """
+
+    def __init__(self, message: str, status_code: int = 502):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=FETCH_MAX_CONNECTIONS,
+        max_keepalive_connections=FETCH_MAX_CONNECTIONS,
+    )
+
+
+def _check_url(url: str) -> str:
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.netloc:
+        raise FetchError(f"只支援 http(s) 圖片連結: {url}", status_code=400)
+    return parts.netloc.lower()
+
+
+def _check_response(response: httpx.Response, url: str):
+    if response.status_code >= 400:
+        raise FetchError(f"Failed to download image from URL: HTTP {response.status_code} ({url})")
+
+    content_type = response.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type and not content_type.startswith(_ALLOWED_CONTENT_TYPES):
+        raise FetchError(f"URL 內容不是圖片 (Content-Type: {content_type})", status_code=415)
+
+    content_length = response.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > FETCH_MAX_BYTES:
+        raise FetchError(f"圖片超過大小上限 {FETCH_MAX_BYTES} bytes", status_code=413)
+
+
+def _append_limited(buffer: bytearray, chunk: bytes):
+    if len(buffer) + len(chunk) > FETCH_MAX_BYTES:
+        raise FetchError(f"圖片超過大小上限 {FETCH_MAX_BYTES} bytes", status_code=413)
+    buffer.extend(chunk)
+
+
+# ---- 非同步（API 端點使用）----
+
+_async_client: Optional[httpx.AsyncClient] = None
+# 主機 -> [Semaphore, 使用中與等待中的下載數]；下載數歸零時移除，字典大小不隨看過的主機數增長
+_host_semaphores: Dict[str, List] = {}
+
+
+def _get_async_client() -> httpx.AsyncClient:
+    global _async_client
+    if _async_client is None:
+        _async_client = httpx.AsyncClient(
+            timeout=FETCH_TIMEOUT,
+            limits=_limits(),
+            follow_redirects=True,
+        )
+    return _async_client
+
+
+@asynccontextmanager
+async def _host_slot(host: str):
+    """
+    取得主機的連線名額；該主機最後一個下載結束時移除它的 Semaphore
+    """
+    entry = _host_semaphores.get(host)
+    if entry is None:
+        entry = _host_semaphores[host] = [asyncio.Semaphore(FETCH_PER_HOST), 0]
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0 and _host_semaphores.get(host) is entry:
+            del _host_semaphores[host]
+
+
+async def fetch_image_bytes(url: str) -> bytes:
+    """
+    以共用連線池串流下載圖片，超過大小上限或內容類型不符時立即中止
+    """
+    host = _check_url(url)
+    buffer = bytearray()
+    try:
+        async with _host_slot(host):
+            with stage("download"):
+                async with _get_async_client().stream("GET", url) as response:
+                    _check_response(response, url)
+                    async for chunk in response.aiter_bytes():
+                        _append_limited(buffer, chunk)
+    except httpx.HTTPError as e:
+        raise FetchError(f"Failed to download image from URL: {e}")
+    return bytes(buffer)
+
+
+async def close_async_client():
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+    _host_semaphores.clear()
+
+
+# ---- 同步（run_ocr 等函式庫呼叫使用）----
+
+_sync_client: Optional[httpx.Client] = None
+_sync_lock = threading.Lock()
+
+
+def _get_sync_client() -> httpx.Client:
+    global _sync_client
+    if _sync_client is None:
+        with _sync_lock:
+            if _sync_client is None:
+                _sync_client = httpx.Client(
+                    timeout=FETCH_TIMEOUT,
+                    limits=_limits(),
+                    follow_redirects=True,
+                )
+    return _sync_client
+
+
+def fetch_image_bytes_sync(url: str) -> bytes:
+    """
+    fetch_image_bytes 的同步版本（共用同樣的檢查與大小上限）
+    """
+    _check_url(url)
+    buffer = bytearray()
+    try:
+        with stage("download"), _get_sync_client().stream("GET", url) as response:
+            _check_response(response, url)
+            for chunk in response.iter_bytes():
+                _append_limited(buffer, chunk)
+    except httpx.HTTPError as e:
+        raise FetchError(f"Failed to download image from URL: {e}")
+    return bytes(buffer)
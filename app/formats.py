@@ -0,0 +1,214 @@
+import os
+import gzip
+import json
+import logging
+import contextvars
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qs
+
+from starlette.responses import JSONResponse
+
+from app.metrics import stage
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# 回應壓縮：依請求的 Accept-Encoding 協商，依 OCR_COMPRESSION 的順序選第一個雙方都支援的編碼（設為空字串停用）；
+# zstd 需要安裝 zstandard。小於 OCR_COMPRESS_MIN_BYTES 的回應不壓縮
+COMPRESSION = [e.strip() for e in os.getenv("OCR_COMPRESSION", "zstd,gzip").split(",") if e.strip()]
+COMPRESS_MIN_BYTES = int(os.getenv("OCR_COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("OCR_GZIP_LEVEL", "6"))
+ZSTD_LEVEL = int(os.getenv("OCR_ZSTD_LEVEL", "3"))
+
+# response_format 參數 -> Content-Type
+RESPONSE_FORMATS = {
+    "json": "application/json",
+    "msgpack": "application/msgpack",
+}
+_MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+
+# 以 fields 選取欄位時一律保留，讓客戶端仍能判斷成功與失敗
+_ALWAYS_FIELDS = ("status", "error", "detail")
+
+logger = logging.getLogger(__name__)
+
+
+class FormatError(Exception):
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+@dataclass(frozen=True)
+class ResponseOptions:
+    """
+    一個請求協商出的回應格式
+    """
+    # 欄位樹：{"full_text": None, "pages": {"text": None}}，None 代表整個值；fields 為 None 時不選取
+    fields: Optional[Dict] = None
+    format: str = "json"
+    # gzip／zstd；None 代表不壓縮
+    encoding: Optional[str] = None
+
+
+_DEFAULT_OPTIONS = ResponseOptions()
+_response_options: contextvars.ContextVar[ResponseOptions] = contextvars.ContextVar(
+    "ocr_response_options", default=_DEFAULT_OPTIONS
+)
+
+
+def parse_fields(spec: str) -> Optional[Dict]:
+    """
+    解析 fields 參數，例如 "full_text,pages.page,pages.text"；以點號選取巢狀欄位（對清單中的每個元素套用）
+    """
+    paths = [p.strip() for p in spec.split(",") if p.strip()]
+    if not paths:
+        return None
+    tree: Dict = {}
+    for path in paths:
+        parts = path.split(".")
+        if any(not part for part in parts):
+            raise FormatError(f"無效的 fields: {path}")
+        node = tree
+        for part in parts[:-1]:
+            if part in node and node[part] is None:
+                # 已選取整個欄位
+                break
+            node = node.setdefault(part, {})
+        else:
+            node[parts[-1]] = None
+    return tree
+
+
+def select_fields(value, fields: Optional[Dict]):
+    if fields is None:
+        return value
+    if isinstance(value, list):
+        return [select_fields(item, fields) for item in value]
+    if not isinstance(value, dict):
+        return value
+    return {
+        key: select_fields(item, fields[key]) if key in fields else item
+        for key, item in value.items()
+        if key in fields or key in _ALWAYS_FIELDS
+    }
+
+
+def _accepted_encodings(header: str) -> set:
+    accepted = set()
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, val = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(val)
+                except ValueError:
+                    q = 0.0
+        if name and q > 0:
+            accepted.add(name.strip().lower())
+    return accepted
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    accepted = _accepted_encodings(accept_encoding)
+    for encoding in COMPRESSION:
+        if encoding == "zstd" and zstandard is None:
+            continue
+        if encoding not in ("gzip", "zstd"):
+            continue
+        if encoding in accepted or "*" in accepted:
+            return encoding
+    return None
+
+
+def parse_options(scope) -> ResponseOptions:
+    """
+    由查詢參數 fields、response_format 與 Accept／Accept-Encoding 標頭決定回應格式
+    """
+    headers = {}
+    for name, value in scope.get("headers", []):
+        headers[name.decode("latin-1")] = value.decode("latin-1")
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+
+    fields = parse_fields(",".join(query.get("fields", [])))
+
+    fmt = query.get("response_format", [""])[-1].lower()
+    if fmt:
+        if fmt not in RESPONSE_FORMATS:
+            raise FormatError(f"不支持的回應格式: {fmt}（可用: {', '.join(RESPONSE_FORMATS)}）")
+        if fmt == "msgpack" and msgpack is None:
+            raise FormatError("伺服器未安裝 msgpack，無法以 MessagePack 回應", status_code=406)
+    elif msgpack is not None and any(t in headers.get("accept", "") for t in _MSGPACK_MEDIA_TYPES):
+        fmt = "msgpack"
+    else:
+        fmt = "json"
+
+    return ResponseOptions(
+        fields=fields,
+        format=fmt,
+        encoding=negotiate_encoding(headers.get("accept-encoding", "")),
+    )
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def encode_response(content) -> Tuple[bytes, str, Optional[str]]:
+    """
+    依目前請求的回應格式選取欄位、序列化並壓縮，回傳 (body, Content-Type, Content-Encoding)
+    """
+    options = _response_options.get()
+    with stage("serialize"):
+        content = select_fields(content, options.fields)
+        if options.format == "msgpack":
+            body = msgpack.packb(content, use_bin_type=True)
+        else:
+            body = json.dumps(
+                content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+            ).encode("utf-8")
+    encoding = None
+    if options.encoding and len(body) >= COMPRESS_MIN_BYTES:
+        with stage("compress"):
+            body = compress(body, options.encoding)
+        encoding = options.encoding
+    return body, RESPONSE_FORMATS[options.format], encoding
+
+
+class ResponseFormatMiddleware:
+    """
+    解析每個請求的回應格式選項並放入 contextvars，由 TimedJSONResponse 在序列化時取用；
+    選項無效時直接回應錯誤，不進入端點
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        try:
+            options = parse_options(scope)
+        except FormatError as e:
+            response = JSONResponse({"status": "error", "error": str(e)}, status_code=e.status_code)
+            await response(scope, receive, send)
+            return
+
+        token = _response_options.set(options)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _response_options.reset(token)
@@ -0,0 +1,299 @@
+import os
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+from app.metrics import Gauge, PAGES, register, stage
+from app.ocr import OCRResult, run_ocr_image, PdfPages
+from app.pagefilter import PageFilter
+from app.pipeline import PipelinedPdfPages, pipelined_pdf_pages
+from app.scheduler import BULK_LANE, current_lane, lane_context
+
+logger = logging.getLogger(__name__)
+
+# 非同步 PDF 任務：狀態存在 SQLite，重啟後未完成的任務會從下一個未完成頁繼續
+JOBS_DIR = Path(os.getenv("OCR_JOBS_DIR", "./jobs"))
+JOB_WORKERS = int(os.getenv("OCR_JOB_WORKERS", "1"))
+JOB_MAX_PENDING = int(os.getenv("OCR_JOB_MAX_PENDING", "100"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    filename TEXT,
+    pdf_path TEXT NOT NULL,
+    prompt TEXT,
+    encrypted INTEGER NOT NULL DEFAULT 0,
+    page_count INTEGER,
+    pages_done INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE TABLE IF NOT EXISTS job_pages (
+    job_id TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    text TEXT,
+    lines TEXT,
+    elapsed_ms INTEGER,
+    source TEXT,
+    duplicate_of INTEGER,
+    PRIMARY KEY (job_id, page)
+);
+"""
+
+# 舊版資料庫的 job_pages 沒有這些欄位，啟動時補上
+_PAGE_COLUMNS = {"source": "TEXT", "duplicate_of": "INTEGER"}
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class JobStore:
+    """
+    任務與每頁結果的 SQLite 儲存
+    """
+
+    def __init__(self, db_path: Path):
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.executescript(_SCHEMA)
+            existing = {r["name"] for r in self._conn.execute("PRAGMA table_info(job_pages)")}
+            for column, kind in _PAGE_COLUMNS.items():
+                if column not in existing:
+                    self._conn.execute(f"ALTER TABLE job_pages ADD COLUMN {column} {kind}")
+
+    def create(self, job_id: str, filename: str, pdf_path: str, prompt: Optional[str], encrypted: bool):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, filename, pdf_path, prompt, encrypted, created_at) "
+                "VALUES (?, 'queued', ?, ?, ?, ?, ?)",
+                (job_id, filename, pdf_path, prompt, int(encrypted), time.time()),
+            )
+
+    def update(self, job_id: str, **fields):
+        columns = ", ".join(f"{k} = ?" for k in fields)
+        with self._lock, self._conn:
+            self._conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def save_page(
+        self,
+        job_id: str,
+        page: int,
+        text: str,
+        lines: list,
+        elapsed_ms: int,
+        source: str = "ocr",
+        duplicate_of: Optional[int] = None,
+    ):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO job_pages (job_id, page, text, lines, elapsed_ms, source, duplicate_of) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, page, text, json.dumps(lines, ensure_ascii=False), elapsed_ms, source, duplicate_of),
+            )
+            self._conn.execute(
+                "UPDATE jobs SET pages_done = (SELECT COUNT(*) FROM job_pages WHERE job_id = ?) WHERE id = ?",
+                (job_id, job_id),
+            )
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def pages(self, job_id: str) -> list:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT page, text, lines, elapsed_ms, source, duplicate_of FROM job_pages WHERE job_id = ? ORDER BY page",
+                (job_id,),
+            ).fetchall()
+        pages = []
+        for r in rows:
+            # 與 /ocr/pdf 的記錄相同：source 標示空白頁、重複頁，重複頁附上沿用的頁碼
+            record = {
+                "page": r["page"],
+                "text": r["text"],
+                "lines": json.loads(r["lines"]),
+                "elapsed_ms": r["elapsed_ms"],
+                "source": r["source"] or "ocr",
+            }
+            if r["duplicate_of"] is not None:
+                record["duplicate_of"] = r["duplicate_of"]
+            pages.append(record)
+        return pages
+
+    def done_pages(self, job_id: str) -> set:
+        with self._lock:
+            rows = self._conn.execute("SELECT page FROM job_pages WHERE job_id = ?", (job_id,)).fetchall()
+        return {r["page"] for r in rows}
+
+    def unfinished(self) -> list:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM jobs WHERE status IN ('queued', 'running') ORDER BY created_at"
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    def count_pending(self) -> int:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')"
+            ).fetchone()
+        return row[0]
+
+
+class JobManager:
+    """
+    以固定大小的執行緒池處理 PDF 任務
+    """
+
+    def __init__(self, store: JobStore, workers: int, max_pending: int):
+        self.store = store
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="ocr-job")
+        # PDF 密碼只保留在記憶體中，不寫入資料庫
+        self._passwords = {}
+        # 提交任務的請求所屬的 (lane, 租戶)；服務重啟後接續的任務改走 bulk lane
+        self._lanes = {}
+
+    def submit_pdf(self, pdf_bytes: bytes, filename: str, prompt: Optional[str], password: Optional[str]) -> str:
+        if self.store.count_pending() >= self.max_pending:
+            raise JobQueueFull(f"待處理任務已達上限 ({self.max_pending})")
+
+        job_id = uuid.uuid4().hex
+        pdf_path = JOBS_DIR / f"{job_id}.pdf"
+        pdf_path.parent.mkdir(parents=True, exist_ok=True)
+        pdf_path.write_bytes(pdf_bytes)
+
+        self.store.create(job_id, filename, str(pdf_path), prompt, encrypted=bool(password))
+        if password:
+            self._passwords[job_id] = password
+        self._lanes[job_id] = current_lane()
+        self._executor.submit(self._run, job_id)
+        return job_id
+
+    def resume_unfinished(self) -> int:
+        """
+        重新排入上次關機時尚未完成的任務
+        """
+        resumed = 0
+        for job in self.store.unfinished():
+            if job["encrypted"] and job["id"] not in self._passwords:
+                self.store.update(
+                    job["id"], status="failed", finished_at=time.time(),
+                    error="服務重啟後無法取得 PDF 密碼，請重新提交任務",
+                )
+                continue
+            self.store.update(job["id"], status="queued")
+            self._executor.submit(self._run, job["id"])
+            resumed += 1
+        return resumed
+
+    def _run(self, job_id: str):
+        job = self.store.get(job_id)
+        if not job:
+            return
+        pdf_path = job["pdf_path"]
+        self.store.update(job_id, status="running", started_at=job["started_at"] or time.time())
+        logger.info("任務 %s 開始處理", job_id)
+        lane, tenant = self._lanes.pop(job_id, (BULK_LANE, "jobs"))
+
+        try:
+            pdf_pages = pipelined_pdf_pages(
+                PdfPages(pdf_path, dpi=200, user_password=self._passwords.get(job_id))
+            )
+            # 任務的每一頁都以提交請求的 lane 排程
+            with lane_context(lane, tenant), pdf_pages:
+                self.store.update(job_id, page_count=pdf_pages.page_count)
+                done = self.store.done_pages(job_id)
+                # 只渲染尚未完成的頁面
+                pdf_pages.page_numbers = [p for p in pdf_pages.page_numbers if p not in done]
+                self._run_pages(job_id, job["prompt"], pdf_pages)
+
+            self.store.update(job_id, status="done", finished_at=time.time())
+            logger.info("任務 %s 完成", job_id)
+        except Exception as e:
+            logger.exception("任務 %s 失敗: %s", job_id, e)
+            self.store.update(job_id, status="failed", error=str(e), finished_at=time.time())
+        finally:
+            self._passwords.pop(job_id, None)
+            job = self.store.get(job_id)
+            if job and job["status"] in ("done", "failed") and os.path.exists(pdf_path):
+                os.remove(pdf_path)
+
+    def _run_pages(self, job_id: str, prompt: Optional[str], pdf_pages: PipelinedPdfPages):
+        # 空白頁不推論、重複頁沿用先前頁面的結果（依伺服器的 OCR_SKIP_BLANK_PAGES／OCR_DEDUPE_PAGES）
+        page_filter = PageFilter()
+        ocr_results = {}
+        for page, img in pdf_pages:
+            t0 = time.time()
+            with stage("page_filter"):
+                kind, ref_page = page_filter.check(page, img)
+            if kind == "blank":
+                result = OCRResult("", [], source="blank")
+            elif kind == "duplicate":
+                result = OCRResult(ocr_results[ref_page].text, ocr_results[ref_page].lines, source="duplicate")
+            else:
+                result = run_ocr_image(img, prompt)
+                if page_filter.dedupe:
+                    ocr_results[page] = result
+            PAGES.inc(source=result.source)
+            elapsed_ms = int((time.time() - t0) * 1000)
+            self.store.save_page(job_id, page, result.text, result.lines, elapsed_ms, result.source, ref_page)
+
+    def status(self, job_id: str, include_pages: bool = True) -> Optional[dict]:
+        job = self.store.get(job_id)
+        if not job:
+            return None
+        end = job["finished_at"] or time.time()
+        result = {
+            "job_id": job["id"],
+            "status": job["status"],
+            "filename": job["filename"],
+            "page_count": job["page_count"],
+            "pages_done": job["pages_done"],
+            "progress": round(job["pages_done"] / job["page_count"], 4) if job["page_count"] else 0.0,
+            "error": job["error"],
+            "timing": {
+                "created_at": job["created_at"],
+                "started_at": job["started_at"],
+                "finished_at": job["finished_at"],
+                "queued_ms": int(((job["started_at"] or end) - job["created_at"]) * 1000),
+                "elapsed_ms": int((end - job["started_at"]) * 1000) if job["started_at"] else 0,
+            },
+        }
+        if include_pages:
+            result["pages"] = self.store.pages(job_id)
+        return result
+
+
+_manager: Optional[JobManager] = None
+_manager_lock = threading.Lock()
+
+
+def get_job_manager() -> JobManager:
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = JobManager(JobStore(JOBS_DIR / "jobs.db"), JOB_WORKERS, JOB_MAX_PENDING)
+    return _manager
+
+
+register(Gauge(
+    "ocr_jobs_pending",
+    "Queued and running PDF jobs",
+    lambda: {(): _manager.store.count_pending()} if _manager else {},
+))
@@ -1,64 +1,419 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException, Request, UploadFile, File, Form
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel, ValidationError
+from typing import List, Optional
 import time
+import asyncio
 import shutil
 from pathlib import Path
 import tempfile
 import os
+import json
+import logging
+import uuid
 import traceback
+from urllib.parse import quote
+from contextlib import closing
 
-from app.ocr import run_ocr, run_ocr_local, runtime_meta, pdf_to_images_high_quality
+from app.ocr import (
+    decode_base64_image, load_image_bytes, run_ocr_bytes, run_ocr_local, run_ocr_image, runtime_meta, stream_ocr,
+    OCRResult, PdfPages, PageRangeError, PageRenderError
+)
+from app.admission import Overloaded, get_admission
+from app.backend import get_backend, preload_in_background
+from app.batching import get_batcher
+from app.batch_ocr import (
+    BatchInputError, check_batch_size, items_from_base64, items_from_bytes, items_from_zip, run_ocr_batch
+)
+from app.cache import get_cache
+from app.checkpoints import CHECKPOINT_ENABLED, Checkpoint, document_hash, settings_key
+from app.documents import (
+    IMAGE_FORMATS, RENDER_DEFAULT_DPI, DocumentError, get_document_store, parse_render_options
+)
+from app.fetch import FetchError, close_async_client, fetch_image_bytes
+from app.formats import ResponseFormatMiddleware, encode_response
+from app.pipeline import PipelinedPdfPages, pipelined_pdf_pages
+from app.jobs import JobQueueFull, get_job_manager
+from app.pagefilter import DEDUPE_PAGES, SKIP_BLANK_PAGES, PageFilter
+from app.metrics import MetricsMiddleware, PAGES, render_prometheus, request_timings, stage
+from app.resolution import ResolutionModeError, parse_mode
+from app.scheduler import LaneMiddleware, get_scheduler
+from app.searchable import SearchablePdfWriter
+from app.schemas import HealthResponse
 
-app = FastAPI(title="DeepSeek OCR API")
+# 只調整本服務的 logger；DEBUG 層級的訊息在未啟用時不會格式化
+LOG_LEVEL = os.getenv("OCR_LOG_LEVEL", "INFO").upper()
+logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logging.getLogger("app").setLevel(LOG_LEVEL)
+logger = logging.getLogger(__name__)
 
-# 原有的 URL 請求模型
+class TimedJSONResponse(JSONResponse):
+    """
+    依請求協商的格式（fields 選取、JSON 或 MessagePack、gzip／zstd 壓縮）序列化回應，
+    耗時記錄為 serialize 與 compress 階段
+    """
+
+    def render(self, content) -> bytes:
+        body, self.media_type, self.content_encoding = encode_response(content)
+        return body
+
+    def init_headers(self, headers=None):
+        super().init_headers(headers)
+        if self.content_encoding:
+            self.raw_headers.append((b"content-encoding", self.content_encoding.encode("latin-1")))
+        self.raw_headers.append((b"vary", b"Accept, Accept-Encoding"))
+
+app = FastAPI(title="DeepSeek OCR API", default_response_class=TimedJSONResponse)
+app.add_middleware(ResponseFormatMiddleware)
+app.add_middleware(LaneMiddleware)
+app.add_middleware(MetricsMiddleware)
+
+# /ocr/urls 一次最多接受的 URL 數
+FETCH_MAX_URLS = int(os.getenv("OCR_FETCH_MAX_URLS", "32"))
+
+@app.on_event("startup")
+def preload_model():
+    # 預設在背景載入模型，API 先啟動；OCR_PRELOAD=0 則延遲到第一個請求才載入
+    if os.getenv("OCR_PRELOAD", "1") != "0":
+        preload_in_background()
+
+    # 重新排入上次未完成的 PDF 任務
+    resumed = get_job_manager().resume_unfinished()
+    if resumed:
+        logger.info("已重新排入 %d 個未完成任務", resumed)
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    # 滿載時立即回應，讓客戶端或負載平衡器依 Retry-After 重試
+    return TimedJSONResponse(
+        {"status": "error", "detail": str(exc), "retry_after": exc.retry_after},
+        status_code=503,
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+@app.on_event("shutdown")
+async def close_http_clients():
+    await close_async_client()
+
+@app.on_event("shutdown")
+def stop_model_workers():
+    get_backend().close()
+
+# 原有的 URL 請求模型（image_url 與 image_base64 擇一）
 class OCRRequest(BaseModel):
-    image_url: str
+    image_url: str = None
+    image_base64: str = None
     prompt: str = None
+    mode: str = None
+    stream: str = None
+
+# 新增：多個 URL 請求模型
+class OCRUrlsRequest(BaseModel):
+    image_urls: List[str]
+    prompt: str = None
+    mode: str = None
+
+# 新增：批次 Base64 請求模型
+class OCRBatchImage(BaseModel):
+    image_base64: str
+    name: str = None
+
+class OCRBatchRequest(BaseModel):
+    images: List[OCRBatchImage]
+    prompt: str = None
+    mode: str = None
 
 # 新增：本地路徑請求模型
 class OCRLocalRequest(BaseModel):
     image_path: str
     prompt: str = None
+    mode: str = None
+
+def _resolution_mode(name: Optional[str]):
+    """
+    解析請求的解析度模式（tiny/small/base/large/gundam/auto），未指定時使用 OCR_RESOLUTION_MODE
+    """
+    try:
+        return parse_mode(name)
+    except ResolutionModeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _stream_format(stream: Optional[str]) -> Optional[str]:
+    if stream and stream not in _STREAM_MEDIA_TYPES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"不支持的串流格式。支持: {', '.join(_STREAM_MEDIA_TYPES)}"
+        )
+    return stream
+
+def _stream_ocr_records(image, prompt: str, mode, fmt: str, t0: float):
+    """
+    將 stream_ocr 的輸出轉成 NDJSON / SSE 記錄：生成中逐段送出 {"type": "delta", "text"}，
+    最後送出與非串流回應相同欄位的 {"type": "result", ...}；失敗時送出 error 記錄
+    """
+    first_token_ms = None
+    result = None
+    try:
+        with closing(stream_ocr(image, prompt, mode)) as items:
+            for item in items:
+                if isinstance(item, OCRResult):
+                    result = item
+                    continue
+                if first_token_ms is None:
+                    first_token_ms = int((time.time() - t0) * 1000)
+                yield _format_stream_record({"type": "delta", "text": item}, fmt)
+    except Exception as e:
+        logger.exception("串流 OCR 失敗: %s", e)
+        yield _format_stream_record({"type": "error", "status": "error", "error": str(e)}, fmt)
+        return
+    record = {
+        "type": "result",
+        "status": "ok",
+        "full_text": result.text,
+        "lines": result.lines,
+        "cached": result.cached,
+        "mode": result.mode,
+        "first_token_ms": first_token_ms,
+        "elapsed_ms": int((time.time() - t0) * 1000),
+        "meta": runtime_meta(),
+    }
+    # 串流的標頭在處理前就已送出，階段耗時明細改放在最後的記錄中
+    timings = request_timings()
+    if timings is not None:
+        record["timings"] = timings
+    yield _format_stream_record(record, fmt)
 
 @app.get("/")
 def read_root():
     return {"message": "DeepSeek OCR FastAPI", "meta": runtime_meta()}
 
+@app.get("/health", response_model=HealthResponse)
+def health_endpoint():
+    """
+    就緒檢查：模型載入完成前回傳 503，方便負載平衡器判斷
+    """
+    backend = get_backend()
+    batcher = get_batcher()
+    cache = get_cache()
+    if backend.ready:
+        status = "ok"
+    elif backend.load_error:
+        status = "error"
+    else:
+        status = "loading"
+    meta = backend.meta()
+    body = HealthResponse(
+        status=status,
+        device=meta["device"],
+        model_id=meta["model_id"],
+        backend=backend.name,
+        extra={
+            "load_seconds": backend.load_seconds,
+            "warmup_seconds": backend.warmup_seconds,
+            "load_error": backend.load_error,
+            "batching": batcher.stats() if batcher else None,
+            "cache": cache.stats() if cache else None,
+            "admission": get_admission().stats(),
+            "scheduler": get_scheduler().stats(),
+            "worker_pool": backend.stats(),
+        },
+    )
+    return TimedJSONResponse(body.model_dump(), status_code=200 if status == "ok" else 503)
+
+@app.get("/metrics")
+def metrics_endpoint():
+    """
+    Prometheus 文字格式的指標：各階段耗時直方圖、頁數、token 數、錯誤數與佇列深度
+    """
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+@app.get("/cache/stats")
+def cache_stats_endpoint():
+    """
+    OCR 結果快取的命中／未命中統計
+    """
+    cache = get_cache()
+    return {"enabled": cache is not None, **(cache.stats() if cache else {})}
+
 # 原有的 URL 端點
 @app.post("/ocr")
-def ocr_endpoint(req: OCRRequest):
+async def ocr_endpoint(req: OCRRequest):
+    """
+    下載 URL 圖片（或解碼 image_base64）進行 OCR（下載不佔用工作執行緒，推論在執行緒池中執行）
+    stream=ndjson 或 stream=sse 時，模型生成中的文字逐段送出，最後送出完整結果
+    """
+    if bool(req.image_url) == bool(req.image_base64):
+        raise HTTPException(status_code=400, detail="image_url 與 image_base64 必須擇一提供")
+    mode = _resolution_mode(req.mode)
+    stream = _stream_format(req.stream)
+    admission = get_admission()
     try:
         t0 = time.time()
-        full_text, lines = run_ocr(req.image_url, req.prompt)
+        ticket = admission.admit()
+        try:
+            if req.image_url:
+                data = await fetch_image_bytes(req.image_url)
+            else:
+                data = decode_base64_image(req.image_base64)
+            if stream:
+                # 串流結束才釋放名額
+                image = await admission.call(load_image_bytes, data)
+                response = StreamingResponse(
+                    admission.iterate(ticket, _stream_ocr_records(image, req.prompt, mode, stream, t0)),
+                    media_type=_STREAM_MEDIA_TYPES[stream],
+                )
+                ticket = None
+                return response
+            result = await admission.call(run_ocr_bytes, data, req.prompt, mode)
+        finally:
+            if ticket is not None:
+                ticket.release()
         elapsed_ms = int((time.time() - t0) * 1000)
         return {
-            "full_text": full_text,
-            "lines": lines,
+            "full_text": result.text,
+            "lines": result.lines,
+            "cached": result.cached,
+            "mode": result.mode,
             "elapsed_ms": elapsed_ms,
             "meta": runtime_meta(),
         }
+    except FetchError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Overloaded:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+async def _ocr_one_url(image_url: str, limit: asyncio.Semaphore, prompt: str = None, mode=None) -> dict:
+    t0 = time.time()
+    try:
+        data = await fetch_image_bytes(image_url)
+        async with limit:
+            result = await get_admission().call(run_ocr_bytes, data, prompt, mode)
+    except Exception as e:
+        return {"image_url": image_url, "status": "error", "error": str(e)}
+    return {
+        "image_url": image_url,
+        "status": "ok",
+        "full_text": result.text,
+        "lines": result.lines,
+        "cached": result.cached,
+        "mode": result.mode,
+        "elapsed_ms": int((time.time() - t0) * 1000),
+    }
+
+@app.post("/ocr/urls")
+async def ocr_urls_endpoint(req: OCRUrlsRequest):
+    """
+    同時下載多個 URL 並逐一 OCR：每張圖片下載完成就開始推論，與其他圖片的下載重疊
+    Example: {"image_urls": ["https://example.com/a.jpg", "https://example.com/b.jpg"]}
+    """
+    if not req.image_urls:
+        raise HTTPException(status_code=400, detail="image_urls 不可為空")
+    if len(req.image_urls) > FETCH_MAX_URLS:
+        raise HTTPException(status_code=400, detail=f"一次最多 {FETCH_MAX_URLS} 個 URL")
+    mode = _resolution_mode(req.mode)
+
+    t0 = time.time()
+    admission = get_admission()
+    # 整個請求佔用一個名額；下載全部同時進行，推論則與 /ocr/batch 相同受 fan_out_limit() 限制
+    with admission.admit():
+        limit = admission.fan_out_limit()
+        results = await asyncio.gather(*(_ocr_one_url(url, limit, req.prompt, mode) for url in req.image_urls))
+    return {
+        "status": "ok",
+        "results": results,
+        "elapsed_ms": int((time.time() - t0) * 1000),
+        "meta": runtime_meta(),
+    }
+
+def _is_zip_upload(upload) -> bool:
+    return (
+        Path(upload.filename or "").suffix.lower() == ".zip"
+        or upload.content_type in ("application/zip", "application/x-zip-compressed")
+    )
+
+async def _batch_items_from_form(request: Request):
+    form = await request.form()
+    prompt = form.get("prompt") or None
+    mode = _resolution_mode(form.get("mode") or None)
+    files = [f for f in form.getlist("files") if not isinstance(f, str)]
+    items = []
+    for upload in files:
+        data = await upload.read()
+        if _is_zip_upload(upload):
+            items.extend(await run_in_threadpool(items_from_zip, data))
+        else:
+            items.extend(items_from_bytes([(upload.filename, data)]))
+    return items, prompt, mode
+
+async def _batch_items_from_json(request: Request):
+    try:
+        req = OCRBatchRequest.model_validate_json(await request.body())
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False))
+    images = [(img.name or f"image_{i}", img.image_base64) for i, img in enumerate(req.images)]
+    return items_from_base64(images), req.prompt, _resolution_mode(req.mode)
+
+@app.post("/ocr/batch")
+async def ocr_batch_endpoint(request: Request):
+    """
+    一次請求處理多張圖片，依輸入順序回傳每張圖片的結果或錯誤（單張失敗不影響其他圖片）
+    - multipart/form-data：多個 files 欄位（圖片或 ZIP 檔），可附 prompt 與 mode
+    - application/json：{"images": [{"image_base64": "...", "name": "a.jpg"}], "prompt": "...", "mode": "auto"}
+    """
+    content_type = request.headers.get("content-type", "")
+    admission = get_admission()
+    # 整批佔用一個名額；滿載時在讀取上傳內容之前就回傳 503，各圖片在同一 lane 的執行緒池中以 fan_out_limit() 為上限並行
+    with admission.admit():
+        try:
+            if content_type.startswith("multipart/form-data"):
+                items, prompt, mode = await _batch_items_from_form(request)
+            elif content_type.startswith("application/json"):
+                items, prompt, mode = await _batch_items_from_json(request)
+            else:
+                raise HTTPException(status_code=415, detail="請以 multipart/form-data 或 application/json 上傳")
+            check_batch_size(items)
+        except BatchInputError as e:
+            raise HTTPException(status_code=e.status_code, detail=str(e))
+
+        t0 = time.time()
+        results = await run_ocr_batch(items, prompt, mode)
+    failed = sum(1 for r in results if r["status"] != "ok")
+    return {
+        "status": "ok",
+        "count": len(results),
+        "failed": failed,
+        "results": results,
+        "elapsed_ms": int((time.time() - t0) * 1000),
+        "meta": runtime_meta(),
+    }
+
 # 新增：本地文件路徑端點
 @app.post("/ocr/local")
-def ocr_local_endpoint(req: OCRLocalRequest):
+async def ocr_local_endpoint(req: OCRLocalRequest):
     """
     使用本地圖片路徑進行 OCR
-    Example: {"image_path": "F:/images/test.jpg"}
+    Example: {"image_path": "F:/images/test.jpg", "mode": "auto"}
     """
+    mode = _resolution_mode(req.mode)
     try:
         t0 = time.time()
-        full_text, lines = run_ocr_local(req.image_path, req.prompt)
+        result = await get_admission().run(run_ocr_local, req.image_path, req.prompt, mode)
         elapsed_ms = int((time.time() - t0) * 1000)
         return {
-            "full_text": full_text,
-            "lines": lines,
+            "full_text": result.text,
+            "lines": result.lines,
+            "cached": result.cached,
+            "mode": result.mode,
             "elapsed_ms": elapsed_ms,
             "meta": runtime_meta(),
         }
+    except Overloaded:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -66,12 +421,18 @@ def ocr_local_endpoint(req: OCRLocalRequest):
 @app.post("/ocr/upload")
 async def ocr_upload_endpoint(
     file: UploadFile = File(...),
-    prompt: str = None
+    prompt: str = None,
+    mode: str = None,
+    stream: str = None
 ):
     """
     上傳圖片文件進行 OCR
     支持的格式: jpg, jpeg, png, bmp, gif
+    mode 可指定解析度模式（tiny/small/base/large/gundam），auto 依圖片尺寸與文字密度自動挑選
+    stream=ndjson 或 stream=sse 時，模型生成中的文字逐段送出，最後送出完整結果
     """
+    resolution_mode = _resolution_mode(mode)
+    stream = _stream_format(stream)
     try:
         # 檢查文件類型
         allowed_extensions = {".jpg", ".jpeg", ".png", ".bmp", ".gif"}
@@ -82,116 +443,414 @@ async def ocr_upload_endpoint(
                 detail=f"不支持的文件格式。支持: {', '.join(allowed_extensions)}"
             )
         
-        # 保存上傳的文件
-        upload_dir = Path("./uploads")
-        upload_dir.mkdir(exist_ok=True)
-        
-        temp_file = upload_dir / f"upload_{int(time.time())}{file_ext}"
-        with temp_file.open("wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        # 執行 OCR
-        t0 = time.time()
-        full_text, lines = run_ocr_local(str(temp_file), prompt)
+        admission = get_admission()
+        ticket = admission.admit()
+        try:
+            # 保存上傳的文件
+            upload_dir = Path("./uploads")
+            upload_dir.mkdir(exist_ok=True)
+
+            # 同一秒內的並行上傳不能共用檔名，否則會互相覆寫
+            temp_file = upload_dir / f"upload_{int(time.time())}_{uuid.uuid4().hex[:8]}{file_ext}"
+            await run_in_threadpool(_save_upload, file, temp_file)
+
+            t0 = time.time()
+            if stream:
+                # 串流結束才釋放名額
+                records = _stream_ocr_records(str(temp_file), prompt, resolution_mode, stream, t0)
+                response = StreamingResponse(
+                    admission.iterate(ticket, records),
+                    media_type=_STREAM_MEDIA_TYPES[stream],
+                )
+                ticket = None
+                return response
+
+            # 執行 OCR（在推論執行緒池中，不阻塞事件迴圈）
+            result = await admission.call(run_ocr_local, str(temp_file), prompt, resolution_mode)
+        finally:
+            if ticket is not None:
+                ticket.release()
         elapsed_ms = int((time.time() - t0) * 1000)
         
         # 清理臨時文件（可選）
         # temp_file.unlink()
         
         return {
-            "full_text": full_text,
-            "lines": lines,
+            "full_text": result.text,
+            "lines": result.lines,
+            "cached": result.cached,
+            "mode": result.mode,
             "elapsed_ms": elapsed_ms,
             "meta": runtime_meta(),
         }
+    except Overloaded:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def _save_upload(file: UploadFile, path: Path):
+    with stage("upload_spool"), path.open("wb") as buffer:
+        shutil.copyfileobj(file.file, buffer)
+
+_STREAM_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "sse": "text/event-stream",
+}
+
+def _ocr_pdf_pages(
+    pdf_pages: PipelinedPdfPages,
+    prompt: str = None,
+    tmp_path: str = None,
+    page_filter: PageFilter = None,
+    checkpoint: Checkpoint = None
+):
+    """
+    逐頁 OCR（頁面由渲染行程池預先渲染），每完成一頁就 yield {page, text, lines}；結束時關閉 PDF 並刪除暫存檔
+    page_filter 判定為空白的頁面不做推論，重複頁沿用先前頁面的結果（記錄中附上 duplicate_of）
+    單頁渲染或推論失敗時 yield 帶有 error 的記錄並繼續下一頁；
+    有 checkpoint 時，先前已完成的頁面直接取用（記錄中附上 resumed），其餘頁面完成後立即寫入檢查點
+    """
+    # 可能被後續重複頁沿用的結果
+    ocr_results = {}
+    try:
+        done = {}
+        if checkpoint is not None:
+            with stage("checkpoint"):
+                selected = set(pdf_pages.page_numbers)
+                done = {p: r for p, r in checkpoint.load().items() if p in selected}
+            if done:
+                # 只渲染尚未完成的頁面
+                pdf_pages.page_numbers = [p for p in pdf_pages.page_numbers if p not in done]
+                logger.info("PDF 從檢查點接續：%d 頁已完成，%d 頁待處理", len(done), len(pdf_pages.page_numbers))
+        resumed = sorted(done)
+
+        def resumed_before(page_no):
+            while resumed and (page_no is None or resumed[0] < page_no):
+                PAGES.inc(source="checkpoint")
+                yield {**done[resumed.pop(0)], "resumed": True}
+
+        for page_no, img in pdf_pages:
+            yield from resumed_before(page_no)
+            logger.debug("Processing page %d...", page_no)
+            kind = ref_page = None
+            try:
+                if isinstance(img, PageRenderError):
+                    raise img
+                if isinstance(img, str):
+                    # 原生文字層可用，不需要模型
+                    result = OCRResult.from_text(img, source="text_layer")
+                    logger.debug("Page %d served from native text layer.", page_no)
+                else:
+                    if page_filter is not None:
+                        with stage("page_filter"):
+                            kind, ref_page = page_filter.check(page_no, img)
+                    if kind == "duplicate" and ref_page not in ocr_results:
+                        # 被沿用的頁面推論失敗，這一頁仍需自行推論
+                        kind = ref_page = None
+                    if kind == "blank":
+                        result = OCRResult("", [], source="blank")
+                        logger.debug("Page %d is blank, skipped.", page_no)
+                    elif kind == "duplicate":
+                        ref = ocr_results[ref_page]
+                        result = OCRResult(ref.text, ref.lines, cached=ref.cached, source="duplicate", mode=ref.mode)
+                        logger.debug("Page %d duplicates page %d, result reused.", page_no, ref_page)
+                    else:
+                        # 頁面圖片直接在記憶體中交給模型，不寫入暫存 JPEG
+                        result = run_ocr_image(img, prompt) # <-- 核心 OCR 步驟
+                        if page_filter is not None and page_filter.dedupe:
+                            ocr_results[page_no] = result
+                        logger.debug("OCR complete for page %d.", page_no)
+            except Exception as e:
+                # 單頁失敗不中止整份文件；失敗的頁面不寫入檢查點，重送時會再處理
+                logger.exception("PDF 第 %d 頁失敗: %s", page_no, e)
+                PAGES.inc(source="error")
+                yield {
+                    "page": page_no,
+                    "text": "",
+                    "lines": [],
+                    "cached": False,
+                    "source": "error",
+                    "mode": None,
+                    "error": str(e),
+                }
+                continue
+            finally:
+                del img
+            PAGES.inc(source=result.source)
+
+            record = {
+                "page": page_no,
+                "text": result.text,
+                "lines": result.lines,
+                "cached": result.cached,
+                "source": result.source,
+                "mode": result.mode
+            }
+            if kind == "duplicate":
+                record["duplicate_of"] = ref_page
+            if checkpoint is not None:
+                with stage("checkpoint"):
+                    checkpoint.save(record)
+            yield record
+        yield from resumed_before(None)
+    finally:
+        pdf_pages.close()
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+            logger.debug("Temp PDF file %s removed.", tmp_path)
+
+def _new_pdf_summary() -> dict:
+    return {"skipped": {"blank": [], "duplicate": []}, "failed": [], "resumed": []}
+
+def _note_page(summary: dict, page_result: dict):
+    """
+    累計逐頁結果：跳過推論的頁面（空白頁的頁碼，以及重複頁與其沿用的頁碼）、失敗的頁面與從檢查點取用的頁面
+    """
+    if page_result.get("resumed"):
+        summary["resumed"].append(page_result["page"])
+    if page_result["source"] == "error":
+        summary["failed"].append({"page": page_result["page"], "error": page_result["error"]})
+    elif page_result["source"] == "blank":
+        summary["skipped"]["blank"].append(page_result["page"])
+    elif page_result["source"] == "duplicate":
+        summary["skipped"]["duplicate"].append({"page": page_result["page"], "duplicate_of": page_result["duplicate_of"]})
+
+def _format_stream_record(record: dict, fmt: str) -> str:
+    with stage("serialize"):
+        data = json.dumps(record, ensure_ascii=False)
+    if fmt == "sse":
+        return f"event: {record['type']}\ndata: {data}\n\n"
+    return data + "\n"
+
+def _stream_pdf_results(pages, fmt: str, t0: float, checkpoint: Checkpoint = None):
+    """
+    將逐頁結果轉成 NDJSON / SSE 記錄，最後附上摘要；中途失敗時送出 error 記錄
+    """
+    page_count = 0
+    summary = _new_pdf_summary()
+    try:
+        for page_result in pages:
+            page_count += 1
+            _note_page(summary, page_result)
+            yield _format_stream_record({"type": "page", **page_result}, fmt)
+    except Exception as e:
+        logger.exception("PDF 串流於第 %d 頁失敗", page_count + 1)
+        yield _format_stream_record({
+            "type": "error",
+            "status": "error",
+            "page": page_count + 1,
+            "error": str(e),
+        }, fmt)
+        return
+    summary = {
+        "type": "summary",
+        "status": "partial" if summary["failed"] else "ok",
+        "page_count": page_count,
+        **summary,
+        "document_sha256": checkpoint.document if checkpoint else None,
+        "elapsed_ms": int((time.time() - t0) * 1000),
+        "meta": runtime_meta(),
+    }
+    # 串流的標頭在處理前就已送出，階段耗時明細改放在摘要中
+    timings = request_timings()
+    if timings is not None:
+        summary["timings"] = timings
+    yield _format_stream_record(summary, fmt)
+
+# 不加文字層的頁面：已有原生文字、空白或失敗
+_NO_TEXT_LAYER_SOURCES = ("text_layer", "blank", "error")
+
+def _stream_searchable_pdf(pages, writer: SearchablePdfWriter, t0: float):
+    """
+    output=pdf：先送出原檔內容，之後每次增量寫出就送出新增的位元組，最後送出移除未選取頁面後的更新
+    PDF 的標頭在處理前就已送出，中途失敗時只能中斷串流（單頁失敗不影響，該頁不加文字層）
+    """
+    page_count = 0
+    summary = _new_pdf_summary()
+    try:
+        yield from writer.read_available()
+        for page_result in pages:
+            page_count += 1
+            _note_page(summary, page_result)
+            if page_result["source"] not in _NO_TEXT_LAYER_SOURCES:
+                writer.add_text_layer(page_result["page"], page_result["lines"])
+            yield from writer.read_available()
+        writer.finish()
+        yield from writer.read_available()
+        logger.info(
+            "可搜尋 PDF 完成：%d 頁，失敗 %s，耗時 %d ms",
+            page_count, [f["page"] for f in summary["failed"]], int((time.time() - t0) * 1000)
+        )
+    except Exception:
+        logger.exception("可搜尋 PDF 於第 %d 頁失敗，串流中斷", page_count + 1)
+        raise
+    finally:
+        pages.close()
+        writer.close()
+
+def _save_temp_pdf(data: bytes) -> str:
+    with stage("upload_spool"), tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
+        tmp.write(data)
+        return tmp.name
+
+def _open_pdf_pages(tmp_path: str, **options) -> PipelinedPdfPages:
+    try:
+        return pipelined_pdf_pages(PdfPages(tmp_path, **options))
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+def _collect_pdf_results(
+    pdf_pages: PipelinedPdfPages,
+    prompt: str = None,
+    tmp_path: str = None,
+    page_filter: PageFilter = None,
+    checkpoint: Checkpoint = None
+):
+    """
+    非串流模式：逐頁 OCR 並整合全文（在推論執行緒池中執行；失敗的頁面不列入全文）
+    """
+    all_text = ""
+    page_texts = []
+    summary = _new_pdf_summary()
+    page_results = _ocr_pdf_pages(pdf_pages, prompt, tmp_path, page_filter, checkpoint)
+    try:
+        for page_result in page_results:
+            if page_result["source"] != "error":
+                all_text += f"\n\n[Page {page_result['page']}]\n" + page_result["text"]
+            page_texts.append(page_result)
+            _note_page(summary, page_result)
+    finally:
+        page_results.close()
+    return all_text.strip(), page_texts, summary
+
 @app.post("/ocr/pdf")
 async def ocr_pdf_endpoint(
     file: UploadFile = File(...),
     prompt: str = Form(None), 
-    password: str = Form(None)
+    password: str = Form(None),
+    stream: str = Form(None),
+    pages: str = Form(None),
+    grayscale: bool = Form(False),
+    native_text: bool = Form(False),
+    mode: str = Form(None),
+    skip_blank: bool = Form(None),
+    dedupe: bool = Form(None),
+    resume: bool = Form(True),
+    output: str = Form("json")
 ):
     """
-    上傳 PDF 檔，會自動分頁轉圖片並逐頁 OCR。
+    上傳 PDF 檔，會自動分頁轉圖片並逐頁 OCR（pages 可指定範圍，例如 "1-3,5"）。
+    grayscale=true 時以灰階渲染頁面，減少渲染與傳輸的像素資料量。
+    mode 指定解析度模式，頁面只渲染到該模式需要的解析度；mode=auto 時每頁依尺寸與文字密度各自挑選。
+    skip_blank／dedupe 控制是否跳過空白頁、是否讓重複頁沿用先前頁面的結果（未指定時依伺服器設定，預設關閉），
+    跳過的頁面列在回應的 skipped 中。
+    native_text=true 時，具有可用原生文字層的頁面直接取用文字，只有掃描頁才交給模型（每頁回傳 source）。
+    單頁失敗不會中止整份文件：該頁回傳 error 並列在 failed 中（status 為 partial）。
+    每完成一頁就寫入以文件內容雜湊為鍵的檢查點；相同文件以相同參數重送時，只處理尚未完成或失敗的頁面
+    （取用的頁面列在 resumed 中），resume=false 則捨棄既有檢查點重新處理。
     回傳整合後全文與每頁分行結果。
+    stream=ndjson 或 stream=sse 時改為每完成一頁就送出 {page, text, lines}，最後送出摘要。
+    output=pdf 時回傳加上不可見 OCR 文字層的可搜尋 PDF（原頁面不重新編碼），邊處理邊以增量更新串流送出。
     """
-    print("\n[DEBUG] --- /ocr/pdf endpoint hit ---")
-    if password:
-        print(f"[DEBUG] Received password: {'*' * len(password)}")
+    logger.debug("/ocr/pdf endpoint hit (password: %s)", "yes" if password else "no")
+    _stream_format(stream)
+    if output not in ("json", "pdf"):
+        raise HTTPException(status_code=400, detail="不支持的輸出格式。支持: json, pdf")
+    if output == "pdf" and stream:
+        raise HTTPException(status_code=400, detail="output=pdf 不能與 stream 同時使用")
+    resolution_mode = _resolution_mode(mode)
+    page_filter = PageFilter(
+        skip_blank=SKIP_BLANK_PAGES if skip_blank is None else skip_blank,
+        dedupe=DEDUPE_PAGES if dedupe is None else dedupe,
+    )
+    t0 = time.time()
+    # 整份 PDF 佔用一個名額；滿載時在讀取檔案之前就回傳 503
+    admission = get_admission()
+    ticket = admission.admit()
     try:
         # === 1. 暫存上傳的 PDF ===
-        print("[DEBUG] 1. Saving PDF to temp file...")
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-            tmp.write(await file.read())
-            tmp_path = tmp.name
-        print(f"[DEBUG] 1. PDF saved to: {tmp_path}")
-
-        # === 2. 將 PDF 拆成圖片 ===
-        print("[DEBUG] 2. Converting PDF to images...")
-        images = pdf_to_images_high_quality(
-            tmp_path, 
-            dpi=200, 
-            user_password=password
+        data = await file.read()
+        tmp_path = await run_in_threadpool(_save_temp_pdf, data)
+        logger.debug("PDF saved to: %s", tmp_path)
+
+        checkpoint = None
+        if CHECKPOINT_ENABLED:
+            with stage("checkpoint"):
+                checkpoint = Checkpoint(await run_in_threadpool(document_hash, data), settings_key(
+                    prompt=prompt, mode=getattr(resolution_mode, "name", resolution_mode), dpi=200,
+                    grayscale=grayscale, native_text=native_text,
+                    skip_blank=page_filter.skip_blank, dedupe=page_filter.dedupe,
+                ))
+                if not resume:
+                    await run_in_threadpool(checkpoint.clear)
+        del data
+
+        # === 2. 開啟 PDF，頁面在迭代時才渲染 ===
+        pdf_pages = await admission.call(
+            _open_pdf_pages, tmp_path, dpi=200, user_password=password, pages=pages,
+            grayscale=grayscale, native_text=native_text, mode=resolution_mode, page_errors=True
         )
-        print(f"[DEBUG] 2. PDF converted to {len(images)} image(s).")
-        os.remove(tmp_path)
-        print(f"[DEBUG] 2. Temp PDF file {tmp_path} removed.")
+        logger.debug("PDF has %d page(s), %d selected.", pdf_pages.page_count, len(pdf_pages))
 
-        all_text = ""
-        all_lines = []
-        page_texts = []
+        # === 3. 可搜尋 PDF：在原檔副本上逐頁加文字層，邊寫邊送 ===
+        if output == "pdf":
+            try:
+                writer = await admission.call(
+                    SearchablePdfWriter, tmp_path, tmp_path[:-len(".pdf")] + "_searchable.pdf",
+                    password, list(pdf_pages.page_numbers)
+                )
+            except Exception:
+                pdf_pages.close()
+                os.remove(tmp_path)
+                raise
+            chunks = _stream_searchable_pdf(
+                _ocr_pdf_pages(pdf_pages, prompt, tmp_path, page_filter, checkpoint), writer, t0
+            )
+            filename = Path(file.filename or "document.pdf").stem + "_searchable.pdf"
+            response = StreamingResponse(
+                admission.iterate(ticket, chunks),
+                media_type="application/pdf",
+                # 檔名可能含非 ASCII 字元，以 RFC 5987 編碼
+                headers={"Content-Disposition": f"attachment; filename*=UTF-8''{quote(filename)}"},
+            )
+            ticket = None
+            return response
+
+        # === 3. 串流模式：每完成一頁就送出（逐頁在推論執行緒池中推進，串流結束才釋放名額）===
+        if stream:
+            records = _stream_pdf_results(
+                _ocr_pdf_pages(pdf_pages, prompt, tmp_path, page_filter, checkpoint), stream, t0, checkpoint
+            )
+            response = StreamingResponse(
+                admission.iterate(ticket, records),
+                media_type=_STREAM_MEDIA_TYPES[stream],
+            )
+            ticket = None
+            return response
 
         # === 3. 逐頁 OCR ===
-        print("[DEBUG] 3. Starting page-by-page OCR loop...")
-        for idx, img in enumerate(images):
-            print(f"[DEBUG] 3. Processing page {idx + 1}...")
-            
-            # *** 檢查 'outputs' 資料夾是否存在 ***
-            output_dir = Path("./outputs")
-            output_dir.mkdir(exist_ok=True) # <-- 自動建立資料夾
-            
-            page_tmp = str(output_dir / f"tmp_page_{idx}.jpg")
-            
-            print(f"[DEBUG] 3a. Saving image to {page_tmp}...")
-            img.save(page_tmp) # <-- 如果 outputs 資料夾不存在，這裡會出錯
-            print(f"[DEBUG] 3a. Image saved.")
-
-            print(f"[DEBUG] 3b. Running run_ocr_local on {page_tmp}...")
-            text, lines = run_ocr_local(page_tmp, prompt) # <-- 核心 OCR 步驟
-            print(f"[DEBUG] 3b. OCR complete for page {idx + 1}.")
-            
-            all_text += f"\n\n[Page {idx+1}]\n" + text
-            all_lines.append(lines)
-            page_texts.append({
-                "page": idx + 1,
-                "text": text,
-                "lines": lines
-            })
-
-            os.remove(page_tmp)
-            print(f"[DEBUG] 3c. Removed temp image {page_tmp}.")
-
-        print("[DEBUG] 4. All pages processed. Returning JSON.")
-        return JSONResponse({
-            "status": "ok",
+        all_text, page_texts, summary = await admission.call(
+            _collect_pdf_results, pdf_pages, prompt, tmp_path, page_filter, checkpoint
+        )
+
+        return TimedJSONResponse({
+            "status": "partial" if summary["failed"] else "ok",
             "pages": page_texts,
-            "text_full": all_text.strip(),
+            "text_full": all_text,
+            **summary,
+            "document_sha256": checkpoint.document if checkpoint else None,
+            "elapsed_ms": int((time.time() - t0) * 1000),
             "meta": runtime_meta()
         })
 
+    except PageRangeError as e:
+        return TimedJSONResponse({"status": "error", "error": str(e)}, status_code=400)
     except Exception as e:
-        # --- *** 這就是我們的新偵錯區塊 *** ---
-        print("\n--- !!! AN EXCEPTION OCCURRED !!! ---")
-        print(f"Error Type: {type(e)}")
-        print(f"Error Details: {str(e)}")
-        print("--- FULL TRACEBACK ---")
-        traceback.print_exc()  # <--- 強制在 console 印出完整錯誤
-        print("-------------------------\n")
-        
+        logger.exception("/ocr/pdf failed: %s", e)
+
         # 並且也將錯誤訊息回傳給 n8n
-        return JSONResponse(
+        return TimedJSONResponse(
             {
                 "status": "error", 
                 "error": str(e),
@@ -199,63 +858,162 @@ async def ocr_pdf_endpoint(
             }, 
             status_code=500
         )
+    finally:
+        if ticket is not None:
+            ticket.release()
 
 @app.post("/pdf/split")
 async def pdf_split_endpoint(
     file: UploadFile = File(...),
-    password: str = Form(None)
+    password: str = Form(None),
+    pages: str = Form(None)
 ):
     """
-    接收 PDF 檔，解密並將其拆分為多張圖片。
-    回傳儲存的圖片路徑列表，供後續逐頁 OCR。
+    接收 PDF 檔並存入文件庫，立即回傳 document_id 與頁數（不渲染任何頁面）。
+    頁面以 GET /pdf/{document_id}/pages/{n} 按需渲染，或以 POST /pdf/{document_id}/pages/{n}/ocr 直接 OCR；
+    文件閒置超過 OCR_DOC_TTL_SECONDS 後自動刪除。
     """
-    print("\n[DEBUG] --- /pdf/split endpoint hit ---")
-    
-    # 建立一個唯一的資料夾來存放該 PDF 的所有頁面
-    # 這樣可以避免同時處理多個 PDF 時檔案名稱衝突
-    output_dir = Path(f"./outputs/pdf_{int(time.time())}_{file.filename[:20]}")
-    output_dir.mkdir(parents=True, exist_ok=True)
-    print(f"[DEBUG] Pages will be saved to: {output_dir.resolve()}")
-
     try:
-        # === 1. 暫存上傳的 PDF ===
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-            tmp.write(await file.read())
-            tmp_path = tmp.name
-
-        # === 2. 將 PDF 拆成圖片 (使用您已有的 ocr.py 函式) ===
-        print(f"[DEBUG] Converting PDF with password: {'*' * len(password) if password else 'None'}")
-        images = pdf_to_images_high_quality(
-            tmp_path, 
-            dpi=200, 
-            user_password=password
-        )
-        print(f"[DEBUG] PDF converted to {len(images)} image(s).")
-        os.remove(tmp_path) # 刪除暫存 PDF
-
-        # === 3. 儲存所有圖片並收集路徑 ===
-        image_paths = []
-        for idx, img in enumerate(images):
-            # 儲存圖片到我們建立的唯一資料夾中
-            page_path = output_dir / f"page_{idx + 1}.jpg"
-            img.save(page_path)
-            
-            # 必須回傳「絕對路徑」，run_ocr_local 才能找到檔案
-            image_paths.append(page_path.resolve().as_posix())
-
-        print(f"[DEBUG] Returning {len(image_paths)} image paths.")
-        # 立即回傳，這個請求非常快
+        # 開檔驗證在推論執行緒池中進行，滿載時回傳 503
+        admission = get_admission()
+        with admission.admit():
+            info = await admission.call(
+                get_document_store().add, await file.read(), file.filename, password, pages
+            )
+
+        doc_id = info["document_id"]
+        logger.debug("PDF stored as document %s (%d pages).", doc_id, info["page_count"])
         return {
             "status": "ok",
-            "page_count": len(image_paths),
-            "image_paths": image_paths # <--- 這是 n8n 需要的陣列
+            **info,
+            "page_urls": [f"/pdf/{doc_id}/pages/{n}" for n in info["pages"]],
+            "ocr_urls": [f"/pdf/{doc_id}/pages/{n}/ocr" for n in info["pages"]],
         }
 
+    except PageRangeError as e:
+        raise HTTPException(status_code=400, detail={"status": "error", "error": str(e)})
+    except Overloaded:
+        raise
     except Exception as e:
-        print("\n--- !!! AN EXCEPTION OCCURRED in /pdf/split !!! ---")
-        traceback.print_exc()
-        print("-------------------------\n")
+        logger.exception("/pdf/split failed: %s", e)
         raise HTTPException(
             status_code=500, 
             detail={"status": "error", "error": str(e)}
-        )
\ No newline at end of file
+        )
+
+@app.get("/pdf/{doc_id}")
+def pdf_document_endpoint(doc_id: str):
+    try:
+        return {"status": "ok", **get_document_store().info(doc_id)}
+    except DocumentError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+@app.delete("/pdf/{doc_id}")
+def pdf_document_delete_endpoint(doc_id: str):
+    try:
+        if not get_document_store().delete(doc_id):
+            raise DocumentError(f"文件不存在或已過期: {doc_id}", status_code=404)
+    except DocumentError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    return {"status": "ok", "document_id": doc_id}
+
+@app.get("/pdf/{doc_id}/pages/{page_no}")
+async def pdf_page_endpoint(
+    doc_id: str,
+    page_no: int,
+    dpi: int = RENDER_DEFAULT_DPI,
+    format: str = "png",
+    grayscale: bool = False
+):
+    """
+    按需渲染文件的單頁圖片（format 為 png 或 jpeg），結果放入渲染快取
+    """
+    store = get_document_store()
+    try:
+        fmt = parse_render_options(dpi, format)
+        # 快取命中時不佔用推論執行緒池的名額
+        data = store.cached_page(doc_id, page_no, dpi, fmt, grayscale)
+        cache_status = "hit"
+        if data is None:
+            admission = get_admission()
+            with admission.admit():
+                data = await admission.call(store.render_page, doc_id, page_no, dpi, fmt, grayscale)
+            cache_status = "miss"
+    except DocumentError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    return Response(
+        content=data,
+        media_type=IMAGE_FORMATS[fmt][1],
+        headers={
+            "Cache-Control": f"private, max-age={int(store.ttl)}",
+            "X-Render-Cache": cache_status,
+        },
+    )
+
+def _ocr_document_page(doc_id: str, page_no: int, dpi: int, prompt: str, mode) -> OCRResult:
+    img = get_document_store().page_image(doc_id, page_no, dpi, mode)
+    PAGES.inc(source="ocr")
+    return run_ocr_image(img, prompt)
+
+@app.post("/pdf/{doc_id}/pages/{page_no}/ocr")
+async def pdf_page_ocr_endpoint(
+    doc_id: str,
+    page_no: int,
+    dpi: int = RENDER_DEFAULT_DPI,
+    prompt: str = None,
+    mode: str = None
+):
+    """
+    對文件的第 page_no 頁直接 OCR（在記憶體中渲染，不產生中間圖片檔）
+    """
+    resolution_mode = _resolution_mode(mode)
+    try:
+        parse_render_options(dpi, "png")
+        t0 = time.time()
+        admission = get_admission()
+        with admission.admit():
+            result = await admission.call(_ocr_document_page, doc_id, page_no, dpi, prompt, resolution_mode)
+    except DocumentError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except Overloaded:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return {
+        "document_id": doc_id,
+        "page": page_no,
+        "full_text": result.text,
+        "lines": result.lines,
+        "cached": result.cached,
+        "mode": result.mode,
+        "elapsed_ms": int((time.time() - t0) * 1000),
+        "meta": runtime_meta(),
+    }
+
+@app.post("/jobs/pdf", status_code=202)
+async def create_pdf_job_endpoint(
+    file: UploadFile = File(...),
+    prompt: str = Form(None),
+    password: str = Form(None)
+):
+    """
+    建立非同步 PDF OCR 任務，立即回傳 job_id。
+    以 GET /jobs/{job_id} 查詢進度與每頁結果。
+    """
+    try:
+        data = await file.read()
+        # 寫入 SQLite 與儲存 PDF 都是阻塞 I/O，移到執行緒池避免卡住事件迴圈
+        job_id = await run_in_threadpool(get_job_manager().submit_pdf, data, file.filename, prompt, password)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return {"job_id": job_id, "status": "queued", "status_url": f"/jobs/{job_id}"}
+
+@app.get("/jobs/{job_id}")
+def get_job_endpoint(job_id: str, include_pages: bool = True):
+    """
+    查詢任務狀態：queued / running / done / failed
+    """
+    job = get_job_manager().status(job_id, include_pages=include_pages)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"找不到任務: {job_id}")
+    return job
@@ -0,0 +1,316 @@
+import os
+import time
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+from urllib.parse import parse_qs
+
+# 各階段耗時直方圖與計數器，以 Prometheus 文字格式輸出（GET /metrics）。
+# 單一行程內的輕量實作，不需要額外的套件
+METRICS_ENABLED = os.getenv("OCR_METRICS", "1") != "0"
+
+# 秒；涵蓋毫秒級的前處理到數十秒的整份 PDF
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _format_labels(labelnames: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{k}="{_escape(v)}"' for k, v in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        lines.extend(self.samples())
+        return lines
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        if not items and not self.labelnames:
+            items = [((), 0.0)]
+        for key, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Gauge(_Metric):
+    """
+    於抓取時呼叫 collect() 取得目前數值，回傳 {(label 值...): 數值}
+    """
+    type_name = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        collect: Callable[[], Dict[Tuple[str, ...], float]],
+        labelnames: Sequence[str] = ()
+    ):
+        super().__init__(name, documentation, labelnames)
+        self._collect = collect
+
+    def samples(self) -> Iterable[str]:
+        try:
+            values = self._collect()
+        except Exception:
+            return
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 每組 label：[各 bucket 計數..., +Inf 計數, 總和]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            state[index] += 1
+            state[-1] += value
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            items = sorted((key, list(state)) for key, state in self._values.items())
+        for key, state in items:
+            cumulative = 0.0
+            for bound, count in zip(self.buckets + (float("inf"),), state[:-1]):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {_format_value(cumulative)}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {_format_value(cumulative)}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(state[-1])}"
+
+
+_registry: List[_Metric] = []
+
+
+def register(metric: _Metric) -> _Metric:
+    _registry.append(metric)
+    return metric
+
+
+def render_prometheus() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ---- 服務指標 ----
+
+STAGE_SECONDS = register(Histogram(
+    "ocr_stage_seconds",
+    "Time spent in each processing stage",
+    ("stage",),
+))
+STAGE_ERRORS = register(Counter(
+    "ocr_stage_errors_total",
+    "Errors raised inside a processing stage",
+    ("stage",),
+))
+REQUEST_SECONDS = register(Histogram(
+    "ocr_http_request_seconds",
+    "HTTP request latency until the response headers are sent",
+    ("path", "method"),
+))
+REQUESTS = register(Counter(
+    "ocr_http_requests_total",
+    "HTTP requests by route and status code",
+    ("path", "method", "status"),
+))
+PAGES = register(Counter(
+    "ocr_pages_total",
+    "PDF pages processed, by result source",
+    ("source",),
+))
+IMAGES = register(Counter(
+    "ocr_images_total",
+    "Images sent through OCR, by whether the result came from cache",
+    ("cached",),
+))
+TOKENS = register(Counter(
+    "ocr_tokens_generated_total",
+    "Tokens generated by the model",
+))
+FIRST_TOKEN_SECONDS = register(Histogram(
+    "ocr_time_to_first_token_seconds",
+    "Time from the start of a streamed OCR request to its first text chunk",
+    ("cached",),
+))
+
+# ---- 每個請求的階段耗時（contextvars，跟著請求進入執行緒池）----
+
+# 批次與 PDF 頁面可能在多個執行緒中累加同一個請求的明細
+_timings_lock = threading.Lock()
+_request_timings: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar(
+    "ocr_request_timings", default=None
+)
+
+
+def start_request_timings() -> contextvars.Token:
+    return _request_timings.set({})
+
+
+def reset_request_timings(token: contextvars.Token):
+    _request_timings.reset(token)
+
+
+def request_timings() -> Optional[Dict[str, float]]:
+    """
+    目前請求各階段累計耗時（毫秒）；不在請求內時回傳 None
+    """
+    timings = _request_timings.get()
+    if timings is None:
+        return None
+    with _timings_lock:
+        return {stage: round(ms, 2) for stage, ms in timings.items()}
+
+
+def record_stage(stage: str, seconds: float):
+    if METRICS_ENABLED:
+        STAGE_SECONDS.observe(seconds, stage=stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        with _timings_lock:
+            timings[stage] = timings.get(stage, 0.0) + seconds * 1000.0
+
+
+@contextmanager
+def stage(name: str):
+    """
+    量測一個處理階段：寫入直方圖並累加到目前請求的耗時明細；區塊內拋出例外時計入錯誤數
+    """
+    t0 = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        if METRICS_ENABLED:
+            STAGE_ERRORS.inc(stage=name)
+        raise
+    finally:
+        record_stage(name, time.perf_counter() - t0)
+
+
+# ---- HTTP 中介層 ----
+
+def _wants_timings(scope) -> bool:
+    for name, value in scope.get("headers", []):
+        if name == b"x-ocr-timings":
+            return value.lower() in (b"1", b"true")
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    return query.get("timings", [""])[-1].lower() in ("1", "true")
+
+
+def _server_timing(timings: Dict[str, float]) -> str:
+    return ", ".join(f"{name};dur={ms:.2f}" for name, ms in timings.items())
+
+
+class MetricsMiddleware:
+    """
+    記錄每個 HTTP 請求的延遲與狀態碼（以路由樣板為 label，避免 label 數量無限增長）。
+    請求帶有 X-OCR-Timings: 1 標頭或 timings=1 查詢參數時才收集該請求的階段耗時，
+    並以 Server-Timing 標頭回傳
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._paths = None
+
+    def _route_path(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        if self._paths is None:
+            routes = getattr(scope.get("app"), "routes", [])
+            self._paths = {getattr(r, "endpoint", None): r.path for r in routes if hasattr(r, "path")}
+        return self._paths.get(endpoint, "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        t0 = time.perf_counter()
+        token = start_request_timings() if _wants_timings(scope) else None
+        state = {"status": 500, "started": False}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+                state["started"] = True
+                REQUEST_SECONDS.observe(time.perf_counter() - t0, path=self._route_path(scope), method=scope["method"])
+                timings = request_timings()
+                if timings:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", _server_timing(timings).encode("latin-1")))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            path = self._route_path(scope)
+            if not state["started"]:
+                REQUEST_SECONDS.observe(time.perf_counter() - t0, path=path, method=scope["method"])
+            REQUESTS.inc(path=path, method=scope["method"], status=state["status"])
+            if token is not None:
+                reset_request_timings(token)
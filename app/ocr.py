@@ -2,295 +2,343 @@ import io
 import os
 import base64
 import time
-import requests
-import torch
 import glob
 import json
 from pathlib import Path
-from PIL import Image
-from typing import Tuple, List
-from transformers import AutoModel, AutoTokenizer
-from dotenv import load_dotenv
+from PIL import Image, ImageOps
+from typing import Iterator, Optional, Tuple, List, Union
 import fitz  # PyMuPDF
 import io
 import img2pdf
 from PIL import Image
 import tempfile
 import fnmatch
+import re
 import sys
+import logging
+from dataclasses import dataclass
 
-# 初始化
-load_dotenv()
+from app.backend import DEFAULT_PROMPT, get_backend
+from app.batching import get_batcher
+from app.scheduler import get_scheduler
+from app.cache import cache_key, get_cache
+from app.fetch import fetch_image_bytes_sync
+from app.metrics import FIRST_TOKEN_SECONDS, IMAGES, TOKENS, record_stage, stage
+from app.resolution import (
+    AUTO, MODES, PROBE_DPI, ResolutionMode, choose_mode, choose_mode_for_image, glyph_height, parse_mode, render_dpi,
+    text_density
+)
 
-MODEL_ID = os.getenv("DEEPSEEK_OCR_MODEL", "deepseek-ai/DeepSeek-OCR")
-DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+logger = logging.getLogger(__name__)
 
-os.environ["CUDA_VISIBLE_DEVICES"] = '0'
+# ===============================
+# 輔助函式
+# ===============================
+def load_image_bytes(data: bytes) -> Image.Image:
+    """
+    在記憶體中解碼圖片（依 EXIF 轉正，與模型讀檔時的處理一致）
+    """
+    with stage("image_decode"):
+        try:
+            img = Image.open(io.BytesIO(data))
+            img = ImageOps.exif_transpose(img)
+            img.load()
+        except Exception as e:
+            raise ValueError(f"無法解碼圖片: {e}")
+    return img
 
-# 載入 tokenizer
-tokenizer = AutoTokenizer.from_pretrained(MODEL_ID, trust_remote_code=True)
+def load_image_file(path: str) -> Image.Image:
+    """
+    讀取並解碼本機圖片檔（依 EXIF 轉正）；快取鍵、auto 模式與推論都使用這一份解碼結果
+    """
+    with stage("image_decode"):
+        try:
+            with Image.open(path) as img:
+                img = ImageOps.exif_transpose(img)
+                img.load()
+        except Exception as e:
+            raise ValueError(f"無法解碼圖片: {e}")
+    return img
 
-# 載入模型
-if DEVICE == "cuda":
+def decode_base64_image(data: str) -> bytes:
+    """
+    解碼 Base64 圖片資料（容許 data:image/...;base64, 前綴）
+    """
+    if data.startswith("data:"):
+        data = data.split(",", 1)[-1]
     try:
-        model = AutoModel.from_pretrained(
-            MODEL_ID,
-            trust_remote_code=True,
-            torch_dtype=torch.bfloat16,
-            device_map="auto",
-            attn_implementation="flash_attention_2"
-        )
-    except Exception as e:
-        print(f"Flash attention failed: {e}, falling back to eager...")
-        model = AutoModel.from_pretrained(
-            MODEL_ID,
-            trust_remote_code=True,
-            torch_dtype=torch.bfloat16,
-            device_map="auto",
-            attn_implementation="eager"
-        )
+        return base64.b64decode("".join(data.split()), validate=True)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"無效的 Base64 圖片資料: {e}")
 
-    except Exception as e:
-        print(f"Flash attention failed: {e}")
-        
-else:
-    model = AutoModel.from_pretrained(
-        MODEL_ID,
-        trust_remote_code=True,
-        torch_dtype=torch.float32,
-        device_map="cpu"
-    )
-
-model = model.eval()
+# 模型 grounding 輸出的標記，例如 <|ref|>text<|/ref|><|det|>[[x1, y1, x2, y2]]<|/det|>
+_GROUNDING_PATTERN = re.compile(r"<\|ref\|>(.*?)<\|/ref\|><\|det\|>(.*?)<\|/det\|>", re.DOTALL)
 
-# ===============================
-# 輔助函式
-# ===============================
-def _download_image(image_url: str, save_path: str):
-    r = requests.get(image_url, timeout=30)
-    r.raise_for_status()
-    with open(save_path, "wb") as f:
-        f.write(r.content)
-    return save_path
+def _clean_model_output(raw: str) -> str:
+    """
+    整理模型解碼後的原始文字（與模型存成 .mmd 時的處理一致）
+    """
+    text = _GROUNDING_PATTERN.sub("", raw)
+    text = text.replace("\\coloneqq", ":=").replace("\\eqqcolon", "=:")
+    return text.strip()
 
-def _process_ocr(image_path: str, prompt: str = None) -> Tuple[str, List[str]]:
+@dataclass
+class OCRResult:
     """
-    DeepSeek-OCR 處理（從標準輸出捕捉結果）
+    單張圖片的 OCR 結果；可直接解包為 (text, lines) 以相容舊的呼叫方式
     """
-    from io import StringIO
-    import re
-    
-    if not prompt:
-        prompt = "<image>\nFree OCR."
-    
-    if not os.path.exists(image_path):
-        raise FileNotFoundError(f"圖片文件不存在: {image_path}")
+    text: str
+    lines: List[str]
+    cached: bool = False
+    # 結果來源：ocr（模型推論）、text_layer（PDF 原生文字層）、blank（空白頁）或 duplicate（沿用重複頁）
+    source: str = "ocr"
+    # 推論使用的解析度模式（text_layer 時為 None）
+    mode: Optional[str] = None
 
-    print(f"[DEBUG-OCR] 開始處理: {os.path.basename(image_path)}")
-    
-    text = ""
-    output_dir = os.path.abspath("./ocr_output_debug")
-    os.makedirs(output_dir, exist_ok=True)
-    
-    # 捕捉標準輸出和標準錯誤
-    old_stdout = sys.stdout
-    old_stderr = sys.stderr
-    sys.stdout = captured_stdout = StringIO()
-    sys.stderr = captured_stderr = StringIO()
-    
-    try:
-        # 調用模型（不打印內部信息）
-        model.infer(
-            tokenizer,
-            prompt=prompt,
-            image_file=os.path.abspath(image_path),
-            output_path=output_dir,
-            base_size=1024,
-            image_size=640,
-            crop_mode=True,
-            save_results=True,
-            test_compress=False,
-            eval_mode=False
-        )
-    finally:
-        sys.stdout = old_stdout
-        sys.stderr = old_stderr
-    
-    # 獲取捕捉的輸出
-    stdout_text = captured_stdout.getvalue()
-    stderr_text = captured_stderr.getvalue()
-    
-    print(f"[DEBUG-OCR] ✓ 模型執行完成")
-    
-    # ====================================================================
-    # 首先嘗試從檔案讀取（優先）
-    # ====================================================================
-    all_files = []
-    for root, dirs, files in os.walk(output_dir):
-        for file in files:
-            full_path = os.path.join(root, file)
-            all_files.append(full_path)
-    
-    if all_files:
-        print(f"[DEBUG-OCR] 找到 {len(all_files)} 個檔案，嘗試讀取...")
-        
-        priority_exts = ['.mmd', '.txt', '.md', '.json']
-        for ext in priority_exts:
-            matching_files = [f for f in all_files if f.lower().endswith(ext)]
-            
-            for file_path in matching_files:
-                if any(file_path.lower().endswith(img_ext) for img_ext in ['.jpg', '.png', '.jpeg']):
-                    continue
-                
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                    
-                    if ext == '.json':
-                        import json
-                        try:
-                            data = json.loads(content)
-                            if isinstance(data, dict):
-                                text = data.get('text', '') or data.get('content', '')
-                            elif isinstance(data, list) and len(data) > 0:
-                                text = str(data[0])
-                            if not text:
-                                text = json.dumps(data, ensure_ascii=False, indent=2)
-                        except:
-                            text = content
-                    else:
-                        text = content.strip().strip('"')
-                    
-                    if text and len(text) > 10:
-                        print(f"[DEBUG-OCR] ✓ 從檔案讀取成功")
-                        break
-                except:
-                    continue
-            
-            if text:
-                break
-    
-    # ====================================================================
-    # 如果檔案中沒有找到，從標準輸出提取
-    # ====================================================================
-    if not text and stdout_text:
-        print(f"[DEBUG-OCR] 從標準輸出提取...")
-        
-        # 清理捕捉的輸出
-        clean_text = stdout_text
-        
-        # 移除 ANSI 控制碼
-        clean_text = re.sub(r'\x1b\[[0-9;]*m', '', clean_text)
-        
-        # 移除我們自己的調試信息
-        debug_patterns = [
-            r'\[內部\][^\n]*\n',
-            r'\[DEBUG[^\]]*\][^\n]*\n',
-            r'={3,}\n',
-            r'BASE: torch\.Size\([^\)]+\)\n',
-            r'PATCHES: torch\.Size\([^\)]+\)\n',
-        ]
-        
-        for pattern in debug_patterns:
-            clean_text = re.sub(pattern, '', clean_text, flags=re.MULTILINE)
-        
-        # 移除開頭和結尾的空白
-        clean_text = clean_text.strip()
-        
-        # 如果有 Markdown 代碼塊，提取內容
-        if '```' in clean_text:
-            parts = clean_text.split('```')
-            if len(parts) >= 3:
-                # 取第一個代碼塊的內容
-                text = parts[1].strip()
-                # 移除可能的語言標識（如 markdown, text 等）
-                if '\n' in text:
-                    lines = text.split('\n')
-                    if lines[0].strip() in ['markdown', 'text', 'md', '']:
-                        text = '\n'.join(lines[1:])
-            elif len(parts) == 2:
-                text = parts[1].strip()
+    def __iter__(self):
+        return iter((self.text, self.lines))
+
+    @classmethod
+    def from_text(cls, text: str, **kwargs) -> "OCRResult":
+        lines = [ln for ln in text.splitlines() if ln.strip()]
+        return cls(text, lines, **kwargs)
+
+def _infer_text(image: Union[str, Image.Image], prompt: str, mode: ResolutionMode) -> str:
+    """
+    呼叫模型並整理輸出文字
+    """
+    backend = get_backend()
+    # 先依請求的優先權 lane 取得推論名額；啟用微批次時交給排程器與其他請求合併推論（耗時包含等待批次的時間）
+    with get_scheduler().slot(), stage("inference"):
+        batcher = get_batcher()
+        if batcher is not None:
+            raw = batcher.infer(image, prompt, mode)
         else:
-            text = clean_text
-        
-        if text:
-            print(f"[DEBUG-OCR] ✓ 從標準輸出提取成功")
-    
-    # ====================================================================
-    # 最終驗證
-    # ====================================================================
-    if not text or len(text) < 10:
-        print(f"[DEBUG-OCR] ✗ 未能獲取有效的 OCR 結果")
-        print(f"[DEBUG-OCR] 標準輸出長度: {len(stdout_text)}")
-        print(f"[DEBUG-OCR] 標準錯誤長度: {len(stderr_text)}")
+            raw = backend.infer(image, prompt, mode)
+    TOKENS.inc(backend.count_tokens(raw or ""))
+
+    with stage("extract"):
+        text = _clean_model_output(raw or "")
+    logger.debug("模型執行完成")
+
+    if not text:
+        logger.warning("未能獲取有效的 OCR 結果")
         raise Exception("無法從模型獲取有效的 OCR 結果")
+    return text
+
+ModeInput = Union[None, str, ResolutionMode]
+
+def _resolve_mode(image: Image.Image, mode: ModeInput) -> ResolutionMode:
+    """
+    決定這張圖片的解析度模式：PDF 渲染時已選好的模式優先，其次是呼叫端指定的模式；
+    auto 依圖片尺寸與文字密度挑選
+    """
+    if image.info.get("ocr_mode") in MODES:
+        return MODES[image.info["ocr_mode"]]
+    if not isinstance(mode, ResolutionMode):
+        mode = parse_mode(mode)
+    if mode != AUTO:
+        return mode
+    with stage("mode_select"):
+        return choose_mode_for_image(image)
+
+def _process_ocr(image: Union[str, Image.Image], prompt: str = None, mode: ModeInput = None) -> OCRResult:
+    """
+    DeepSeek-OCR 處理（直接在記憶體中取得模型解碼結果）
+    image 可以是圖片路徑或記憶體中的 PIL 圖片；相同內容與參數的結果會從快取回傳
+    mode 為解析度模式（名稱、ResolutionMode 或 "auto"），未指定時使用 OCR_RESOLUTION_MODE
+    """
+    if not prompt:
+        prompt = DEFAULT_PROMPT
     
-    print(f"[DEBUG-OCR] ✅ 成功! 文字長度: {len(text)} 字元")
-    
-    # 預覽前 150 字元
-    preview = text[:150].replace('\n', ' ')
-    if len(text) > 150:
-        preview += '...'
-    print(f"[DEBUG-OCR] 預覽: {preview}")
-    
-    lines = [ln for ln in text.splitlines() if ln.strip()]
-    return text, lines
+    if isinstance(image, str):
+        if not os.path.exists(image):
+            raise FileNotFoundError(f"圖片文件不存在: {image}")
+        logger.debug("開始處理: %s", os.path.basename(image))
+        # 只解碼一次，快取鍵與推論共用
+        image = load_image_file(image)
+    else:
+        logger.debug("開始處理: <in-memory %s %dx%d>", image.mode, image.size[0], image.size[1])
 
-def run_ocr(image_url: str, prompt: str = None) -> Tuple[str, List[str]]:
+    mode = _resolve_mode(image, mode)
+    cache = get_cache()
+    if cache is not None:
+        key = cache_key(image, prompt, mode)
+        text, cached = cache.get_or_compute(key, lambda: _infer_text(image, prompt, mode))
+        if cached:
+            logger.debug("快取命中 %s", key[:12])
+    else:
+        text, cached = _infer_text(image, prompt, mode), False
+    IMAGES.inc(cached=str(cached).lower())
+
+    if logger.isEnabledFor(logging.DEBUG):
+        # 預覽前 150 字元
+        preview = text[:150].replace('\n', ' ')
+        if len(text) > 150:
+            preview += '...'
+        logger.debug("成功! 文字長度: %d 字元，預覽: %s", len(text), preview)
+
+    with stage("extract"):
+        return OCRResult.from_text(text, cached=cached, mode=mode.name)
+
+def run_ocr(image_url: str, prompt: str = None, mode: ModeInput = None) -> OCRResult:
     """
-    從 URL 下載圖片並執行 OCR
+    從 URL 下載圖片並執行 OCR（共用連線池，圖片只在記憶體中解碼）
     """
-    try:
-        response = requests.get(image_url, timeout=30) # 30 秒超時
-        response.raise_for_status() # 如果下載失敗 (例如 404) 會拋出錯誤
-        
-        # 將下載的圖片寫入臨時文件
-        # 我們需要一個帶有正確副檔名的文件，以便模型可以識別它
-        suffix = Path(image_url).suffix or '.jpg'
-        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_file:
-            tmp_file.write(response.content)
-            tmp_image_path = tmp_file.name
-
-        # 呼叫通用的本地 OCR 處理器
-        full_text, lines = _process_ocr(tmp_image_path, prompt)
-        
-        # 清理臨時圖片
-        os.remove(tmp_image_path)
-        
-        return full_text, lines
-        
-    except requests.RequestException as e:
-        raise Exception(f"Failed to download image from URL: {e}")
-    except Exception as e:
-        # 捕捉 _process_ocr 可能拋出的錯誤
-        # 確保即使出錯也刪除臨時文件
-        if 'tmp_image_path' in locals() and os.path.exists(tmp_image_path):
-            os.remove(tmp_image_path)
-        raise e
+    data = fetch_image_bytes_sync(image_url)
+    return run_ocr_bytes(data, prompt, mode)
 
-def run_ocr_local(image_path: str, prompt: str = None) -> Tuple[str, List[str]]:
+def run_ocr_bytes(data: bytes, prompt: str = None, mode: ModeInput = None) -> OCRResult:
+    """
+    對記憶體中的圖片檔內容（JPEG/PNG 等）進行 OCR
+    """
+    return run_ocr_image(load_image_bytes(data), prompt, mode)
+
+def run_ocr_local(image_path: str, prompt: str = None, mode: ModeInput = None) -> OCRResult:
     """
     直接使用本地圖片進行 OCR（隱私模式）
     (此函式是 _process_ocr 的一個簡單包裝器)
     """
     # 確保模型已載入
-    if not model or not tokenizer:
-        raise Exception("AI model is not loaded. Server configuration error.")
+    try:
+        get_backend().load()
+    except Exception as e:
+        raise Exception(f"AI model is not loaded. Server configuration error: {e}")
         
-    return _process_ocr(image_path, prompt)
+    return _process_ocr(image_path, prompt, mode)
 
-def pdf_to_images_high_quality(
-    pdf_path: str, 
-    dpi: int = 144, 
-    image_format: str = "PNG", 
-    user_password: str = None
-) -> List[Image.Image]:
+def run_ocr_image(image: Image.Image, prompt: str = None, mode: ModeInput = None) -> OCRResult:
     """
-    將 PDF 逐頁轉成高品質 PIL 圖片列表
-    (*** 修正版：支援加密 PDF ***)
+    直接對記憶體中的 PIL 圖片進行 OCR（不經過磁碟）
+    """
+    # 確保模型已載入
+    try:
+        get_backend().load()
+    except Exception as e:
+        raise Exception(f"AI model is not loaded. Server configuration error: {e}")
+
+    return _process_ocr(image, prompt, mode)
+
+def stream_ocr(image: Union[str, Image.Image], prompt: str = None, mode: ModeInput = None) -> Iterator[Union[str, OCRResult]]:
+    """
+    串流 OCR：模型生成中逐段 yield 原始文字（str），最後 yield 整理後的 OCRResult
+    串流推論不經過微批次（逐段送出需要獨佔一次 generate）；快取命中時整段文字一次送出
+    """
+    t0 = time.perf_counter()
+    backend = get_backend()
+    try:
+        backend.load()
+    except Exception as e:
+        raise Exception(f"AI model is not loaded. Server configuration error: {e}")
+    if not prompt:
+        prompt = DEFAULT_PROMPT
+    if isinstance(image, str):
+        if not os.path.exists(image):
+            raise FileNotFoundError(f"圖片文件不存在: {image}")
+        image = load_image_file(image)
+
+    mode = _resolve_mode(image, mode)
+    cache = get_cache()
+    key = cache_key(image, prompt, mode) if cache is not None else None
+    text = cache.get(key) if cache is not None else None
+    cached = text is not None
+    IMAGES.inc(cached=str(cached).lower())
+    if cached:
+        FIRST_TOKEN_SECONDS.observe(time.perf_counter() - t0, cached="true")
+        yield text
+    else:
+        # 生成期間一直佔用推論名額
+        with get_scheduler().slot():
+            t_infer = time.perf_counter()
+            first = True
+            chunks = backend.infer_stream(image, prompt, mode)
+            try:
+                while True:
+                    try:
+                        delta = next(chunks)
+                    except StopIteration as done:
+                        raw = done.value
+                        break
+                    if first:
+                        first = False
+                        FIRST_TOKEN_SECONDS.observe(time.perf_counter() - t0, cached="false")
+                        record_stage("first_token", time.perf_counter() - t0)
+                    yield delta
+            finally:
+                # 呼叫端中途關閉時停止生成
+                chunks.close()
+            record_stage("inference", time.perf_counter() - t_infer)
+        TOKENS.inc(backend.count_tokens(raw or ""))
+        with stage("extract"):
+            text = _clean_model_output(raw or "")
+        if not text:
+            logger.warning("未能獲取有效的 OCR 結果")
+            raise Exception("無法從模型獲取有效的 OCR 結果")
+        if cache is not None:
+            cache.put(key, text)
+
+    with stage("extract"):
+        yield OCRResult.from_text(text, cached=cached, mode=mode.name)
+
+# 單頁渲染的像素上限（超過時自動降低該頁 DPI），避免大型或惡意 PDF 佔用大量記憶體
+PDF_MAX_PAGE_PIXELS = int(os.getenv("OCR_PDF_MAX_PAGE_PIXELS", "40000000"))
+
+
+# 原生文字層判斷門檻：至少這麼多字元、亂碼比例不超過上限、圖片覆蓋面積不超過上限
+NATIVE_TEXT_MIN_CHARS = int(os.getenv("OCR_NATIVE_TEXT_MIN_CHARS", "50"))
+NATIVE_TEXT_MAX_BAD_RATIO = float(os.getenv("OCR_NATIVE_TEXT_MAX_BAD_RATIO", "0.05"))
+NATIVE_TEXT_MAX_IMAGE_COVERAGE = float(os.getenv("OCR_NATIVE_TEXT_MAX_IMAGE_COVERAGE", "0.5"))
+
+
+class PageRangeError(ValueError):
+    pass
+
+
+class PageRenderError(Exception):
+    """
+    單頁渲染失敗；PdfPages(page_errors=True) 時以 (page_no, PageRenderError) 取代該頁圖片，而不中止整份文件
+    """
+
+    def __init__(self, page_no: int, error: Exception):
+        super().__init__(f"Error during PDF page conversion (page {page_no}): {error}")
+        self.page_no = page_no
+
+
+def parse_page_range(spec: str, page_count: int) -> List[int]:
+    """
+    解析頁碼範圍（1 起算），例如 "1-3,5,10-"；空白代表全部頁面
+    """
+    if not spec or not spec.strip():
+        return list(range(1, page_count + 1))
+
+    pages = []
+    seen = set()
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            if "-" in part:
+                start_str, end_str = part.split("-", 1)
+                start = int(start_str) if start_str.strip() else 1
+                end = int(end_str) if end_str.strip() else page_count
+            else:
+                start = end = int(part)
+        except ValueError:
+            raise PageRangeError(f"無效的頁碼範圍: {part}")
+        if start < 1 or end > page_count or start > end:
+            raise PageRangeError(f"頁碼範圍超出文件頁數 ({page_count}): {part}")
+        for page in range(start, end + 1):
+            if page not in seen:
+                seen.add(page)
+                pages.append(page)
+    return pages
+
+
+def open_pdf(pdf_path: str, user_password: str = None) -> fitz.Document:
+    """
+    開啟 PDF，若已加密則以密碼解密
     """
-    images = []
-    
     # 1. 打開 PDF 文件
     try:
         pdf_document = fitz.open(pdf_path)
@@ -300,7 +348,7 @@ def pdf_to_images_high_quality(
 
     # 2. 檢查是否加密，並嘗試解密
     if pdf_document.is_encrypted:
-        print(f"[DEBUG-PDF] PDF is encrypted. Attempting authentication...")
+        logger.debug("PDF is encrypted. Attempting authentication...")
         if not user_password:
             # 如果文件已加密，但調用者沒有提供密碼
             pdf_document.close()
@@ -313,36 +361,229 @@ def pdf_to_images_high_quality(
             pdf_document.close()
             raise Exception("Invalid password provided for PDF.")
         
-        print(f"[DEBUG-PDF] PDF authenticated successfully.")
-    
+        logger.debug("PDF authenticated successfully.")
+
+    return pdf_document
+
+
+def extract_native_text(page: fitz.Page) -> Optional[str]:
+    """
+    數位產生的頁面直接取用 PDF 文字層；文字太少、亂碼太多或以圖片為主（掃描頁）時回傳 None
+    """
+    text = page.get_text("text").strip()
+    if len(text) < NATIVE_TEXT_MIN_CHARS:
+        return None
+
+    # 字型缺少 ToUnicode 對應時會出現替代字元或控制字元
+    visible = [ch for ch in text if not ch.isspace()]
+    bad = sum(1 for ch in visible if ch == "\ufffd" or (ord(ch) < 32))
+    if not visible or bad / len(visible) > NATIVE_TEXT_MAX_BAD_RATIO:
+        return None
+
+    page_area = abs(page.rect)
+    if page_area > 0:
+        image_area = 0.0
+        for info in page.get_image_info():
+            bbox = fitz.Rect(info["bbox"]) & page.rect
+            image_area += abs(bbox)
+        if image_area / page_area > NATIVE_TEXT_MAX_IMAGE_COVERAGE:
+            return None
+
+    return text
+
+
+def render_pdf_page_pixmap(
+    page: fitz.Page,
+    dpi: int,
+    max_page_pixels: int = PDF_MAX_PAGE_PIXELS,
+    grayscale: bool = False
+) -> fitz.Pixmap:
+    """
+    將單頁 PDF 渲染成 RGB（或灰階）pixmap；超過像素上限時等比例降低解析度
+    """
     zoom = dpi / 72.0
-    matrix = fitz.Matrix(zoom, zoom)
-    page_num = 0
+    rect = page.rect
+    pixels = rect.width * zoom * rect.height * zoom
+    if max_page_pixels and pixels > max_page_pixels:
+        zoom *= (max_page_pixels / pixels) ** 0.5
+        logger.info("Page %d exceeds pixel budget, rendering at %.0f DPI.", page.number + 1, zoom * 72)
 
-    try:
-        for page_num in range(pdf_document.page_count):
-            page = pdf_document[page_num]
-            pixmap = page.get_pixmap(matrix=matrix, alpha=False)
-            Image.MAX_IMAGE_PIXELS = None # 移除 PIL 的圖片大小限制
-
-            img_data = pixmap.tobytes("png") # 始終使用 png 獲取原始數據
-            img = Image.open(io.BytesIO(img_data))
-
-            # 若為 RGBA 轉成 RGB (JPEGs 不支援透明度)
-            if img.mode in ("RGBA", "LA"):
-                background = Image.new("RGB", img.size, (255, 255, 255))
-                background.paste(img, mask=img.split()[-1] if img.mode == "RGBA" else None)
-                img = background
-
-            images.append(img)
-            
-    except Exception as e:
-        # 捕捉轉檔過程中的錯誤 (例如 "document closed or encrypted")
-        pdf_document.close()
-        raise Exception(f"Error during PDF page conversion (page {page_num}): {e}")
+    colorspace = fitz.csGRAY if grayscale else fitz.csRGB
+    return page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=colorspace, alpha=False)
+
+
+def image_from_raw(mode: str, size: Tuple[int, int], stride: int, samples) -> Image.Image:
+    """
+    以原始像素緩衝區（bytes 或 memoryview）建立 PIL 圖片，不經過 PNG 編碼／解碼。
+    灰階（L）直接映射緩衝區、不複製，呼叫端須讓緩衝區在圖片使用期間保持有效；
+    PIL 內部以每像素 4 bytes 存放 RGB，RGB 一定會解包複製一次
+    """
+    return Image.frombuffer(mode, size, samples, "raw", mode, stride, 1)
+
+
+def image_from_pixmap(pixmap: fitz.Pixmap) -> Image.Image:
+    """
+    直接以 pixmap 的像素記憶體（samples_mv，不先複製成 bytes）建立 PIL 圖片；
+    灰階頁面與 pixmap 共用記憶體，因此把 pixmap 掛在圖片上，讓它與圖片同時釋放
+    """
+    mode = "L" if pixmap.n == 1 else "RGB"
+    image = image_from_raw(mode, (pixmap.width, pixmap.height), pixmap.stride, pixmap.samples_mv)
+    if mode == "L":
+        image._ocr_pixmap = pixmap
+    return image
 
-    pdf_document.close()
-    return images
+
+def render_pdf_page(
+    page: fitz.Page,
+    dpi: int,
+    max_page_pixels: int = PDF_MAX_PAGE_PIXELS,
+    grayscale: bool = False
+) -> Image.Image:
+    """
+    將單頁 PDF 渲染成 RGB（或灰階）PIL 圖片
+    """
+    return image_from_pixmap(render_pdf_page_pixmap(page, dpi, max_page_pixels, grayscale))
+
+
+def select_page_mode(page: fitz.Page, mode: Union[str, ResolutionMode], dpi: int) -> Tuple[ResolutionMode, int]:
+    """
+    決定 PDF 頁面的解析度模式與渲染 DPI
+
+    auto 先以 PROBE_DPI 渲染灰階縮圖估算文字密度與行高，再依請求 DPI 下的頁面尺寸挑選模式；
+    渲染 DPI 不超過模型實際輸入解析度所需，避免渲染之後又被縮小丟掉的像素
+    """
+    rect = page.rect
+    if mode == AUTO:
+        probe = render_pdf_page(page, PROBE_DPI, grayscale=True)
+        size = (int(rect.width * dpi / 72.0), int(rect.height * dpi / 72.0))
+        glyph = glyph_height(probe)
+        if glyph is not None:
+            glyph *= dpi / PROBE_DPI
+        mode = choose_mode(size, text_density(probe), glyph)
+    return mode, render_dpi(mode, max(rect.width, rect.height) / 72.0, dpi)
+
+
+def _render_with_mode(
+    page: fitz.Page,
+    mode: Union[None, str, ResolutionMode],
+    dpi: int,
+    max_page_pixels: int,
+    grayscale: bool
+) -> Tuple[Optional[str], fitz.Pixmap]:
+    """
+    依解析度模式渲染單頁，回傳 (模式名稱, pixmap)；mode 為 None 時照請求 DPI 渲染
+    """
+    if mode is None:
+        return None, render_pdf_page_pixmap(page, dpi, max_page_pixels, grayscale)
+    if isinstance(mode, str) and mode != AUTO:
+        # 渲染行程只收到模式名稱
+        mode = MODES[mode]
+    mode, dpi = select_page_mode(page, mode, dpi)
+    return mode.name, render_pdf_page_pixmap(page, dpi, max_page_pixels, grayscale)
+
+
+def tag_page_image(image: Image.Image, mode_name: Optional[str]) -> Image.Image:
+    """
+    在頁面圖片上記錄渲染時選定的模式，_process_ocr 會沿用而不重新判斷
+    """
+    if mode_name:
+        image.info["ocr_mode"] = mode_name
+    return image
+
+
+class PdfPages:
+    """
+    按需逐頁渲染 PDF：迭代時才渲染下一頁，同一時間只持有一頁的像素
+
+    native_text=True 時，具有可用原生文字層的頁面不渲染，改為 yield (page_no, text: str)。
+    mode 為解析度模式或 "auto"：依模式降低渲染 DPI，並在圖片上標記選定的模式。
+    page_errors=True 時，單頁渲染失敗改為 yield (page_no, PageRenderError)，繼續渲染下一頁。
+
+    Example:
+        with PdfPages(path, dpi=200, pages="1-3") as pdf_pages:
+            for page_no, img in pdf_pages:
+                ...
+    """
+
+    def __init__(
+        self,
+        pdf_path: str,
+        dpi: int = 144,
+        user_password: str = None,
+        pages: str = None,
+        max_page_pixels: int = PDF_MAX_PAGE_PIXELS,
+        grayscale: bool = False,
+        native_text: bool = False,
+        mode: Union[None, str, ResolutionMode] = None,
+        page_errors: bool = False
+    ):
+        self.pdf_path = pdf_path
+        self.dpi = dpi
+        self.mode = mode
+        self.grayscale = grayscale
+        self.native_text = native_text
+        self.page_errors = page_errors
+        self.user_password = user_password
+        self.max_page_pixels = max_page_pixels
+        self.document = open_pdf(pdf_path, user_password)
+        self.page_count = self.document.page_count
+        try:
+            self.page_numbers = parse_page_range(pages, self.page_count)
+        except PageRangeError:
+            self.close()
+            raise
+
+    def __len__(self) -> int:
+        return len(self.page_numbers)
+
+    def __iter__(self) -> Iterator[Tuple[int, Union[Image.Image, str, PageRenderError]]]:
+        for page_num in self.page_numbers:
+            try:
+                item = self._load_page(page_num)
+            except Exception as e:
+                # 捕捉轉檔過程中的錯誤 (例如 "document closed or encrypted")
+                error = PageRenderError(page_num, e)
+                if not self.page_errors:
+                    raise error
+                logger.warning("%s", error)
+                item = error
+            yield page_num, item
+
+    def _load_page(self, page_num: int) -> Union[Image.Image, str]:
+        with stage("pdf_render"):
+            page = self.document[page_num - 1]
+            if self.native_text:
+                text = extract_native_text(page)
+                if text is not None:
+                    return text
+            mode_name, pixmap = _render_with_mode(page, self.mode, self.dpi, self.max_page_pixels, self.grayscale)
+            return tag_page_image(image_from_pixmap(pixmap), mode_name)
+
+    def close(self):
+        if not self.document.is_closed:
+            self.document.close()
+
+    def __enter__(self) -> "PdfPages":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def pdf_to_images_high_quality(
+    pdf_path: str, 
+    dpi: int = 144, 
+    image_format: str = "PNG", 
+    user_password: str = None
+) -> List[Image.Image]:
+    """
+    將 PDF 逐頁轉成高品質 PIL 圖片列表
+    (*** 修正版：支援加密 PDF ***)
+
+    會一次持有所有頁面的像素；大型文件請改用 PdfPages 逐頁迭代。
+    """
+    with PdfPages(pdf_path, dpi=dpi, user_password=user_password) as pdf_pages:
+        return [img for _, img in pdf_pages]
 
 
 def pil_to_pdf_img2pdf(pil_images, output_path: str):
@@ -370,9 +611,17 @@ def pil_to_pdf_img2pdf(pil_images, output_path: str):
     with open(output_path, "wb") as f:
         f.write(pdf_bytes)
 
+_runtime_meta: Optional[dict] = None
+
 def runtime_meta() -> dict:
-    return {
-        "device": DEVICE,
-        "model_id": MODEL_ID,
-        "torch": torch.__version__,
-    }
\ No newline at end of file
+    """
+    後端資訊在模型載入後不再改變，載入後只建立一次並在之後的回應中共用（呼叫者不可修改）
+    """
+    global _runtime_meta
+    if _runtime_meta is not None:
+        return _runtime_meta
+    backend = get_backend()
+    meta = backend.meta()
+    if backend.ready:
+        _runtime_meta = meta
+    return meta
\ No newline at end of file
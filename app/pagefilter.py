@@ -0,0 +1,194 @@
+import os
+import zlib
+from typing import List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+# 推論前的頁面過濾：空白頁跳過、同一份文件內的重複頁（重新掃描的封面、分隔頁、制式條款頁）沿用先前頁面的結果。
+# 判斷錯誤會直接回傳錯誤的文字，兩者預設都關閉，需要時由伺服器設定或請求的表單欄位開啟
+SKIP_BLANK_PAGES = os.getenv("OCR_SKIP_BLANK_PAGES", "0") == "1"
+DEDUPE_PAGES = os.getenv("OCR_DEDUPE_PAGES", "0") == "1"
+
+# 空白頁：在寬 BLANK_SCAN_WIDTH 的灰階縮圖上，與背景亮度相差超過 BLANK_INK_DELTA 的像素（墨跡）
+# 不超過 BLANK_MAX_INK_PIXELS 個；只容許掃描的零星雜點，任何一小段文字（簽名欄、「Approved」）都不算空白
+BLANK_INK_DELTA = int(os.getenv("OCR_BLANK_INK_DELTA", "48"))
+BLANK_MAX_INK_PIXELS = int(os.getenv("OCR_BLANK_MAX_INK_PIXELS", "8"))
+# 縮圖寬度：A4 頁面約 60 DPI，9pt 文字仍有數個像素高，不會在縮小時被平均掉
+BLANK_SCAN_WIDTH = 512
+
+# 重複頁分兩步判斷：
+# 1. 候選：128 像素寬縮圖的 dHash（256 位元）漢明距離不超過 DUP_MAX_HASH_DISTANCE；
+#    同一範本的不同頁面（只差頁碼或金額的發票）雜湊也很接近，雜湊只用來縮小比對範圍
+# 2. 確認：在寬 DUP_CONFIRM_WIDTH（A4／Letter 約 100 DPI）的墨跡濃度圖上，先校正整頁的平移
+#    （重新掃描的位移，最多 DUP_MAX_SHIFT 像素），再比較每個 DUP_INK_WINDOW 見方範圍內的墨跡量，
+#    並容許 1 像素的局部位移；任何一處的差超過 DUP_MAX_INK_DIFF（約幾個全黑像素）就不算重複。
+#    改一個數字或一個字會讓該處多出或少了一段筆畫，掃描雜訊、JPEG 壓縮與亮度差異則不會；
+#    標點（逗號與句點）這類小於一段筆畫的差異在 100 DPI 下與掃描雜訊無法區分，因此重複頁判斷預設關閉
+DUP_MAX_HASH_DISTANCE = int(os.getenv("OCR_DUP_MAX_HASH_DISTANCE", "24"))
+DUP_MAX_INK_DIFF = float(os.getenv("OCR_DUP_MAX_INK_DIFF", "4.0"))
+DUP_CONFIRM_WIDTH = 850
+DUP_INK_WINDOW = 4
+DUP_MAX_SHIFT = 8
+# 每份文件最多保留幾頁的指紋用於比對（壓縮後的濃度圖，文字頁每頁約數十 KB）
+DUP_WINDOW = int(os.getenv("OCR_DUP_WINDOW", "64"))
+
+# dHash 使用的縮圖寬度與區塊數（HASH_SIZE × HASH_SIZE 個相鄰差異）
+HASH_THUMBNAIL_WIDTH = 128
+HASH_SIZE = 16
+HASH_MIN_STEP = 1.0
+
+
+def page_thumbnail(image: Image.Image, width: int = BLANK_SCAN_WIDTH) -> np.ndarray:
+    """
+    將頁面縮成固定寬度的灰階縮圖（uint8 陣列）；頁面本身較窄時不放大
+    """
+    gray = image.convert("L")
+    if gray.width > width:
+        gray = gray.resize((width, max(1, round(gray.height * width / gray.width))), Image.BOX)
+    return np.asarray(gray, dtype=np.uint8)
+
+
+def ink_mask(thumb: np.ndarray) -> np.ndarray:
+    """
+    以中位數亮度作為紙張背景，標記與背景差異明顯的像素（墨跡）
+    """
+    return np.abs(thumb.astype(np.int16) - np.median(thumb)) > BLANK_INK_DELTA
+
+
+def ink_pixels(thumb: np.ndarray) -> int:
+    return int(np.count_nonzero(ink_mask(thumb)))
+
+
+def is_blank(image: Image.Image) -> bool:
+    return ink_pixels(page_thumbnail(image)) <= BLANK_MAX_INK_PIXELS
+
+
+def dhash(thumb: np.ndarray) -> np.ndarray:
+    """
+    差異雜湊：把縮圖分成 HASH_SIZE × (HASH_SIZE + 1) 個區塊取平均，比較水平相鄰區塊的亮度，
+    回傳打包後的 32 bytes 位元陣列
+    """
+    if thumb.shape[0] < HASH_SIZE:
+        thumb = np.repeat(thumb, -(-HASH_SIZE // thumb.shape[0]), axis=0)
+    rows = np.linspace(0, thumb.shape[0], HASH_SIZE + 1).astype(np.intp)
+    cols = np.linspace(0, thumb.shape[1], HASH_SIZE + 2).astype(np.intp)
+    sums = np.add.reduceat(np.add.reduceat(thumb.astype(np.float32), rows[:-1], axis=0), cols[:-1], axis=1)
+    blocks = sums / np.outer(np.diff(rows), np.diff(cols))
+    # 亮度幾乎相同的相鄰區塊（大片空白）一律記為 0，掃描雜訊才不會讓這些位元隨機翻轉
+    return np.packbits(blocks[:, 1:] - blocks[:, :-1] > HASH_MIN_STEP)
+
+
+def ink_density(thumb: np.ndarray) -> np.ndarray:
+    """
+    墨跡濃度（0 = 紙張背景，255 = 頁面上最深的墨色），以背景與最深色的差正規化，不受掃描亮度與對比影響；
+    幾乎沒有墨跡的頁面以 BLANK_INK_DELTA 為下限，雜點不會被放大成全黑
+    """
+    background = float(np.median(thumb))
+    dark = float(np.percentile(thumb, 0.5))
+    density = (background - thumb.astype(np.float32)) / max(float(BLANK_INK_DELTA), background - dark)
+    return (np.clip(density, 0.0, 1.0) * 255).astype(np.uint8)
+
+
+def _best_shift(a: np.ndarray, b: np.ndarray) -> int:
+    """
+    以墨跡投影的相關性估計 b 需要平移多少才能對齊 a（-DUP_MAX_SHIFT..DUP_MAX_SHIFT）
+    """
+    a = a.astype(np.float32)
+    b = b.astype(np.float32)
+    scores = [
+        float(np.dot(a[max(0, s):len(a) + min(0, s)], b[max(0, -s):len(b) - max(0, s)]))
+        for s in range(-DUP_MAX_SHIFT, DUP_MAX_SHIFT + 1)
+    ]
+    return int(np.argmax(scores)) - DUP_MAX_SHIFT
+
+
+def _shift(values: np.ndarray, dy: int, dx: int) -> np.ndarray:
+    out = np.zeros_like(values)
+    h, w = values.shape
+    out[max(0, dy):h + min(0, dy), max(0, dx):w + min(0, dx)] = values[max(0, -dy):h - max(0, dy), max(0, -dx):w - max(0, dx)]
+    return out
+
+
+def _window_sums(values: np.ndarray, k: int) -> np.ndarray:
+    """
+    每個 k × k 範圍的總和（以積分圖向量化計算）
+    """
+    c = np.pad(values, ((1, 0), (1, 0))).cumsum(axis=0).cumsum(axis=1)
+    return c[k:, k:] - c[:-k, k:] - c[k:, :-k] + c[:-k, :-k]
+
+
+def ink_difference(a: np.ndarray, b: np.ndarray) -> float:
+    """
+    兩頁墨跡濃度圖校正平移後，各 DUP_INK_WINDOW 見方範圍內墨跡量的差（單位：全黑像素），容許 1 像素局部位移後取最大值；
+    掃描的頁面尺寸可能差幾個像素，只比對兩者重疊的範圍
+    """
+    h, w = min(a.shape[0], b.shape[0]), min(a.shape[1], b.shape[1])
+    a = a[:h, :w].astype(np.float32) / 255
+    b = b[:h, :w].astype(np.float32) / 255
+    dy = _best_shift(a.sum(axis=1), b.sum(axis=1))
+    dx = _best_shift(a.sum(axis=0), b.sum(axis=0))
+    sums_a = _window_sums(a, DUP_INK_WINDOW)
+    sums_b = _window_sums(_shift(b, dy, dx), DUP_INK_WINDOW)
+    diff = None
+    for oy in (-1, 0, 1):
+        for ox in (-1, 0, 1):
+            d = np.abs(sums_a - _shift(sums_b, oy, ox))
+            diff = d if diff is None else np.minimum(diff, d)
+    # 平移後移出畫面的邊緣不比對
+    margin = DUP_MAX_SHIFT + 1
+    diff = diff[margin:-margin, margin:-margin]
+    return float(diff.max()) if diff.size else 0.0
+
+
+class PageFilter:
+    """
+    逐頁檢查一份文件的頁面圖片：check 回傳 ("blank", None)、("duplicate", 先前頁碼) 或 (None, None)
+
+    Example:
+        page_filter = PageFilter(skip_blank=True, dedupe=True)
+        for page_no, img in pdf_pages:
+            kind, ref_page = page_filter.check(page_no, img)
+    """
+
+    def __init__(self, skip_blank: bool = SKIP_BLANK_PAGES, dedupe: bool = DEDUPE_PAGES, window: int = DUP_WINDOW):
+        self.skip_blank = skip_blank
+        self.dedupe = dedupe
+        self.window = max(1, window)
+        # 先前頁面的 dHash、確認用的墨跡濃度圖（形狀, zlib 壓縮的位元組）與頁碼
+        self._hashes: List[np.ndarray] = []
+        self._densities: List[Tuple[Tuple[int, int], bytes]] = []
+        self._pages: List[int] = []
+
+    @property
+    def enabled(self) -> bool:
+        return self.skip_blank or self.dedupe
+
+    def check(self, page_no: int, image: Image.Image) -> Tuple[Optional[str], Optional[int]]:
+        if not self.enabled:
+            return None, None
+        if self.skip_blank and is_blank(image):
+            return "blank", None
+        if not self.dedupe:
+            return None, None
+
+        confirm = page_thumbnail(image, DUP_CONFIRM_WIDTH)
+        page_hash = dhash(page_thumbnail(Image.fromarray(confirm), HASH_THUMBNAIL_WIDTH))
+        density = ink_density(confirm)
+        if self._hashes:
+            distances = np.unpackbits(np.bitwise_xor(np.stack(self._hashes), page_hash), axis=1).sum(axis=1)
+            # 雜湊最接近的候選先比對
+            for i in sorted(np.flatnonzero(distances <= DUP_MAX_HASH_DISTANCE), key=lambda i: distances[i]):
+                shape, packed = self._densities[i]
+                if abs(shape[0] - density.shape[0]) > DUP_MAX_SHIFT or abs(shape[1] - density.shape[1]) > DUP_MAX_SHIFT:
+                    continue
+                other = np.frombuffer(zlib.decompress(packed), dtype=np.uint8).reshape(shape)
+                if ink_difference(other, density) <= DUP_MAX_INK_DIFF:
+                    return "duplicate", self._pages[i]
+
+        self._hashes.append(page_hash)
+        self._densities.append((density.shape, zlib.compress(density.tobytes(), 1)))
+        self._pages.append(page_no)
+        if len(self._pages) > self.window:
+            del self._hashes[0], self._densities[0], self._pages[0]
+        return None, None
@@ -0,0 +1,262 @@
+import os
+import time
+import threading
+import multiprocessing
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from typing import Iterator, Optional, Tuple, Union
+
+import fitz  # PyMuPDF
+
+from PIL import Image
+
+from app.metrics import record_stage
+from app.ocr import PageRenderError, PdfPages, open_pdf, extract_native_text, image_from_raw, tag_page_image, _render_with_mode
+
+# 渲染行程數（0 代表在目前執行緒內逐頁渲染）與預先渲染的頁數；
+# 預設保留一顆 CPU 給推論執行緒，單核心機器上不啟用行程池
+RENDER_WORKERS = int(os.getenv("OCR_RENDER_WORKERS", str(max(0, min(2, (os.cpu_count() or 1) - 1)))))
+RENDER_PREFETCH = int(os.getenv("OCR_RENDER_PREFETCH", "4"))
+# 每個渲染行程保持開啟的 PDF 數（同一份文件的各頁不必重新開檔、驗證密碼）
+RENDER_OPEN_DOCUMENTS = 4
+
+# 渲染行程內開啟中的文件：(路徑, 密碼, inode, 修改時間) -> Document；
+# 暫存檔刪除後路徑可能被新的上傳重複使用，以 inode 與修改時間區分
+_documents: "OrderedDict[tuple, fitz.Document]" = OrderedDict()
+
+
+def _open_cached(pdf_path: str, user_password: Optional[str]) -> fitz.Document:
+    st = os.stat(pdf_path)
+    key = (pdf_path, user_password, st.st_ino, st.st_mtime_ns)
+    document = _documents.get(key)
+    if document is not None:
+        _documents.move_to_end(key)
+        return document
+    document = _documents[key] = open_pdf(pdf_path, user_password)
+    while len(_documents) > RENDER_OPEN_DOCUMENTS:
+        _documents.popitem(last=False)[1].close()
+    return document
+
+
+def _to_shared_memory(pixmap: fitz.Pixmap) -> Tuple[str, str, Tuple[int, int], int]:
+    """
+    把 pixmap 的像素寫入新的共享記憶體區塊，主行程以區塊名稱取回，不經過 pickle 與管線複製；
+    區塊由主行程 unlink
+    """
+    samples = pixmap.samples_mv
+    block = shared_memory.SharedMemory(create=True, size=max(1, len(samples)))
+    try:
+        block.buf[:len(samples)] = samples
+        return block.name, "L" if pixmap.n == 1 else "RGB", (pixmap.width, pixmap.height), pixmap.stride
+    finally:
+        block.close()
+
+
+def _image_from_shared_memory(name: str, mode: str, size: Tuple[int, int], stride: int) -> Image.Image:
+    """
+    從渲染行程寫入的共享記憶體區塊建立圖片；像素複製一次到 PIL 後即釋放區塊
+    """
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        image = image_from_raw(mode, size, stride, block.buf)
+        if image.readonly:
+            # 灰階直接映射了區塊，複製一份才能關閉區塊
+            image = image.copy()
+        else:
+            image.load()
+        return image
+    finally:
+        block.close()
+        block.unlink()
+
+
+def _discard_finished(future):
+    if not future.cancelled() and future.exception() is None:
+        _discard_shared_memory(future.result()[1])
+
+
+def _discard_shared_memory(raw):
+    if isinstance(raw, tuple):
+        try:
+            block = shared_memory.SharedMemory(name=raw[0])
+        except FileNotFoundError:
+            return
+        block.close()
+        block.unlink()
+
+
+def _render_page_worker(
+    pdf_path: str,
+    user_password: Optional[str],
+    page_no: int,
+    dpi: int,
+    max_page_pixels: int,
+    grayscale: bool,
+    native_text: bool,
+    mode: Optional[str] = None
+) -> Tuple[int, Union[str, Tuple[str, str, Tuple[int, int], int]], float, Optional[str]]:
+    """
+    在渲染行程中渲染單頁，原始像素（不做任何編碼）寫入共享記憶體，回傳 (區塊名稱, mode, size, stride)；
+    可用原生文字層時改回傳文字。後兩個值為渲染耗時（秒，由主行程記錄到指標）與選定的解析度模式。
+    文件在行程內保持開啟，同一份文件的後續頁面直接沿用
+    """
+    t0 = time.perf_counter()
+    page = _open_cached(pdf_path, user_password)[page_no - 1]
+    if native_text:
+        text = extract_native_text(page)
+        if text is not None:
+            return page_no, text, time.perf_counter() - t0, None
+    mode_name, pixmap = _render_with_mode(page, mode, dpi, max_page_pixels, grayscale)
+    return page_no, _to_shared_memory(pixmap), time.perf_counter() - t0, mode_name
+
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_render_executor() -> Optional[ProcessPoolExecutor]:
+    global _executor
+    if RENDER_WORKERS <= 0:
+        return None
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                # 使用 spawn：主行程可能已初始化 CUDA 與多個執行緒，fork 並不安全
+                _executor = ProcessPoolExecutor(
+                    max_workers=RENDER_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+    return _executor
+
+
+def _discard_render_executor(executor: ProcessPoolExecutor):
+    """
+    渲染行程異常結束時丟棄整個行程池，下一個請求會重新建立
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+class PipelinedPdfPages:
+    """
+    生產者／消費者管線：渲染行程池最多領先推論 prefetch 頁，
+    迭代介面與 PdfPages 相同，依頁碼順序 yield (page_no, image)；
+    page_errors=True 時渲染失敗的頁面 yield (page_no, PageRenderError)；
+    渲染行程異常結束（例如損壞的頁面讓 MuPDF 崩潰）時換用新的行程池，找出造成崩潰的頁面後繼續
+    """
+
+    def __init__(
+        self,
+        pdf_pages: PdfPages,
+        executor: Optional[ProcessPoolExecutor] = None,
+        prefetch: int = RENDER_PREFETCH
+    ):
+        self.pdf_pages = pdf_pages
+        self.executor = executor
+        self.prefetch = max(1, prefetch)
+        self._pending = deque()
+
+    @property
+    def page_count(self) -> int:
+        return self.pdf_pages.page_count
+
+    @property
+    def page_numbers(self):
+        return self.pdf_pages.page_numbers
+
+    @page_numbers.setter
+    def page_numbers(self, value):
+        self.pdf_pages.page_numbers = value
+
+    def __len__(self) -> int:
+        return len(self.pdf_pages)
+
+    def _submit(self, page_no: int):
+        self._pending.append((page_no, self.executor.submit(
+            _render_page_worker,
+            self.pdf_pages.pdf_path,
+            self.pdf_pages.user_password,
+            page_no,
+            self.pdf_pages.dpi,
+            self.pdf_pages.max_page_pixels,
+            self.pdf_pages.grayscale,
+            self.pdf_pages.native_text,
+            getattr(self.pdf_pages.mode, "name", self.pdf_pages.mode),
+        )))
+
+    def __iter__(self) -> Iterator[Tuple[int, Union[Image.Image, str]]]:
+        if self.executor is None:
+            yield from self.pdf_pages
+            return
+
+        queue = deque(self.pdf_pages.page_numbers)
+        # 之後還需單獨渲染的頁數：行程池崩潰時無法得知是哪一頁造成的，當時在渲染中的頁面逐頁重新渲染
+        isolate = 0
+        self._fill(queue, isolate)
+        while self._pending:
+            page_no, future = self._pending.popleft()
+            if not isolate:
+                self._fill(queue, isolate)
+            try:
+                _, raw, render_seconds, mode_name = future.result()
+            except BrokenProcessPool as e:
+                _discard_render_executor(self.executor)
+                if not self.pdf_pages.page_errors:
+                    raise PageRenderError(page_no, e)
+                self.executor = get_render_executor()
+                if not isolate:
+                    suspects = [page_no] + [p for p, _ in self._pending]
+                    for _, pending in self._pending:
+                        # 崩潰前已完成的頁面也要重新渲染，釋放它們已寫好的共享記憶體
+                        pending.add_done_callback(_discard_finished)
+                    self._pending.clear()
+                    queue.extendleft(reversed(suspects))
+                    isolate = len(suspects)
+                    self._fill(queue, isolate)
+                    continue
+                item = PageRenderError(page_no, e)
+            except Exception as e:
+                if not self.pdf_pages.page_errors:
+                    raise PageRenderError(page_no, e)
+                item = PageRenderError(page_no, e)
+            else:
+                record_stage("pdf_render", render_seconds)
+                item = raw if isinstance(raw, str) else tag_page_image(_image_from_shared_memory(*raw), mode_name)
+            if isolate:
+                isolate -= 1
+                self._fill(queue, isolate)
+            yield page_no, item
+
+    def _fill(self, queue: deque, isolate: int):
+        """
+        排入頁面直到佇列長度達到 prefetch（背壓上限）；逐頁單獨渲染時一次只排一頁
+        """
+        limit = 1 if isolate else self.prefetch
+        while queue and len(self._pending) < limit:
+            self._submit(queue.popleft())
+
+    def close(self):
+        while self._pending:
+            future = self._pending.popleft()[1]
+            if not future.cancel():
+                # 已在渲染中的頁面：完成後釋放它的共享記憶體區塊
+                future.add_done_callback(_discard_finished)
+        self.pdf_pages.close()
+
+    def __enter__(self) -> "PipelinedPdfPages":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def pipelined_pdf_pages(pdf_pages: PdfPages) -> PipelinedPdfPages:
+    """
+    以全域渲染行程池包裝 PdfPages；OCR_RENDER_WORKERS=0 時退回同執行緒渲染
+    """
+    return PipelinedPdfPages(pdf_pages, get_render_executor())
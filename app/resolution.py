@@ -0,0 +1,150 @@
+import os
+from dataclasses import dataclass
+from typing import Optional, Tuple, Union
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+# DeepSeek-OCR 的解析度模式；視覺 token 數越少，推論越快
+#   tiny   512×512           64 tokens
+#   small  640×640          100 tokens
+#   base   1024×1024        256 tokens
+#   large  1280×1280        400 tokens
+#   gundam 1024 全圖 + 640 切塊（token 數隨切塊數增加），最適合密集的大型文件
+
+
+@dataclass(frozen=True)
+class ResolutionMode:
+    name: str
+    base_size: int
+    image_size: int
+    crop_mode: bool
+
+    @property
+    def target_pixels(self) -> Optional[int]:
+        """
+        模型實際看到的長邊像素；gundam 會切塊，沒有固定上限
+        """
+        return None if self.crop_mode else self.base_size
+
+
+MODES = {
+    "tiny": ResolutionMode("tiny", 512, 512, False),
+    "small": ResolutionMode("small", 640, 640, False),
+    "base": ResolutionMode("base", 1024, 1024, False),
+    "large": ResolutionMode("large", 1280, 1280, False),
+    "gundam": ResolutionMode("gundam", 1024, 640, True),
+}
+AUTO = "auto"
+
+# 未指定 mode 時使用的模式，可設為 auto
+DEFAULT_MODE = os.getenv("OCR_RESOLUTION_MODE", "gundam").strip().lower()
+
+# auto 模式：文字密度估算用的縮圖寬度，以及 PDF 頁面試渲染的 DPI（需足以量出 9pt 文字的行高）
+DENSITY_THUMBNAIL_WIDTH = 256
+PROBE_DPI = 72
+# auto 模式：估算行高用的灰階圖寬度與墨跡門檻（與背景亮度的差）
+GLYPH_SCAN_WIDTH = 1024
+GLYPH_INK_DELTA = 48
+# auto 模式：縮到模型輸入解析度後，文字行高至少要有幾個像素；不足時改用更大的模式
+MIN_GLYPH_PIXELS = float(os.getenv("OCR_AUTO_MIN_GLYPH_PIXELS", "10"))
+# 依 PDF 模式選擇渲染 DPI 時的下限
+MIN_RENDER_DPI = 72
+
+# (文字密度上限, 長邊像素上限, 模式)：由小到大挑第一個符合的模式，都不符合時用 gundam。
+# 低於 base 的模式只給本身就不大的圖片；整頁文件即使文字很少，也可能是小字，不能只憑密度縮小
+_AUTO_RULES = (
+    (0.04, 1024, "tiny"),
+    (0.10, 1024, "small"),
+    (0.10, None, "base"),
+    (0.18, 1600, "base"),
+    (0.18, None, "large"),
+    (None, 1280, "large"),
+)
+
+
+class ResolutionModeError(ValueError):
+    pass
+
+
+def parse_mode(name: Optional[str]) -> Union[ResolutionMode, str]:
+    """
+    解析 API 傳入的模式名稱；空白代表 OCR_RESOLUTION_MODE，回傳 ResolutionMode 或 "auto"
+    """
+    name = (name or DEFAULT_MODE).strip().lower()
+    if name == AUTO:
+        return AUTO
+    mode = MODES.get(name)
+    if mode is None:
+        raise ResolutionModeError(f"不支援的解析度模式: {name}（可用: {', '.join(MODES)}, {AUTO}）")
+    return mode
+
+
+def text_density(image: Image.Image) -> float:
+    """
+    粗估文字密度：縮圖上邊緣像素的比例（空白標籤約 0.01，密集雙欄合約約 0.2 以上）
+    """
+    gray = image.convert("L")
+    if gray.width > DENSITY_THUMBNAIL_WIDTH:
+        height = max(1, round(gray.height * DENSITY_THUMBNAIL_WIDTH / gray.width))
+        gray = gray.resize((DENSITY_THUMBNAIL_WIDTH, height), Image.BILINEAR)
+    edges = gray.filter(ImageFilter.FIND_EDGES)
+    histogram = edges.histogram()
+    strong = sum(histogram[64:])
+    return strong / float(gray.width * gray.height)
+
+
+def glyph_height(image: Image.Image) -> Optional[float]:
+    """
+    粗估文字行高（原圖像素）：含墨跡的連續像素列視為一行文字，取各行高度的中位數；
+    沒有文字時回傳 None。多欄排版的行可能黏在一起，估計值偏大
+    """
+    gray = image.convert("L")
+    scale = 1.0
+    if gray.width > GLYPH_SCAN_WIDTH:
+        scale = gray.width / GLYPH_SCAN_WIDTH
+        height = max(1, round(gray.height / scale))
+        gray = gray.resize((GLYPH_SCAN_WIDTH, height), Image.BOX)
+    pixels = np.asarray(gray, dtype=np.int16)
+    ink = np.abs(pixels - np.median(pixels)) > GLYPH_INK_DELTA
+    rows = np.concatenate(([0], (ink.sum(axis=1) >= 2).astype(np.int8), [0]))
+    edges = np.diff(rows)
+    runs = np.flatnonzero(edges == -1) - np.flatnonzero(edges == 1)
+    # 1 像素高的多半是表格線、底線或雜點
+    runs = runs[runs >= 2]
+    if not runs.size:
+        return None
+    return float(np.median(runs)) * scale
+
+
+def choose_mode(size: Tuple[int, int], density: float, glyph: Optional[float] = None) -> ResolutionMode:
+    """
+    依圖片長邊、文字密度與行高挑選可能維持準確度的最小模式；
+    glyph 為原圖上的行高（像素），縮到模式的輸入解析度後低於 MIN_GLYPH_PIXELS 的模式不選
+    """
+    long_side = max(size)
+    for max_density, max_side, name in _AUTO_RULES:
+        if max_density is not None and density >= max_density:
+            continue
+        if max_side is not None and long_side > max_side:
+            continue
+        target = MODES[name].target_pixels
+        if glyph is not None and target is not None and long_side > target:
+            if glyph * target / long_side < MIN_GLYPH_PIXELS:
+                continue
+        return MODES[name]
+    return MODES["gundam"]
+
+
+def choose_mode_for_image(image: Image.Image) -> ResolutionMode:
+    return choose_mode(image.size, text_density(image), glyph_height(image))
+
+
+def render_dpi(mode: ResolutionMode, page_long_inches: float, requested_dpi: int) -> int:
+    """
+    依模式選擇 PDF 渲染 DPI：渲染超過模型輸入解析度的像素只會被縮小丟掉
+    """
+    target = mode.target_pixels
+    if target is None or page_long_inches <= 0:
+        return requested_dpi
+    return int(min(requested_dpi, max(MIN_RENDER_DPI, target / page_long_inches)))
@@ -0,0 +1,265 @@
+import os
+import hashlib
+import logging
+import threading
+import time
+import contextvars
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Optional, Tuple
+
+from starlette.responses import JSONResponse
+
+from app.backend import WORKERS
+from app.batching import BATCH_MAX_SIZE
+from app.metrics import Gauge, Histogram, register, stage
+
+# 推論排程：每次推論（單張圖片或 PDF 的一頁）都要先取得一個推論名額；等待中的推論依優先權 lane 加權公平分配，
+# 同一 lane 內各租戶輪流。閒置的 lane 不保留名額，沒有互動請求時批次工作可以用滿所有名額
+# OCR_LANES 格式為 "名稱:權重,..."：兩個 lane 都有工作在等待時，依權重比例分配名額
+LANES: Dict[str, float] = OrderedDict(
+    (name.strip(), float(weight))
+    for name, _, weight in (
+        item.partition(":") for item in os.getenv("OCR_LANES", "interactive:8,bulk:1").split(",") if item.strip()
+    )
+)
+DEFAULT_LANE = os.getenv("OCR_DEFAULT_LANE", "interactive")
+# 未指定優先權時，這些路徑（前綴）的請求走 bulk lane
+BULK_LANE = os.getenv("OCR_BULK_LANE", "bulk")
+BULK_PATHS = tuple(
+    p.strip() for p in os.getenv("OCR_BULK_PATHS", "/ocr/pdf,/ocr/batch,/ocr/urls,/jobs/").split(",") if p.strip()
+)
+# API 金鑰對應的 lane，格式為 "金鑰=lane,..."；對應到的 lane 優先於 X-OCR-Priority 標頭
+API_KEY_LANES: Dict[str, str] = dict(
+    item.strip().split("=", 1) for item in os.getenv("OCR_API_KEY_LANES", "").split(",") if "=" in item
+)
+# 同時進行中的推論數；預設每個模型實例（worker）一次一個微批次
+SCHED_SLOTS = int(os.getenv("OCR_SCHED_SLOTS", str(max(1, WORKERS) * max(1, BATCH_MAX_SIZE))))
+
+PRIORITY_HEADER = "x-ocr-priority"
+
+logger = logging.getLogger(__name__)
+
+
+class LaneError(Exception):
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _lane_or_default(lane: str) -> str:
+    return lane if lane in LANES else next(iter(LANES))
+
+
+# 目前請求的 (lane, 租戶)；跟著 contextvars 進入執行緒池，不在請求內時為預設 lane
+_current: contextvars.ContextVar[Optional[Tuple[str, str]]] = contextvars.ContextVar("ocr_lane", default=None)
+
+
+def current_lane() -> Tuple[str, str]:
+    return _current.get() or (_lane_or_default(DEFAULT_LANE), "default")
+
+
+@contextmanager
+def lane_context(lane: str, tenant: str):
+    """
+    在請求之外（例如非同步任務）指定後續推論所屬的 lane 與租戶
+    """
+    token = _current.set((_lane_or_default(lane), tenant))
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def resolve_lane(scope) -> Tuple[str, str]:
+    """
+    依 API 金鑰、X-OCR-Priority 標頭與路徑決定請求的 (lane, 租戶)；
+    租戶為 API 金鑰的雜湊，沒有金鑰時為用戶端位址
+    """
+    headers = {name.decode("latin-1"): value.decode("latin-1") for name, value in scope.get("headers", [])}
+    api_key = headers.get("x-api-key")
+    if not api_key and headers.get("authorization", "").lower().startswith("bearer "):
+        api_key = headers["authorization"][7:].strip()
+
+    if api_key:
+        tenant = "key:" + hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+    else:
+        client = scope.get("client")
+        tenant = "ip:" + (client[0] if client else "unknown")
+
+    lane = API_KEY_LANES.get(api_key) if api_key else None
+    if lane is None:
+        lane = headers.get(PRIORITY_HEADER, "").strip().lower() or None
+        if lane is not None and lane not in LANES:
+            raise LaneError(f"未知的優先權: {lane}（可用: {', '.join(LANES)}）")
+    if lane is None:
+        lane = BULK_LANE if scope.get("path", "").startswith(BULK_PATHS) else DEFAULT_LANE
+    return _lane_or_default(lane), tenant
+
+
+class _Lane:
+    __slots__ = ("weight", "finish", "tenants", "waiting", "in_flight")
+
+    def __init__(self, weight: float):
+        self.weight = max(weight, 1e-6)
+        # 最後一次分派的虛擬完成時間（start-time fair queueing）
+        self.finish = 0.0
+        # 租戶 -> 等待中的推論，依輪流順序排列
+        self.tenants: "OrderedDict[str, Deque[threading.Event]]" = OrderedDict()
+        self.waiting = 0
+        self.in_flight = 0
+
+
+class FairScheduler:
+    """
+    加權公平的推論名額分配：名額空出時，在有推論等待的 lane 中挑選虛擬開始時間最小者
+    （每分派一次，該 lane 的虛擬時間前進 1/權重），再從該 lane 輪到的租戶取出最早的一筆。
+    以推論次數（頁數）為單位，長文件的每一頁都會重新排隊，與其他請求交錯執行
+    """
+
+    def __init__(self, slots: int, lanes: Dict[str, float]):
+        self.slots = max(1, slots)
+        self._lanes = {name: _Lane(weight) for name, weight in lanes.items()}
+        self._lock = threading.Lock()
+        self._busy = 0
+        self._vtime = 0.0
+
+    def acquire(self, lane: str, tenant: str):
+        state = self._lanes[lane]
+        with self._lock:
+            if self._busy < self.slots and not any(s.waiting for s in self._lanes.values()):
+                self._grant_locked(state)
+                return
+            event = threading.Event()
+            state.tenants.setdefault(tenant, deque()).append(event)
+            state.waiting += 1
+        event.wait()
+
+    def release(self, lane: str):
+        with self._lock:
+            self._busy -= 1
+            self._lanes[lane].in_flight -= 1
+            self._dispatch_locked()
+
+    def _grant_locked(self, state: _Lane):
+        start = max(self._vtime, state.finish)
+        state.finish = start + 1.0 / state.weight
+        self._vtime = start
+        self._busy += 1
+        state.in_flight += 1
+
+    def _dispatch_locked(self):
+        while self._busy < self.slots:
+            backlogged = [s for s in self._lanes.values() if s.waiting]
+            if not backlogged:
+                return
+            state = min(backlogged, key=lambda s: max(self._vtime, s.finish))
+            tenant, events = next(iter(state.tenants.items()))
+            event = events.popleft()
+            # 輪到下一個租戶
+            del state.tenants[tenant]
+            if events:
+                state.tenants[tenant] = events
+            state.waiting -= 1
+            self._grant_locked(state)
+            event.set()
+
+    @contextmanager
+    def slot(self):
+        """
+        取得目前請求所屬 lane 的推論名額，區塊結束時釋放；等待時間記錄為 schedule 階段
+        """
+        lane, tenant = current_lane()
+        t0 = time.perf_counter()
+        with stage("schedule"):
+            self.acquire(lane, tenant)
+        LANE_WAIT_SECONDS.observe(time.perf_counter() - t0, lane=lane)
+        try:
+            yield
+        finally:
+            self.release(lane)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "slots": self.slots,
+                "busy": self._busy,
+                "lanes": {
+                    name: {
+                        "weight": state.weight,
+                        "waiting": state.waiting,
+                        "in_flight": state.in_flight,
+                        "tenants_waiting": len(state.tenants),
+                    }
+                    for name, state in self._lanes.items()
+                },
+            }
+
+
+class LaneMiddleware:
+    """
+    決定每個請求的 lane 與租戶並放入 contextvars；優先權無效時直接回應 400，不進入端點
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        try:
+            lane = resolve_lane(scope)
+        except LaneError as e:
+            response = JSONResponse({"status": "error", "error": str(e)}, status_code=e.status_code)
+            await response(scope, receive, send)
+            return
+
+        token = _current.set(lane)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current.reset(token)
+
+
+LANE_WAIT_SECONDS = register(Histogram(
+    "ocr_lane_wait_seconds",
+    "Time an inference waited for a scheduler slot",
+    ("lane",),
+))
+
+
+def _collect_lanes(field: str):
+    def collect() -> dict:
+        if _scheduler is None:
+            return {}
+        return {(name,): lane[field] for name, lane in _scheduler.stats()["lanes"].items()}
+    return collect
+
+
+register(Gauge(
+    "ocr_lane_queue_depth",
+    "Inferences waiting for a scheduler slot",
+    _collect_lanes("waiting"),
+    ("lane",),
+))
+register(Gauge(
+    "ocr_lane_in_flight",
+    "Inferences holding a scheduler slot",
+    _collect_lanes("in_flight"),
+    ("lane",),
+))
+
+_scheduler: Optional[FairScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> FairScheduler:
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                if not LANES:
+                    raise ValueError("OCR_LANES 至少需要一個 lane")
+                _scheduler = FairScheduler(SCHED_SLOTS, LANES)
+    return _scheduler
@@ -10,6 +10,7 @@ class OCRResponse(BaseModel):
     lines: List[str]
     elapsed_ms: int
     meta: dict
+    cached: bool = False
 
 class HealthResponse(BaseModel):
     status: str
@@ -0,0 +1,154 @@
+import os
+import shutil
+import logging
+from typing import Iterator, List, Optional
+
+import fitz  # PyMuPDF
+
+from app.metrics import stage
+from app.ocr import open_pdf
+
+# 可搜尋 PDF 輸出：在上傳 PDF 的副本上逐頁加上不可見文字層（原頁面的物件原封不動，不重新編碼圖片），
+# 每累積 OCR_SEARCHABLE_FLUSH_PAGES 頁就以增量更新寫回檔案。增量更新只在檔案尾端附加新物件，
+# 已寫入的位元組不會再改變，因此可以邊 OCR 邊把新增的部分送給客戶端
+SEARCHABLE_FLUSH_PAGES = int(os.getenv("OCR_SEARCHABLE_FLUSH_PAGES", "8"))
+
+# 文字層使用 MuPDF 內建的 CJK 字型（也涵蓋拉丁字母），以名稱參照、不嵌入字型檔
+TEXT_LAYER_FONT = "china-t"
+TEXT_LAYER_MARGIN = 36
+TEXT_LAYER_MAX_FONT_SIZE = 12.0
+TEXT_LAYER_LINE_SPACING = 1.2
+
+# 讀取並送出新增位元組時每次讀取的大小
+_CHUNK_SIZE = 1 << 20
+
+logger = logging.getLogger(__name__)
+
+
+class SearchablePdfWriter:
+    """
+    逐頁加上 OCR 文字層並增量寫出的可搜尋 PDF
+
+    Example:
+        writer = SearchablePdfWriter(src_path, out_path, pages=[1, 2, 3])
+        yield from writer.read_available()
+        for page_no, lines in results:
+            writer.add_text_layer(page_no, lines)
+            yield from writer.read_available()
+        writer.finish()
+        yield from writer.read_available()
+    """
+
+    def __init__(
+        self,
+        src_path: str,
+        out_path: str,
+        user_password: str = None,
+        pages: Optional[List[int]] = None,
+        flush_pages: int = SEARCHABLE_FLUSH_PAGES
+    ):
+        shutil.copyfile(src_path, out_path)
+        self.path = out_path
+        self.flush_pages = max(1, flush_pages)
+        self._password = user_password
+        try:
+            self.document = open_pdf(out_path, user_password)
+        except Exception:
+            os.remove(out_path)
+            raise
+        # 只保留選取的頁面（None 代表全部）
+        self.pages = pages
+        # 損壞後經過修復的檔案無法增量更新，只能在最後整份寫出，無法邊寫邊送
+        self.incremental = bool(self.document.can_save_incrementally())
+        self._dirty = 0
+        self._sent = 0
+        self._finished = False
+
+    def add_text_layer(self, page_no: int, lines: List[str]):
+        """
+        在頁面上以不可見文字（render mode 3）由上而下鋪排 OCR 的各行，讓頁面可以搜尋與複製文字
+        模型輸出不含座標，文字位置只是近似，所有行使用同一字級，以最長的一行不超出頁寬為準
+        """
+        lines = [line for line in lines if line.strip()]
+        if not lines:
+            return
+        page = self.document[page_no - 1]
+        rect = page.rect
+        width = max(1.0, rect.width - 2 * TEXT_LAYER_MARGIN)
+        height = max(1.0, rect.height - 2 * TEXT_LAYER_MARGIN)
+        longest = max(fitz.get_text_length(line, fontname=TEXT_LAYER_FONT, fontsize=1) for line in lines)
+        fontsize = min(
+            TEXT_LAYER_MAX_FONT_SIZE,
+            height / (len(lines) * TEXT_LAYER_LINE_SPACING),
+            width / longest if longest else TEXT_LAYER_MAX_FONT_SIZE,
+        )
+        # 旋轉過的頁面：以畫面上的座標排版，再換算回頁面未旋轉的座標
+        origin = fitz.Point(rect.x0 + TEXT_LAYER_MARGIN, rect.y0 + TEXT_LAYER_MARGIN + fontsize) * page.derotation_matrix
+        with stage("text_layer"):
+            page.insert_text(
+                origin,
+                lines,
+                fontsize=fontsize,
+                lineheight=TEXT_LAYER_LINE_SPACING,
+                fontname=TEXT_LAYER_FONT,
+                render_mode=3,
+                rotate=page.rotation,
+            )
+        self._dirty += 1
+        if self._dirty >= self.flush_pages:
+            self.flush()
+
+    def flush(self):
+        if self._dirty and self.incremental:
+            self._save_incremental()
+            self._dirty = 0
+
+    def _save_incremental(self):
+        """
+        增量寫出後重新開檔：同一個 Document 再次增量存檔時，MuPDF 會覆寫上一次附加的區段，
+        重新開檔才能確保已送出的位元組不再改變
+        """
+        with stage("pdf_write"):
+            self.document.saveIncr()
+            self.document.close()
+            self.document = open_pdf(self.path, self._password)
+
+    def finish(self):
+        """
+        移除未選取的頁面並寫出剩餘的變更
+        """
+        if self.pages is not None and len(self.pages) < self.document.page_count:
+            self.document.select([p - 1 for p in self.pages])
+            self._dirty += 1
+        if self.incremental:
+            if self._dirty:
+                self._save_incremental()
+        else:
+            with stage("pdf_write"):
+                tmp_path = self.path + ".tmp"
+                self.document.save(tmp_path, garbage=3, deflate=True)
+                self.document.close()
+                os.replace(tmp_path, self.path)
+        self._dirty = 0
+        self._finished = True
+
+    def read_available(self) -> Iterator[bytes]:
+        """
+        yield 已寫入檔案、尚未送出的位元組；無法增量更新時只在 finish 之後才有內容
+        """
+        if not self.incremental and not self._finished:
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self._sent)
+            while True:
+                chunk = f.read(_CHUNK_SIZE)
+                if not chunk:
+                    break
+                self._sent += len(chunk)
+                yield chunk
+
+    def close(self):
+        if not self.document.is_closed:
+            self.document.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,542 @@
+import os
+import atexit
+import itertools
+import logging
+import queue
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+from typing import Callable, Generator, List, Optional, Tuple, Union
+
+from PIL import Image
+
+from app.backend import MODEL_ID, ImageInput, OCRBackend, _BACKENDS
+from app.metrics import Gauge, register, stage
+from app.resolution import MODES, ResolutionMode
+
+# 模型 worker 使用的裝置，以逗號分隔的 GPU 編號或 cpu（例如 "0,1,2,3"、"cpu"）；
+# worker 數多於裝置數時輪流分配。未設定時沿用 CUDA_VISIBLE_DEVICES，或偵測到的全部 GPU
+WORKER_DEVICES = os.getenv("OCR_WORKER_DEVICES")
+# CPU worker 的執行緒數（0 代表平分目前可用的 CPU），並各自綁定不重疊的 CPU 核心
+WORKER_THREADS = int(os.getenv("OCR_WORKER_THREADS", "0"))
+# 等待 worker 載入模型的秒數
+WORKER_START_TIMEOUT = float(os.getenv("OCR_WORKER_START_TIMEOUT", "900"))
+
+# 可以直接以原始像素交給 worker 的圖片模式，其他模式先轉成 RGB
+_SHM_IMAGE_MODES = ("RGB", "L", "RGBA")
+
+logger = logging.getLogger(__name__)
+
+
+def _cuda_device_ids() -> List[str]:
+    try:
+        import torch
+    except ImportError:
+        return []
+    return [str(i) for i in range(torch.cuda.device_count())]
+
+
+def worker_devices(count: int, backend_name: str) -> List[str]:
+    """
+    決定每個 worker 的裝置；fake 後端一律使用 CPU
+    """
+    if WORKER_DEVICES:
+        devices = [d.strip().lower() for d in WORKER_DEVICES.split(",") if d.strip()]
+    elif backend_name == "fake":
+        devices = []
+    elif os.getenv("CUDA_VISIBLE_DEVICES") is not None:
+        devices = [d.strip() for d in os.environ["CUDA_VISIBLE_DEVICES"].split(",") if d.strip()]
+    else:
+        devices = _cuda_device_ids()
+    devices = devices or ["cpu"]
+    return [devices[i % len(devices)] for i in range(count)]
+
+
+def _cpu_slices(devices: List[str]) -> List[Tuple[int, List[int]]]:
+    """
+    將可用的 CPU 核心平分給 CPU worker，回傳每個 worker 的 (執行緒數, 綁定的核心)
+    """
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+    cpu_workers = [i for i, d in enumerate(devices) if d == "cpu"]
+    per_worker = WORKER_THREADS or max(1, len(cores) // max(1, len(cpu_workers)))
+    slices = [(0, [])] * len(devices)
+    for k, i in enumerate(cpu_workers):
+        assigned = cores[k * per_worker:(k + 1) * per_worker]
+        # 核心不夠分時不綁定，交給作業系統排程
+        slices[i] = (per_worker, assigned if len(assigned) == per_worker else [])
+    return slices
+
+
+def _worker_main(index: int, device: str, threads: int, cores: List[int], backend_name: str, conn):
+    """
+    worker 行程：在匯入 torch 之前設定可見裝置與執行緒數，載入模型後逐一處理請求
+    """
+    if device == "cpu":
+        os.environ["CUDA_VISIBLE_DEVICES"] = ""
+        if threads:
+            os.environ["OMP_NUM_THREADS"] = str(threads)
+            os.environ["MKL_NUM_THREADS"] = str(threads)
+        if cores and hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, cores)
+    else:
+        os.environ["CUDA_VISIBLE_DEVICES"] = device
+
+    backend = _BACKENDS[backend_name]()
+    if device == "cpu" and threads and hasattr(backend, "cpu_threads"):
+        # 每個 worker 只使用分配到的核心數，取代 OCR_CPU_THREADS
+        backend.cpu_threads = threads
+    try:
+        backend.load()
+    except Exception as e:
+        conn.send(("error", f"{type(e).__name__}: {e}"))
+        return
+    conn.send(("ready", {
+        "pid": os.getpid(),
+        "load_seconds": backend.load_seconds,
+        "warmup_seconds": backend.warmup_seconds,
+        "meta": backend.meta(),
+    }))
+
+    # 串流途中先讀到的後續請求，依序處理
+    backlog = deque()
+
+    def cancelled(request_id: int) -> bool:
+        """
+        串流途中檢查是否收到這個請求的取消訊息；其他訊息留到串流結束後處理，
+        取消的若是還在 backlog 中的請求，直接回覆已取消
+        """
+        while conn.poll():
+            message = conn.recv()
+            if message is None or message[0] != "cancel":
+                backlog.append(message)
+                continue
+            if message[1] == request_id:
+                return True
+            for queued in list(backlog):
+                if queued is not None and queued[0] == message[1]:
+                    backlog.remove(queued)
+                    conn.send((queued[0], [(False, _CANCELLED)]))
+        return False
+
+    while True:
+        if backlog:
+            message = backlog.popleft()
+        else:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                return
+        if message is None:
+            return
+        if message[0] == "cancel":
+            # 請求已經完成，取消訊息晚到
+            continue
+        request_id, items, stream = message
+        on_delta = (lambda delta: conn.send((request_id, delta))) if stream else None
+        conn.send((request_id, _worker_infer(backend, items, on_delta, lambda: cancelled(request_id))))
+
+
+_CANCELLED = "Exception: 串流已由呼叫端取消"
+
+
+def _worker_infer(
+    backend: OCRBackend,
+    items: list,
+    on_delta: Callable[[str], None] = None,
+    cancelled: Callable[[], bool] = None
+) -> list:
+    """
+    從共享記憶體取回圖片（不複製像素）並整批推論，回傳 [(成功與否, 文字或錯誤訊息)]；
+    有 on_delta 時（單張圖片）改用 infer_stream，生成中的文字逐段交給 on_delta，
+    每段之間以 cancelled 檢查呼叫端是否已關閉串流，是的話關閉產生器、停止生成
+    """
+    images, prompts, modes, blocks = [], [], [], []
+    try:
+        for spec, prompt, mode_name in items:
+            if spec[0] == "path":
+                images.append(spec[1])
+            else:
+                _, name, mode, size = spec
+                block = shared_memory.SharedMemory(name=name)
+                blocks.append(block)
+                images.append(Image.frombuffer(mode, size, block.buf, "raw", mode, 0, 1))
+            prompts.append(prompt)
+            modes.append(MODES.get(mode_name) if mode_name else None)
+        if on_delta is not None:
+            stream = backend.infer_stream(images[0], prompts[0], modes[0])
+            while True:
+                if cancelled is not None and cancelled():
+                    stream.close()
+                    return [(False, _CANCELLED)]
+                try:
+                    on_delta(next(stream))
+                except StopIteration as done:
+                    results = [done.value]
+                    break
+        else:
+            results = backend.infer_batch(images, prompts, modes)
+    except Exception as e:
+        results = [e] * len(items)
+    finally:
+        del images
+        for block in blocks:
+            try:
+                block.close()
+            except BufferError:
+                # 後端仍持有像素的參照；映射會在參照釋放後由 GC 回收
+                pass
+    return [
+        (False, f"{type(r).__name__}: {r}") if isinstance(r, Exception) else (True, r)
+        for r in results
+    ]
+
+
+class _Worker:
+    """
+    API 行程這端的 worker 代理：負責啟動行程、送出請求，並由讀取執行緒把結果交回 Future
+    """
+
+    def __init__(self, pool: "WorkerPoolBackend", index: int, device: str, threads: int, cores: List[int]):
+        self.pool = pool
+        self.index = index
+        self.device = device
+        self.threads = threads
+        self.cores = cores
+        self.process = None
+        self.conn = None
+        self.alive = False
+        self.info: dict = {}
+        self.inflight = 0
+        self.requests = 0
+        self.restarts = 0
+        self._pending = {}
+        # 串流請求：request_id -> 接收生成中文字的 callback
+        self._listeners = {}
+        self._send_lock = threading.Lock()
+        self._ids = itertools.count()
+
+    def start(self):
+        ctx = multiprocessing.get_context("spawn")
+        parent_conn, child_conn = ctx.Pipe()
+        process = ctx.Process(
+            target=_worker_main,
+            args=(self.index, self.device, self.threads, self.cores, self.pool.backend_name, child_conn),
+            name=f"ocr-worker-{self.index}",
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        try:
+            if not parent_conn.poll(WORKER_START_TIMEOUT):
+                raise Exception(f"worker {self.index} 在 {WORKER_START_TIMEOUT:.0f} 秒內未完成載入")
+            kind, payload = parent_conn.recv()
+            if kind != "ready":
+                raise Exception(f"worker {self.index} ({self.device}) 載入失敗: {payload}")
+        except EOFError:
+            process.join()
+            parent_conn.close()
+            raise Exception(f"worker {self.index} ({self.device}) 啟動時結束，exit code {process.exitcode}")
+        except Exception:
+            process.kill()
+            parent_conn.close()
+            raise
+
+        self.process, self.conn, self.info = process, parent_conn, payload
+        self.alive = True
+        threading.Thread(target=self._read_loop, name=f"ocr-worker-{self.index}-reader", daemon=True).start()
+        logger.info("模型 worker %d 已就緒 (device=%s, pid=%d)", self.index, self.device, payload["pid"])
+
+    def submit(
+        self, items: list, blocks: List[shared_memory.SharedMemory], on_delta: Callable[[str], None] = None
+    ) -> Tuple[int, Future]:
+        future: Future = Future()
+        request_id = next(self._ids)
+        self._pending[request_id] = (future, blocks, len(items))
+        if on_delta is not None:
+            self._listeners[request_id] = on_delta
+        try:
+            with self._send_lock:
+                self.conn.send((request_id, items, on_delta is not None))
+        except (OSError, ValueError) as e:
+            self._finish(request_id, Exception(f"無法送出請求給 worker {self.index}: {e}"))
+        return request_id, future
+
+    def cancel(self, request_id: int):
+        """
+        要求 worker 停止串流請求的生成；worker 停止後仍會回覆結果，屆時才釋放共享記憶體與處理中計數
+        """
+        self._listeners.pop(request_id, None)
+        if request_id not in self._pending or not self.alive:
+            return
+        try:
+            with self._send_lock:
+                self.conn.send(("cancel", request_id))
+        except (OSError, ValueError):
+            pass
+
+    def _read_loop(self):
+        conn = self.conn
+        while True:
+            try:
+                request_id, results = conn.recv()
+            except (EOFError, OSError):
+                break
+            if isinstance(results, str):
+                # 串流請求生成中的一段文字
+                listener = self._listeners.get(request_id)
+                if listener is not None:
+                    listener(results)
+                continue
+            self._finish(request_id, results)
+
+        self.alive = False
+        for request_id in list(self._pending):
+            self._finish(request_id, Exception(f"模型 worker {self.index} ({self.device}) 已結束"))
+        if not self.pool.closing:
+            self.process.join(5)
+            logger.error("模型 worker %d 異常結束 (exit code %s)，重新啟動", self.index, self.process.exitcode)
+            self._restart()
+
+    def _restart(self):
+        self.restarts += 1
+        try:
+            self.start()
+        except Exception as e:
+            logger.error("模型 worker %d 重新啟動失敗: %s", self.index, e)
+
+    def _finish(self, request_id: int, outcome: Union[list, Exception]):
+        entry = self._pending.pop(request_id, None)
+        self._listeners.pop(request_id, None)
+        if entry is None:
+            return
+        future, blocks, count = entry
+        for block in blocks:
+            block.close()
+            block.unlink()
+        with self.pool._route_lock:
+            self.inflight -= count
+        if isinstance(outcome, Exception):
+            future.set_exception(outcome)
+        else:
+            future.set_result([text if ok else Exception(text) for ok, text in outcome])
+
+    def stop(self, timeout: float = 10.0):
+        if self.process is None:
+            return
+        if self.alive:
+            try:
+                with self._send_lock:
+                    self.conn.send(None)
+            except (OSError, ValueError):
+                pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.kill()
+        self.alive = False
+
+    def stats(self) -> dict:
+        return {
+            "index": self.index,
+            "device": self.device,
+            "pid": self.info.get("pid"),
+            "warmup_seconds": self.info.get("warmup_seconds"),
+            "alive": self.alive,
+            "inflight": self.inflight,
+            "requests": self.requests,
+            "restarts": self.restarts,
+        }
+
+
+def _to_shared_memory(image: Image.Image) -> Tuple[tuple, shared_memory.SharedMemory]:
+    """
+    把圖片像素寫入新的共享記憶體區塊，worker 以區塊名稱直接映射，不經過 pickle 與管線複製
+    """
+    if image.mode not in _SHM_IMAGE_MODES:
+        image = image.convert("RGB")
+    data = image.tobytes()
+    block = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+    block.buf[:len(data)] = data
+    return ("shm", block.name, image.mode, image.size), block
+
+
+class WorkerPoolBackend(OCRBackend):
+    """
+    多個模型 worker 行程（每張 GPU 或每段 CPU 一個副本），請求送往處理中圖片最少的 worker
+
+    推論結果與單一行程的同名後端相同，因此快取鍵沿用該後端的參數。
+    """
+
+    name = "pool"
+
+    def __init__(self, backend_name: str, count: int):
+        super().__init__()
+        self.backend_name = backend_name
+        self.batched_generate = _BACKENDS[backend_name].batched_generate
+        # 只在 API 行程中用來計算 token 數與快取參數，不載入權重
+        self._local = _BACKENDS[backend_name]()
+        devices = worker_devices(count, backend_name)
+        self.workers = [
+            _Worker(self, i, device, threads, cores)
+            for i, (device, (threads, cores)) in enumerate(zip(devices, _cpu_slices(devices)))
+        ]
+        self.closing = False
+        self._route_lock = threading.Lock()
+        self._round_robin = itertools.count()
+        # 在 multiprocessing 結束 daemon 行程之前先停止 worker，避免讀取執行緒把它們當成異常結束而重新啟動
+        atexit.register(self.close)
+        global _pool
+        _pool = self
+
+    @property
+    def device(self) -> str:
+        return ",".join("cpu" if w.device == "cpu" else f"cuda:{w.device}" for w in self.workers)
+
+    def _load(self):
+        self._local.load_tokenizer()
+        errors = []
+
+        def start(worker: _Worker):
+            try:
+                worker.start()
+            except Exception as e:
+                errors.append(e)
+
+        # 同時啟動所有 worker，載入時間取決於最慢的一個
+        threads = [threading.Thread(target=start, args=(w,), daemon=True) for w in self.workers]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        if errors:
+            self.close()
+            raise errors[0]
+
+    def _pick(self, count: int) -> _Worker:
+        with self._route_lock:
+            alive = [w for w in self.workers if w.alive]
+            if not alive:
+                raise Exception("沒有可用的模型 worker")
+            # 處理中最少者優先，平手時輪流
+            start = next(self._round_robin) % len(alive)
+            worker = min(alive[start:] + alive[:start], key=lambda w: w.inflight)
+            worker.inflight += count
+            worker.requests += count
+            return worker
+
+    def submit_batch(
+        self,
+        images: List[ImageInput],
+        prompts: List[str],
+        modes: Optional[List[Optional[ResolutionMode]]] = None,
+        on_delta: Callable[[str], None] = None
+    ) -> Future:
+        """
+        將一批圖片交給一個 worker，回傳完成時得到 [文字或例外] 的 Future（不阻塞呼叫端）
+        """
+        _, (_, future) = self._dispatch(images, prompts, modes)
+        return future
+
+    def _dispatch(
+        self,
+        images: List[ImageInput],
+        prompts: List[str],
+        modes: Optional[List[Optional[ResolutionMode]]] = None,
+        on_delta: Callable[[str], None] = None
+    ) -> Tuple[_Worker, Tuple[int, Future]]:
+        """
+        選一個 worker 送出請求，回傳 (worker, (request_id, Future))；
+        on_delta 只用於單張圖片，worker 生成中的文字會逐段從讀取執行緒交給它
+        """
+        self.load()
+        modes = modes or [None] * len(images)
+        items, blocks = [], []
+        try:
+            with stage("worker_handoff"):
+                for image, prompt, mode in zip(images, prompts, modes):
+                    if isinstance(image, str):
+                        spec = ("path", os.path.abspath(image))
+                    else:
+                        spec, block = _to_shared_memory(image)
+                        blocks.append(block)
+                    items.append((spec, prompt, mode.name if mode else None))
+            worker = self._pick(len(items))
+        except Exception:
+            for block in blocks:
+                block.close()
+                block.unlink()
+            raise
+        return worker, worker.submit(items, blocks, on_delta)
+
+    def infer(self, image: ImageInput, prompt: str, mode: Optional[ResolutionMode] = None) -> str:
+        result = self.submit_batch([image], [prompt], [mode]).result()[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def infer_stream(
+        self, image: ImageInput, prompt: str, mode: Optional[ResolutionMode] = None
+    ) -> Generator[str, None, str]:
+        deltas: "queue.Queue[Optional[str]]" = queue.Queue()
+        worker, (request_id, future) = self._dispatch([image], [prompt], [mode], on_delta=deltas.put)
+        future.add_done_callback(lambda _: deltas.put(None))
+        try:
+            while True:
+                delta = deltas.get()
+                if delta is None:
+                    break
+                yield delta
+        finally:
+            # 呼叫端中途關閉產生器（例如客戶端斷線）時通知 worker 停止生成，釋放它的推論名額
+            if not future.done():
+                worker.cancel(request_id)
+        result = future.result()[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def infer_batch(
+        self,
+        images: List[ImageInput],
+        prompts: List[str],
+        modes: Optional[List[Optional[ResolutionMode]]] = None
+    ) -> List[Union[str, Exception]]:
+        try:
+            return self.submit_batch(images, prompts, modes).result()
+        except Exception as e:
+            return [e] * len(images)
+
+    def count_tokens(self, text: str) -> int:
+        return self._local.count_tokens(text)
+
+    def infer_params(self, mode: Optional[ResolutionMode] = None) -> dict:
+        return self._local.infer_params(mode)
+
+    def meta(self) -> dict:
+        worker_meta = next((w.info["meta"] for w in self.workers if w.info), {})
+        return {
+            "device": self.device,
+            "model_id": MODEL_ID,
+            "torch": worker_meta.get("torch"),
+            "backend": f"{self.name}:{self.backend_name}",
+            "precision": worker_meta.get("precision"),
+        }
+
+    def stats(self) -> dict:
+        return {"workers": [w.stats() for w in self.workers]}
+
+    def close(self):
+        self.closing = True
+        for worker in self.workers:
+            worker.stop()
+
+
+_pool: Optional[WorkerPoolBackend] = None
+
+register(Gauge(
+    "ocr_worker_inflight",
+    "Images dispatched to each model worker process and not yet finished",
+    lambda: {(str(w.index),): w.inflight for w in _pool.workers} if _pool else {},
+    labelnames=("worker",),
+))
@@ -0,0 +1,163 @@
+import os
+import io
+import sys
+import json
+import time
+import platform
+import resource
+import subprocess
+from pathlib import Path
+from typing import Callable, List, Optional
+
+# 基準測試一律使用不需要權重的 fake 後端，並停用結果快取，避免重複輸入直接命中快取
+os.environ.setdefault("OCR_BACKEND", "fake")
+os.environ.setdefault("OCR_CACHE_MAX_ENTRIES", "0")
+os.environ.setdefault("OCR_LOG_LEVEL", "WARNING")
+
+# 讓 `python benchmarks/xxx.py` 與 `python -m benchmarks.xxx` 都能匯入 app
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+RESULTS_DIR = ROOT / "benchmarks" / "results"
+
+SAMPLE_TEXT = (
+    "DeepSeek OCR benchmark page. The quick brown fox jumps over the lazy dog. "
+    "發票號碼 AB-12345678 金額 NT$ 1,234 元。"
+)
+
+
+def percentile(values: List[float], p: float) -> float:
+    """
+    線性內插的百分位數（p 介於 0 到 100）
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * p / 100.0
+    lower = int(k)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (k - lower)
+
+
+def summarize_ms(samples: List[float]) -> dict:
+    """
+    將秒數樣本整理成毫秒統計
+    """
+    ms = [s * 1000.0 for s in samples]
+    return {
+        "n": len(ms),
+        "mean_ms": round(sum(ms) / len(ms), 3) if ms else 0.0,
+        "min_ms": round(min(ms), 3) if ms else 0.0,
+        "p50_ms": round(percentile(ms, 50), 3),
+        "p95_ms": round(percentile(ms, 95), 3),
+        "p99_ms": round(percentile(ms, 99), 3),
+        "max_ms": round(max(ms), 3) if ms else 0.0,
+    }
+
+
+def measure(fn: Callable[[], object], repeat: int = 5, warmup: int = 1) -> dict:
+    """
+    重複執行 fn 並回傳耗時統計（先執行 warmup 次不計入）
+    """
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    return summarize_ms(samples)
+
+
+def peak_rss_mb() -> float:
+    """
+    目前行程（含已結束的子行程中最大者）的最高常駐記憶體
+    """
+    usage = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    # Linux 單位為 KB，macOS 為 bytes
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return round(usage / divisor, 1)
+
+
+def make_pdf(path: Path, pages: int, with_image: bool = True) -> Path:
+    """
+    產生測試用 PDF：每頁有多行文字，並可嵌入一張點陣圖（模擬掃描內容）
+    """
+    import fitz
+    from PIL import Image, ImageDraw
+
+    image_bytes = None
+    if with_image:
+        img = Image.new("RGB", (800, 400), "white")
+        draw = ImageDraw.Draw(img)
+        for y in range(0, 400, 20):
+            draw.text((10, y), SAMPLE_TEXT[:60], fill="black")
+        buffer = io.BytesIO()
+        img.save(buffer, format="PNG")
+        image_bytes = buffer.getvalue()
+
+    document = fitz.open()
+    for page_no in range(pages):
+        page = document.new_page(width=595, height=842)  # A4
+        for line in range(30):
+            page.insert_text((50, 60 + line * 16), f"{page_no + 1}-{line + 1} {SAMPLE_TEXT[:70]}", fontsize=9)
+        if image_bytes:
+            page.insert_image(fitz.Rect(50, 560, 545, 800), stream=image_bytes)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    document.save(str(path))
+    document.close()
+    return path
+
+
+def make_image_bytes(width: int, height: int, fmt: str = "PNG", seed: int = 0) -> bytes:
+    """
+    產生帶有文字的測試圖片；seed 不同時像素內容不同
+    """
+    from PIL import Image, ImageDraw
+
+    img = Image.new("RGB", (width, height), (255, 255 - seed % 32, 255))
+    draw = ImageDraw.Draw(img)
+    for y in range(0, height, 18):
+        draw.text((8, y), f"{seed} {SAMPLE_TEXT[:50]}", fill="black")
+    buffer = io.BytesIO()
+    img.save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+def environment() -> dict:
+    """
+    紀錄執行環境，方便比較不同時間、不同機器的結果
+    """
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "env": {k: v for k, v in sorted(os.environ.items()) if k.startswith("OCR_")},
+    }
+
+
+def write_results(suite: str, results: dict, output: Optional[str] = None) -> Path:
+    """
+    將結果寫成 JSON；未指定 output 時存到 benchmarks/results/<suite>-<時間>.json
+    """
+    if output:
+        path = Path(output)
+    else:
+        path = RESULTS_DIR / f"{suite}-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    payload = {"suite": suite, "environment": environment(), "results": results}
+    with path.open("w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+    return path
@@ -0,0 +1,59 @@
+"""
+比較兩次基準測試結果（同一個 suite 的 JSON）
+
+    python -m benchmarks.compare benchmarks/results/micro-old.json benchmarks/results/micro-new.json
+"""
+import argparse
+import json
+
+# 比較這些欄位；越小越好的延遲與越大越好的吞吐量
+LOWER_IS_BETTER = ("p50_ms", "p95_ms", "p99_ms", "peak_rss_mb")
+HIGHER_IS_BETTER = ("throughput_rps", "pages_per_second")
+
+
+def _flatten(results: dict, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_flatten(value, name + "/"))
+        elif isinstance(value, (int, float)) and key in LOWER_IS_BETTER + HIGHER_IS_BETTER:
+            flat[name] = value
+    return flat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=5.0, help="標記為變快／變慢的變化百分比")
+    args = parser.parse_args()
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.candidate, encoding="utf-8") as f:
+        candidate = json.load(f)
+    if baseline.get("suite") != candidate.get("suite"):
+        parser.error(f"suite 不同: {baseline.get('suite')} vs {candidate.get('suite')}")
+
+    old = _flatten(baseline["results"])
+    new = _flatten(candidate["results"])
+    print(f"baseline : {baseline['environment'].get('git_commit')} {baseline['environment'].get('timestamp')}")
+    print(f"candidate: {candidate['environment'].get('git_commit')} {candidate['environment'].get('timestamp')}\n")
+
+    for name in sorted(old.keys() & new.keys()):
+        before, after = old[name], new[name]
+        if not before:
+            continue
+        change = (after - before) / before * 100.0
+        better = change < 0 if name.rsplit("/", 1)[-1] in LOWER_IS_BETTER else change > 0
+        mark = ""
+        if abs(change) >= args.threshold:
+            mark = "faster" if better else "SLOWER"
+            if name.endswith("peak_rss_mb"):
+                mark = "smaller" if better else "LARGER"
+        print(f"{name:<64} {before:>12.3f} -> {after:>12.3f}  {change:+7.1f}%  {mark}")
+
+
+if __name__ == "__main__":
+    main()
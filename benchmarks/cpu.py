@@ -0,0 +1,121 @@
+"""
+CPU 推論精度比較：以真實 DeepSeek-OCR 權重分別用 fp32、int8、bf16 載入，
+量測載入與暖機時間、每張圖片的推論延遲、最高 RSS，以及輸出與 fp32 的相似度。
+每種精度在獨立的子行程中執行，RSS 互不影響（需要 torch、transformers 與模型權重）
+
+    python -m benchmarks.cpu                                   # fp32,int8,bf16
+    python -m benchmarks.cpu --precisions fp32,int8 --images 5 --threads 8 --mode base
+    python -m benchmarks.compare benchmarks/results/cpu-A.json benchmarks/results/cpu-B.json
+"""
+import os
+
+# 這個 suite 量測真實模型，並強制只用 CPU（需在匯入 benchmarks.common 之前設定）
+os.environ["OCR_BACKEND"] = "deepseek"
+os.environ["CUDA_VISIBLE_DEVICES"] = ""
+
+import argparse
+import difflib
+import json
+import subprocess
+import sys
+
+from benchmarks.common import ROOT, make_image_bytes, measure, peak_rss_mb, write_results
+
+_RESULT_PREFIX = "BENCH_RESULT "
+
+
+def run_child(args):
+    """
+    子行程：以環境變數指定的精度載入模型並量測
+    """
+    from app.backend import get_backend
+    from app.ocr import _clean_model_output, load_image_bytes
+    from app.resolution import MODES
+
+    backend = get_backend().load()
+    mode = MODES[args.mode]
+    prompt = "<image>\nFree OCR."
+    images = [load_image_bytes(make_image_bytes(1240, 1754, seed=i)) for i in range(args.images)]
+
+    outputs = []
+    state = {"i": 0}
+
+    def infer():
+        image = images[state["i"] % len(images)]
+        state["i"] += 1
+        outputs.append(_clean_model_output(backend.infer(image, prompt, mode)))
+
+    # 模型已在 load 時暖機，這裡不再另外 warmup
+    stats = measure(infer, repeat=args.images * args.repeat, warmup=0)
+    meta = backend.meta()
+    result = {
+        "precision": meta["precision"],
+        "cpu_threads": meta.get("cpu_threads"),
+        "load_seconds": backend.load_seconds,
+        "warmup_seconds": backend.warmup_seconds,
+        "infer": stats,
+        "peak_rss_mb": peak_rss_mb(),
+        "outputs": outputs[:args.images],
+    }
+    print(_RESULT_PREFIX + json.dumps(result, ensure_ascii=False), flush=True)
+
+
+def run_precision(precision: str, args) -> dict:
+    env = {**os.environ, "OCR_CPU_PRECISION": precision}
+    if args.threads:
+        env["OCR_CPU_THREADS"] = str(args.threads)
+    command = [
+        sys.executable, "-m", "benchmarks.cpu", "--child",
+        "--images", str(args.images), "--repeat", str(args.repeat), "--mode", args.mode,
+    ]
+    proc = subprocess.run(command, cwd=ROOT, env=env, capture_output=True, text=True)
+    for line in reversed(proc.stdout.splitlines()):
+        if line.startswith(_RESULT_PREFIX):
+            return json.loads(line[len(_RESULT_PREFIX):])
+    raise RuntimeError(f"{precision} 失敗 (exit code {proc.returncode}):\n{proc.stderr[-2000:]}")
+
+
+def similarity(a: list, b: list) -> float:
+    ratios = [difflib.SequenceMatcher(None, x, y).ratio() for x, y in zip(a, b)]
+    return round(sum(ratios) / len(ratios), 4) if ratios else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--precisions", default="fp32,int8,bf16", help="要比較的精度，以逗號分隔")
+    parser.add_argument("--images", type=int, default=3, help="不同測試圖片數")
+    parser.add_argument("--repeat", type=int, default=1, help="每張圖片推論次數")
+    parser.add_argument("--mode", default="base", help="解析度模式")
+    parser.add_argument("--threads", type=int, default=0, help="OCR_CPU_THREADS（0 為 torch 預設）")
+    parser.add_argument("--output", help="結果 JSON 路徑（預設 benchmarks/results/cpu-<時間>.json）")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+        return
+
+    results = {}
+    for precision in [p.strip() for p in args.precisions.split(",") if p.strip()]:
+        print(f"running {precision} ...", flush=True)
+        try:
+            results[precision] = run_precision(precision, args)
+        except RuntimeError as e:
+            print(e)
+
+    # 以 fp32 的輸出為基準，檢查量化後的文字是否仍一致
+    outputs = {precision: result.pop("outputs") for precision, result in results.items()}
+    for precision, result in results.items():
+        if "fp32" in outputs:
+            result["similarity_to_fp32"] = similarity(outputs["fp32"], outputs[precision])
+        infer = result["infer"]
+        print(
+            f"  {precision:<5} load {result['load_seconds']:>7.1f} s   warmup {result['warmup_seconds'] or 0:>6.1f} s   "
+            f"p50 {infer['p50_ms']:>10.1f} ms   p95 {infer['p95_ms']:>10.1f} ms   "
+            f"RSS {result['peak_rss_mb']:>8.1f} MB   similarity {result.get('similarity_to_fp32', '-')}"
+        )
+    print(f"saved: {write_results('cpu', results, args.output)}")
+
+
+if __name__ == "__main__":
+    main()
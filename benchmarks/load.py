@@ -0,0 +1,156 @@
+"""
+端對端負載產生器：以固定並行數對 /ocr/upload 與 /ocr/pdf 送出請求，
+回報 p50/p95/p99 延遲、吞吐量與最高 RSS
+
+    # 行程內直接驅動 app（fake 後端，不需要 GPU 與權重）
+    python -m benchmarks.load --concurrency 8 --requests 200
+
+    # 對已啟動的服務施壓（RSS 只包含負載產生器本身）
+    python -m benchmarks.load --url http://localhost:8003 --scenarios upload --duration 30
+"""
+import argparse
+import asyncio
+import itertools
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+from benchmarks.common import make_image_bytes, make_pdf, peak_rss_mb, summarize_ms, write_results
+
+import httpx
+
+
+async def run_scenario(client: httpx.AsyncClient, send, concurrency: int, total: int, duration: float) -> dict:
+    """
+    以 concurrency 個 worker 持續送出請求，直到送滿 total 個或超過 duration 秒
+    """
+    latencies = []
+    statuses = Counter()
+    errors = Counter()
+    ticket = itertools.count()
+    deadline = time.perf_counter() + duration if duration else None
+
+    async def worker():
+        while True:
+            i = next(ticket)
+            if total and i >= total:
+                return
+            if deadline and time.perf_counter() >= deadline:
+                return
+            t0 = time.perf_counter()
+            try:
+                response = await send(client, i)
+            except Exception as e:
+                errors[type(e).__name__] += 1
+                continue
+            statuses[response.status_code] += 1
+            if response.status_code == 200:
+                latencies.append(time.perf_counter() - t0)
+
+    t_start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - t_start
+
+    return {
+        "concurrency": concurrency,
+        "wall_seconds": round(wall, 3),
+        "ok": len(latencies),
+        "throughput_rps": round(len(latencies) / wall, 3) if wall else 0.0,
+        "latency": summarize_ms(latencies),
+        "status_codes": {str(k): v for k, v in sorted(statuses.items())},
+        "errors": dict(errors),
+    }
+
+
+def upload_sender(images):
+    async def send(client: httpx.AsyncClient, i: int):
+        data = images[i % len(images)]
+        return await client.post("/ocr/upload", files={"file": (f"bench_{i}.png", data, "image/png")})
+    return send
+
+
+def pdf_sender(pdf_bytes: bytes, stream: bool):
+    async def send(client: httpx.AsyncClient, i: int):
+        data = {"stream": "ndjson"} if stream else {}
+        return await client.post("/ocr/pdf", files={"file": (f"bench_{i}.pdf", pdf_bytes, "application/pdf")}, data=data)
+    return send
+
+
+async def run(args) -> dict:
+    if args.url:
+        transport = None
+        base_url = args.url
+    else:
+        # 行程內執行：與 app 共用事件迴圈，量到的是服務端處理延遲而非網路延遲
+        from app.main import app
+        transport = httpx.ASGITransport(app=app)
+        base_url = "http://bench"
+
+    with tempfile.TemporaryDirectory(prefix="ocr_bench_") as workdir:
+        pdf_bytes = make_pdf(Path(workdir) / "load.pdf", args.pdf_pages).read_bytes()
+    # 每個請求使用不同像素內容的圖片，避免量到快取
+    images = [make_image_bytes(args.image_width, args.image_height, "PNG", seed=i) for i in range(64)]
+
+    scenarios = {
+        "upload": upload_sender(images),
+        "pdf": pdf_sender(pdf_bytes, stream=False),
+        "pdf_stream": pdf_sender(pdf_bytes, stream=True),
+    }
+
+    results = {}
+    timeout = httpx.Timeout(args.timeout)
+    async with httpx.AsyncClient(transport=transport, base_url=base_url, timeout=timeout) as client:
+        for name in args.scenarios.split(","):
+            name = name.strip()
+            if name not in scenarios:
+                raise SystemExit(f"unknown scenario: {name} (choose from {', '.join(scenarios)})")
+            # 暖機：載入模型與渲染行程池
+            await scenarios[name](client, 0)
+            result = await run_scenario(client, scenarios[name], args.concurrency, args.requests, args.duration)
+            if name.startswith("pdf"):
+                result["pages_per_second"] = round(result["throughput_rps"] * args.pdf_pages, 3)
+            results[name] = result
+            latency = result["latency"]
+            print(
+                f"[{name}] {result['ok']} ok in {result['wall_seconds']}s  "
+                f"{result['throughput_rps']} req/s  "
+                f"p50 {latency['p50_ms']} ms  p95 {latency['p95_ms']} ms  p99 {latency['p99_ms']} ms  "
+                f"status {result['status_codes']}"
+            )
+
+    results["config"] = {
+        "url": args.url,
+        "concurrency": args.concurrency,
+        "requests": args.requests,
+        "duration": args.duration,
+        "pdf_pages": args.pdf_pages,
+        "image_size": [args.image_width, args.image_height],
+    }
+    results["peak_rss_mb"] = peak_rss_mb()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="服務位址；未指定時在行程內直接驅動 app")
+    parser.add_argument("--scenarios", default="upload,pdf", help="upload、pdf、pdf_stream，以逗號分隔")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=100, help="每個情境的請求數（0 代表只看 --duration）")
+    parser.add_argument("--duration", type=float, default=0, help="每個情境最長秒數（0 代表不限）")
+    parser.add_argument("--pdf-pages", type=int, default=5)
+    parser.add_argument("--image-width", type=int, default=800)
+    parser.add_argument("--image-height", type=int, default=600)
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--output", help="結果 JSON 路徑（預設 benchmarks/results/load-<時間>.json）")
+    args = parser.parse_args()
+    if not args.requests and not args.duration:
+        parser.error("--requests 與 --duration 至少需要一個")
+
+    results = asyncio.run(run(args))
+    print(f"peak RSS: {results['peak_rss_mb']} MB")
+    print(f"saved: {write_results('load', results, args.output)}")
+
+
+if __name__ == "__main__":
+    main()
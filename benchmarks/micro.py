@@ -0,0 +1,143 @@
+"""
+熱點路徑的微基準測試：PDF 渲染、圖片編碼／解碼、模型輸出解析
+
+    python -m benchmarks.micro                 # 全部
+    python -m benchmarks.micro --quick         # 較少的 DPI／頁數組合
+    python -m benchmarks.micro --only pdf,parse --output results.json
+"""
+import argparse
+import io
+import tempfile
+from pathlib import Path
+
+from benchmarks.common import (
+    SAMPLE_TEXT, make_image_bytes, make_pdf, measure, peak_rss_mb, write_results
+)
+
+from PIL import Image
+
+from app.ocr import (
+    OCRResult, PdfPages, _clean_model_output, image_from_pixmap, load_image_bytes,
+    open_pdf, pdf_to_images_high_quality, render_pdf_page_pixmap
+)
+from app.pipeline import PipelinedPdfPages, get_render_executor
+
+
+def bench_pdf(workdir: Path, repeat: int, quick: bool) -> dict:
+    """
+    PDF 逐頁渲染：不同 DPI、頁數、灰階與渲染行程池
+    """
+    results = {}
+    dpis = (144, 200) if quick else (72, 144, 200, 300)
+    page_counts = (1, 5) if quick else (1, 10, 30)
+
+    for pages in page_counts:
+        pdf_path = str(make_pdf(workdir / f"bench_{pages}p.pdf", pages))
+        for dpi in dpis:
+            def render(dpi=dpi, grayscale=False):
+                with PdfPages(pdf_path, dpi=dpi, grayscale=grayscale) as pdf_pages:
+                    for _, img in pdf_pages:
+                        img.size
+
+            stats = measure(render, repeat=repeat)
+            stats["ms_per_page"] = round(stats["p50_ms"] / pages, 3)
+            results[f"render/pages={pages}/dpi={dpi}"] = stats
+
+            gray = measure(lambda dpi=dpi: render(dpi, grayscale=True), repeat=repeat)
+            gray["ms_per_page"] = round(gray["p50_ms"] / pages, 3)
+            results[f"render_gray/pages={pages}/dpi={dpi}"] = gray
+
+        # 舊介面：一次把所有頁面載入記憶體
+        results[f"pdf_to_images_high_quality/pages={pages}/dpi=200"] = measure(
+            lambda: pdf_to_images_high_quality(pdf_path, dpi=200), repeat=repeat
+        )
+
+        executor = get_render_executor()
+        if executor is not None:
+            def render_pipelined():
+                with PipelinedPdfPages(PdfPages(pdf_path, dpi=200), executor) as pdf_pages:
+                    for _, img in pdf_pages:
+                        img.size
+
+            results[f"render_pipelined/pages={pages}/dpi=200"] = measure(render_pipelined, repeat=repeat)
+    return results
+
+
+def bench_image(workdir: Path, repeat: int, quick: bool) -> dict:
+    """
+    圖片路徑：上傳圖片解碼、頁面像素轉 PIL、交給模型前的暫存編碼
+    """
+    results = {}
+    sizes = ((800, 600), (1654, 2339)) if quick else ((400, 300), (800, 600), (1654, 2339), (2480, 3508))
+
+    for width, height in sizes:
+        label = f"{width}x{height}"
+        for fmt in ("PNG", "JPEG"):
+            data = make_image_bytes(width, height, fmt)
+            results[f"decode/{fmt.lower()}/{label}"] = measure(lambda data=data: load_image_bytes(data), repeat=repeat)
+
+        img = Image.open(io.BytesIO(make_image_bytes(width, height))).convert("RGB")
+        for fmt, options in (("BMP", {}), ("PNG", {}), ("JPEG", {"quality": 95})):
+            def encode(fmt=fmt, options=options):
+                buffer = io.BytesIO()
+                img.save(buffer, format=fmt, **options)
+            results[f"encode/{fmt.lower()}/{label}"] = measure(encode, repeat=repeat)
+
+    pdf_path = str(make_pdf(workdir / "bench_raw.pdf", 1))
+    document = open_pdf(pdf_path)
+    try:
+        pixmap = render_pdf_page_pixmap(document[0], 200)
+        gray = render_pdf_page_pixmap(document[0], 200, grayscale=True)
+    finally:
+        document.close()
+    results["image_from_pixmap/dpi=200"] = measure(lambda: image_from_pixmap(pixmap).load(), repeat=repeat * 4)
+    results["image_from_pixmap/gray/dpi=200"] = measure(lambda: image_from_pixmap(gray).load(), repeat=repeat * 4)
+    return results
+
+
+def bench_parse(repeat: int, quick: bool) -> dict:
+    """
+    模型輸出整理：移除 grounding 標記並切行
+    """
+    results = {}
+    line = "<|ref|>text<|/ref|><|det|>[[12, 34, 560, 78]]<|/det|>\n" + SAMPLE_TEXT + "\n"
+    for lines in ((10, 200) if quick else (10, 200, 2000)):
+        raw = line * lines
+        results[f"clean_model_output/lines={lines}"] = measure(lambda raw=raw: _clean_model_output(raw), repeat=repeat * 4)
+        text = _clean_model_output(raw)
+        results[f"ocr_result_from_text/lines={lines}"] = measure(lambda text=text: OCRResult.from_text(text), repeat=repeat * 4)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="每個項目重複次數")
+    parser.add_argument("--quick", action="store_true", help="只跑較少的組合")
+    parser.add_argument("--only", default="pdf,image,parse", help="要執行的群組，以逗號分隔")
+    parser.add_argument("--output", help="結果 JSON 路徑（預設 benchmarks/results/micro-<時間>.json）")
+    args = parser.parse_args()
+
+    groups = {g.strip() for g in args.only.split(",") if g.strip()}
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="ocr_bench_") as workdir:
+        workdir = Path(workdir)
+        if "pdf" in groups:
+            results["pdf"] = bench_pdf(workdir, args.repeat, args.quick)
+        if "image" in groups:
+            results["image"] = bench_image(workdir, args.repeat, args.quick)
+        if "parse" in groups:
+            results["parse"] = bench_parse(args.repeat, args.quick)
+    results["peak_rss_mb"] = peak_rss_mb()
+
+    for group, items in results.items():
+        if not isinstance(items, dict):
+            continue
+        print(f"\n[{group}]")
+        for name, stats in items.items():
+            print(f"  {name:<48} p50 {stats['p50_ms']:>10.3f} ms   p95 {stats['p95_ms']:>10.3f} ms")
+    print(f"\npeak RSS: {results['peak_rss_mb']} MB")
+    print(f"saved: {write_results('micro', results, args.output)}")
+
+
+if __name__ == "__main__":
+    main()